@@ -1,9 +1,9 @@
 import frappe
-import requests
 import json
 from frappe.utils import add_months, today
 from frappe.auth import LoginManager
 from frappe import _
+from whatsapp_saas.api import eventlog, gateway, routes
 
 @frappe.whitelist(allow_guest=False)
 def proxy(**kwargs):
@@ -63,109 +63,17 @@ def proxy(**kwargs):
         if not instance_id or not endpoint:
             frappe.throw(_("Missing instance_id or endpoint"))
             
-        # 1. Verification
-        customer_name = frappe.db.get_value("WhatsApp Customer", {"user": user}, "name")
-        if not customer_name:
-            frappe.throw(_("No WhatsApp Customer account linked to this user"))
-            
-        instance = frappe.get_doc("WhatsApp Instance", {"instance_id": instance_id})
-        if not instance:
-             frappe.throw(_("Instance not found"))
-             
-        if instance.whatsapp_customer != customer_name:
-            frappe.throw(_("Unauthorized access to this instance"))
-            
-        subscription = frappe.get_doc("WhatsApp Subscription", instance.subscription)
-        if subscription.status != 'Active':
-            frappe.throw(_("Subscription is not active"))
-            
-        # 2. Rate Limiting
-        plan = frappe.get_doc("WhatsApp Plan", subscription.plan)
-        max_messages = plan.max_messages_per_month
-        
-        from frappe.utils import get_first_day, get_last_day, today
-        current_usage = frappe.db.count("WhatsApp Message Log", {
-            "subscription": subscription.name,
-            "creation": ["between", [get_first_day(today()), get_last_day(today())]]
-        })
-        
-        if current_usage >= max_messages:
-            frappe.throw(_("Monthly message limit reached"))
-            
-        # 3. Forward to Baileys
-        # Clean endpoint
-        endpoint = endpoint.lstrip('/')
-        baileys_url = f"http://whatsapp-baileys:3000/api/instance/{instance_id}/{endpoint}"
-        
-        headers = {}
-        files = None
-        
-        if frappe.request.files:
-            files = {}
-            for key, file_storage in frappe.request.files.items():
-                files[key] = (file_storage.filename, file_storage.stream, file_storage.content_type)
-        
-        req_params = None
-        req_json = None
-        req_data_body = None
-        
-        if method == 'GET':
-            req_params = payload
-        else:
-            if files:
-                req_data_body = payload # fields alongside files
-            else:
-                req_json = payload
-
-        try:
-            response = requests.request(
-                method=method,
-                url=baileys_url,
-                params=req_params,
-                json=req_json,
-                data=req_data_body,
-                files=files,
-                headers=headers,
-                timeout=60
-            )
-        except Exception as conn_err:
-             frappe.throw(_(f"Connection to WhatsApp Service failed: {str(conn_err)}"))
-        
-        # 4. Logging
-        log_all = True 
-        if log_all or method in ['POST', 'PUT', 'DELETE']:
-            msg_id = None
-            try:
-                # Try to get Message ID from response
-                resp_json = response.json()
-                if isinstance(resp_json, dict):
-                    msg_id = resp_json.get('key', {}).get('id') or resp_json.get('id') or resp_json.get('messageId')
-            except:
-                pass
-            
-            if not msg_id:
-                 # Generate a tracking ID if none returned
-                 msg_id = "LOG-" + frappe.generate_hash(length=10)
-
-            doc = frappe.get_doc({
-                "doctype": "WhatsApp Message Log",
-                "instance": instance.name,
-                "message_id": msg_id,
-                "timestamp": frappe.utils.now(),
-                "status": "Sent" if response.ok else "Failed",
-                "direction": "Outbound",
-                "whatsapp_customer": customer_name,
-                "subscription": subscription.name
-            })
-            doc.insert(ignore_permissions=True)
-
-        try:
-            return response.json()
-        except:
-             return response.content
+        # 1. Verification (ownership and active subscription)
+        instance = gateway.authorize(instance_id)
+        
+        # 2. Forward to Baileys. Declared routes carry their own quota, logging and
+        # cache policy; anything else is counted and logged like a send.
+        path = f"instance/{instance_id}/{endpoint.lstrip('/')}"
+        route = routes.match(method, path) or routes.DEFAULT_ROUTE._replace(method=method)
+        return gateway.forward(route, path, instance, payload, files=gateway.request_files(), query=True)
 
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "WhatsApp Proxy Error")
+        eventlog.report_error("WhatsApp Proxy Error")
         return {"error": str(e), "traceback": frappe.get_traceback()}
 
 @frappe.whitelist(allow_guest=True)
@@ -243,35 +151,94 @@ def signup():
 @frappe.whitelist(allow_guest=True, methods=['POST'])
 def webhook():
     try:
-        frappe.log_error("WhatsApp Webhook Received",frappe.request.data)
+        eventlog.record_payload("webhook", frappe.request.data)
         data = {}
         if frappe.request.content_type == 'application/json':
             data = frappe.request.json
         else:
             data = frappe.request.form.to_dict()
+        eventlog.event("webhook.received", webhook_event=data.get("event"), instance_id=data.get("instanceId"))
         # Process webhook data as needed
         
         if frappe.db.exists("WhatsApp Instance",{"instance_id":data.get("instanceId")}):
             
             instance = frappe.get_doc("WhatsApp Instance",{"instance_id":data.get("instanceId")})
-            if data.get("event") == "connection.update":
+            if data.get("event") in ("connection.update", "qr"):
+                from whatsapp_saas.api import instance_state
                 webhook_data = data.get("data",{})
-                if webhook_data.get("status") == "connected":
-                    instance.status = "Connected"
-                    instance.phone_number = webhook_data.get("phoneNumber")
-                    instance.save(ignore_permissions=True)
-                    frappe.db.commit()
+                # Cached and pushed to the owner, so clients stop polling instance_qr/instance_status
+                if webhook_data.get("qr"):
+                    instance_state.update_qr(instance, webhook_data["qr"])
+                if webhook_data.get("status"):
+                    instance_state.update_status(instance, webhook_data["status"], webhook_data.get("phoneNumber"))
+
+            elif data.get("event") == "messages.upsert":
+                from whatsapp_saas.api.messages import store_messages
+                store_messages(instance.name, data.get("data", {}))
+                frappe.db.commit()
 
-                elif webhook_data.get("status") == "logged_out":
-                    
-                    instance.status = "Disconnected"
-                    instance.save(ignore_permissions=True)
-                    frappe.db.commit()
+            elif data.get("event") == "messages.update":
+                from whatsapp_saas.api.receipts import record_updates
+                record_updates(instance.name, data.get("data", {}))
+
+            # Push the event to the customer's webhooks instead of making them poll
+            from whatsapp_saas.api.webhooks import emit
+            emit(instance, data.get("event"), data.get("data", {}))
         else:
             frappe.throw(_("Instance not found"))
 
         return {"message": "Webhook processed successfully"}
     
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "WhatsApp Webhook Error")
-        return {"error": str(e), "traceback": frappe.get_traceback()}
\ No newline at end of file
+        eventlog.report_error("WhatsApp Webhook Error")
+        return {"error": str(e), "traceback": frappe.get_traceback()}
+
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def bulk_signup():
+    """
+    Provision many tenants in one call (System Manager only).
+    Small batches are created inline; larger ones (or background=1) run as a job.
+    API tokens are stored on each WhatsApp Customer, as with signup.
+    """
+    frappe.only_for("System Manager")
+    from whatsapp_saas.api import provisioning
+
+    if frappe.request.content_type == 'application/json':
+        data = frappe.request.json
+    else:
+        data = frappe.request.form.to_dict()
+
+    tenants = data.get("tenants")
+    if isinstance(tenants, str):
+        tenants = json.loads(tenants)
+    if not isinstance(tenants, list) or not tenants:
+        frappe.throw(_("tenants must be a non-empty list"))
+
+    if len(tenants) <= provisioning.SYNC_LIMIT and not frappe.utils.cint(data.get("background")):
+        results, errors = provisioning.provision(tenants)
+        return {
+            "message": "Provisioning complete",
+            "succeeded": len(results),
+            "failed": len(errors),
+            "provisioned": results,
+            "errors": errors,
+        }
+
+    job = provisioning.start_job(tenants)
+    return {"message": "Provisioning queued", "job": job.name}
+
+@frappe.whitelist(allow_guest=False)
+def bulk_signup_status(job):
+    frappe.only_for("System Manager")
+    from whatsapp_saas.api import provisioning
+
+    doc = frappe.get_doc(provisioning.JOB_DOCTYPE, job)
+    return {
+        "job": doc.name,
+        "status": doc.status,
+        "total_rows": doc.total_rows,
+        "succeeded": doc.succeeded,
+        "failed": doc.failed,
+        "provisioned": json.loads(doc.results or "[]"),
+        "errors": json.loads(doc.errors or "[]"),
+    }
@@ -0,0 +1,220 @@
+"""
+WhatsApp SaaS Baileys Client
+Every HTTP call to the Baileys service goes through here. Calls are admitted
+under an adaptive concurrency limit per Baileys node (AIMD on observed
+latency, shared across workers in Redis); when a node is saturated,
+low-priority calls are shed first.
+"""
+import hashlib
+import time
+
+import frappe
+import requests
+from frappe import _
+from frappe.utils import cint, flt
+
+DEFAULT_URL = "http://whatsapp-baileys:3000"
+
+# Route priorities; a call is shed once in-flight reaches this share of the limit
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+ADMIT_SHARE = {PRIORITY_LOW: 0.5, PRIORITY_NORMAL: 0.9, PRIORITY_HIGH: 1.0}
+
+INITIAL_LIMIT = 20
+MIN_LIMIT = 4
+MAX_LIMIT = 200
+# Latency above baseline * TOLERANCE counts as congestion
+TOLERANCE = 2.0
+BACKOFF = 0.9
+# Seconds between multiplicative decreases, so one slow burst cuts the limit once
+DECREASE_INTERVAL = 1
+# Seconds over which each route class's minimum latency is taken as its next baseline
+BASELINE_WINDOW = 60
+
+NODES_KEY = "whatsapp_saas:baileys_nodes"
+STATE_KEY = "whatsapp_saas:baileys:{0}:state"
+INFLIGHT_KEY = "whatsapp_saas:baileys:{0}:inflight"
+
+# KEYS: inflight zset, state hash. ARGV: token, now, lease expiry, admit share, initial limit, priority
+_ACQUIRE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit') or ARGV[5])
+if redis.call('ZCARD', KEYS[1]) >= limit * tonumber(ARGV[4]) then
+    redis.call('HINCRBY', KEYS[2], 'shed:' .. ARGV[6], 1)
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('HINCRBY', KEYS[2], 'admitted', 1)
+return 1
+"""
+
+# KEYS: inflight zset, state hash.
+# ARGV: token, now, latency (or -1 to skip), ok, initial, min, max, tolerance, backoff, interval,
+# route class, baseline window
+_RELEASE = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local latency = tonumber(ARGV[3])
+local ok = ARGV[4] == '1'
+if latency < 0 and ok then
+    return 1
+end
+local now = tonumber(ARGV[2])
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit') or ARGV[5])
+local congested = not ok
+
+if latency >= 0 then
+    -- Each route class keeps the minimum latency of the current window; the
+    -- previous window's minimum is its baseline, so one fast outlier or a slow
+    -- drift cannot move it for long
+    local class = ARGV[11]
+    local started = tonumber(redis.call('HGET', KEYS[2], 'window_start:' .. class) or '0')
+    local window_min = tonumber(redis.call('HGET', KEYS[2], 'window_min:' .. class) or '-1')
+    local baseline = tonumber(redis.call('HGET', KEYS[2], 'baseline:' .. class) or '-1')
+    if now - started >= tonumber(ARGV[12]) then
+        if window_min >= 0 then
+            baseline = window_min
+        end
+        started = now
+        window_min = latency
+    elseif window_min < 0 or latency < window_min then
+        window_min = latency
+    end
+    if baseline < 0 then
+        baseline = window_min
+    end
+    redis.call(
+        'HSET', KEYS[2],
+        'window_start:' .. class, started, 'window_min:' .. class, window_min,
+        'baseline:' .. class, baseline, 'latency', latency
+    )
+    congested = congested or latency > baseline * tonumber(ARGV[8])
+end
+
+if congested then
+    local last = tonumber(redis.call('HGET', KEYS[2], 'last_decrease') or '0')
+    if now - last >= tonumber(ARGV[10]) then
+        limit = math.max(tonumber(ARGV[6]), limit * tonumber(ARGV[9]))
+        redis.call('HSET', KEYS[2], 'last_decrease', now)
+    end
+else
+    limit = math.min(tonumber(ARGV[7]), limit + 1 / limit)
+end
+redis.call('HSET', KEYS[2], 'limit', limit)
+return 1
+"""
+
+_session = None
+_scripts = {}
+_known_nodes = set()
+
+
+class Overloaded(Exception):
+    """The Baileys node is at its concurrency limit for this priority"""
+
+
+def base_url():
+    """Baileys node for this site, overridable with `whatsapp_baileys_url` in site_config.json"""
+    return (frappe.conf.get("whatsapp_baileys_url") or DEFAULT_URL).rstrip("/")
+
+
+def request(method, path, timeout=60, priority=PRIORITY_NORMAL, sample_latency=True, route_class=None, **kwargs):
+    """
+    Send a request to `/api/<path>` on Baileys over a pooled keep-alive session.
+    Raises `Overloaded` when the node's adaptive limit has no room at `priority`.
+    Latency is compared against a baseline per `route_class` (the method by
+    default); `sample_latency=False` keeps slow-by-design calls (uploads,
+    downloads) out of the latency signal, and only 2xx responses are sampled.
+    """
+    node = base_url()
+    token = _acquire(node, priority, timeout)
+    started = time.monotonic()
+    ok = sampled = False
+    try:
+        url = f"{node}/api/{path.lstrip('/')}"
+        response = _get_session().request(method=method, url=url, timeout=timeout, **kwargs)
+        ok = response.status_code < 500
+        # Errors return early and would drag the baseline down
+        sampled = sample_latency and 200 <= response.status_code < 300
+        return response
+    finally:
+        latency = (time.monotonic() - started) * 1000 if sampled else -1
+        _release(node, token, latency, ok, route_class or method)
+
+
+def parse_response(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.content.decode('utf-8') if response.content else ""
+
+
+def get_metrics():
+    """Adaptive limit, in-flight calls, latency and shed counts for every node seen"""
+    metrics = {}
+    now = time.time()
+    for node in frappe.cache.smembers(NODES_KEY):
+        node = frappe.safe_decode(node)
+        key = _node_key(node)
+        # Written by the Lua scripts, so plain strings rather than pickled cache values
+        raw = frappe.cache.pipeline().hgetall(frappe.cache.make_key(STATE_KEY.format(key))).execute()[0]
+        state = {frappe.safe_decode(k): flt(frappe.safe_decode(v)) for k, v in raw.items()}
+        metrics[node] = {
+            "limit": round(state.get("limit", INITIAL_LIMIT), 2),
+            "in_flight": frappe.cache.zcount(frappe.cache.make_key(INFLIGHT_KEY.format(key)), now, "+inf"),
+            "latency_ms": round(state.get("latency", 0), 1),
+            "baseline_ms": {
+                name.split(":", 1)[1]: round(value, 1) for name, value in state.items() if name.startswith("baseline:")
+            },
+            "admitted": cint(state.get("admitted")),
+            "shed": {
+                name: cint(state.get(f"shed:{priority}"))
+                for name, priority in (("low", PRIORITY_LOW), ("normal", PRIORITY_NORMAL), ("high", PRIORITY_HIGH))
+            },
+        }
+    return metrics
+
+
+def _acquire(node, priority, timeout):
+    key = _node_key(node)
+    if (frappe.local.site, node) not in _known_nodes:
+        frappe.cache.sadd(NODES_KEY, node)
+        _known_nodes.add((frappe.local.site, node))
+    token = frappe.generate_hash(length=16)
+    now = time.time()
+    admitted = _script("acquire", _ACQUIRE)(
+        keys=[frappe.cache.make_key(INFLIGHT_KEY.format(key)), frappe.cache.make_key(STATE_KEY.format(key))],
+        args=[token, now, now + timeout + 5, ADMIT_SHARE.get(priority, 1.0), INITIAL_LIMIT, priority],
+    )
+    if not admitted:
+        raise Overloaded(_("WhatsApp service is busy, retry shortly"))
+    return token
+
+
+def _release(node, token, latency, ok, route_class):
+    key = _node_key(node)
+    _script("release", _RELEASE)(
+        keys=[frappe.cache.make_key(INFLIGHT_KEY.format(key)), frappe.cache.make_key(STATE_KEY.format(key))],
+        args=[
+            token, time.time(), latency, int(ok),
+            INITIAL_LIMIT, MIN_LIMIT, MAX_LIMIT, TOLERANCE, BACKOFF, DECREASE_INTERVAL,
+            route_class, BASELINE_WINDOW,
+        ],
+    )
+
+
+def _node_key(node):
+    return hashlib.sha1(node.encode()).hexdigest()[:10]
+
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache.register_script(source)
+    return _scripts[name]
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
@@ -0,0 +1,200 @@
+"""
+WhatsApp SaaS Columnar Export
+Incrementally copies WhatsApp Message Log into compressed Parquet files,
+partitioned by month and customer, so volume and failure-rate analysis runs
+on files instead of the production database. Needs the optional `pyarrow`
+dependency (`pip install whatsapp_saas[analytics]`).
+
+Rows are exported once, as they were when copied: a status that changes
+afterwards (a receipt arriving, a send failing) is not reflected in the files.
+Rows younger than SAFETY_LAG are left for a later run, so a transaction that
+commits after a newer row was exported is not skipped by the watermark.
+"""
+import hashlib
+import os
+from datetime import datetime
+
+import frappe
+from frappe import _
+from frappe.utils import add_to_date, cint, get_datetime, now_datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPORT_DIR = ("private", "files", "whatsapp_analytics", "message_log")
+# "<creation>|<name>" of the last exported row, kept with the files it describes.
+# Underscore-prefixed names are skipped by dataset readers.
+WATERMARK_FILE = "_watermark"
+BATCH_SIZE = 50000
+# Seconds a row must have existed before export; longer than any insert transaction
+SAFETY_LAG = 10 * 60
+MAX_BATCHES_PER_RUN = 40
+
+COLUMNS = [
+    "name", "creation", "timestamp", "instance", "whatsapp_customer", "subscription",
+    "direction", "status", "billable", "endpoint", "message_id",
+]
+
+
+def _schema():
+    return pa.schema([
+        ("name", pa.string()),
+        ("creation", pa.timestamp("us")),
+        ("timestamp", pa.timestamp("us")),
+        ("instance", pa.string()),
+        ("whatsapp_customer", pa.string()),
+        ("subscription", pa.string()),
+        ("direction", pa.string()),
+        ("status", pa.string()),
+        ("billable", pa.int8()),
+        ("endpoint", pa.string()),
+        ("message_id", pa.string()),
+    ])
+
+
+def is_available():
+    return pa is not None
+
+
+def export_message_logs():
+    """Scheduler: append log rows created since the watermark to the Parquet store"""
+    if not is_available():
+        return
+
+    cutoff = add_to_date(now_datetime(), seconds=-SAFETY_LAG)
+    for _i in range(MAX_BATCHES_PER_RUN):
+        watermark = _get_watermark()
+        rows = _next_batch(watermark, cutoff)
+        if not rows:
+            return
+
+        partitions = {}
+        for row in rows:
+            key = (row.creation.strftime("%Y-%m"), row.whatsapp_customer or "_")
+            partitions.setdefault(key, []).append(row)
+
+        # Named after the batch's starting watermark: a run that dies before
+        # saving the new watermark rewrites the same files instead of duplicating them
+        part = hashlib.sha1(watermark.encode()).hexdigest()[:16]
+        for (month, customer), partition in partitions.items():
+            _write(month, customer, part, partition)
+
+        last = rows[-1]
+        _set_watermark(f"{last.creation.isoformat(sep=' ')}|{last.name}")
+
+        if len(rows) < BATCH_SIZE:
+            return
+
+
+def read_table(from_month=None, to_month=None, customer=None, columns=None):
+    """
+    Exported log rows as a pyarrow Table. Months are "YYYY-MM" and inclusive;
+    partitions outside the range are never opened.
+    """
+    _require()
+    root = frappe.get_site_path(*EXPORT_DIR)
+    if not os.path.isdir(root):
+        return _schema().empty_table()
+
+    # Explicit string keys: customer names must not be inferred as integers
+    partitioning = ds.partitioning(pa.schema([("month", pa.string()), ("customer", pa.string())]), flavor="hive")
+    dataset = ds.dataset(root, format="parquet", partitioning=partitioning)
+    condition = None
+    for expression in (
+        ds.field("month") >= from_month if from_month else None,
+        ds.field("month") <= to_month if to_month else None,
+        ds.field("customer") == customer if customer else None,
+    ):
+        if expression is not None:
+            condition = expression if condition is None else condition & expression
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def summarize(group_by=("whatsapp_customer", "status"), **filters):
+    """
+    Row counts grouped by `group_by` columns, e.g. per-tenant volume or
+    failures per endpoint: summarize(("endpoint", "status"), from_month="2026-01")
+    """
+    group_by = list(group_by)
+    table = read_table(columns=[*group_by, "name"], **filters)
+    rows = table.group_by(group_by).aggregate([("name", "count")]).to_pylist()
+    return [{**{column: row[column] for column in group_by}, "count": row["name_count"]} for row in rows]
+
+
+def failure_rates(by="endpoint", **filters):
+    """Share of failed outbound logs per `by` column"""
+    table = read_table(columns=[by, "status", "direction"], **filters)
+    table = table.filter(pc.equal(table["direction"], "Outbound"))
+    failed = pc.cast(pc.equal(table["status"], "Failed"), pa.int64())
+    table = table.append_column("failed", failed)
+    rows = table.group_by([by]).aggregate([("failed", "sum"), ("failed", "count")]).to_pylist()
+    return [
+        {
+            by: row[by],
+            "total": row["failed_count"],
+            "failed": row["failed_sum"],
+            "failure_rate": row["failed_sum"] / row["failed_count"] if row["failed_count"] else 0,
+        }
+        for row in rows
+    ]
+
+
+def _next_batch(watermark, cutoff):
+    creation, name = watermark.split("|", 1) if watermark else ("1970-01-01 00:00:00", "")
+    # Keyset on (creation, name); creation is indexed on every Frappe table
+    return frappe.db.sql(
+        f"""
+        select {", ".join(f"`{column}`" for column in COLUMNS)}
+        from `tabWhatsApp Message Log`
+        where (creation > %(creation)s or (creation = %(creation)s and name > %(name)s))
+            and creation < %(cutoff)s
+        order by creation, name
+        limit %(limit)s
+        """,
+        {"creation": creation, "name": name, "cutoff": cutoff, "limit": BATCH_SIZE},
+        as_dict=True,
+    )
+
+
+def _get_watermark():
+    path = frappe.get_site_path(*EXPORT_DIR, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return ""
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _set_watermark(watermark):
+    path = frappe.get_site_path(*EXPORT_DIR, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        f.write(watermark)
+    os.replace(path + ".tmp", path)
+
+
+def _write(month, customer, part, rows):
+    directory = frappe.get_site_path(*EXPORT_DIR, f"month={month}", f"customer={customer}")
+    os.makedirs(directory, exist_ok=True)
+
+    table = pa.Table.from_pylist(
+        [{**row, "billable": cint(row.billable), "timestamp": _to_datetime(row.timestamp)} for row in rows],
+        schema=_schema(),
+    )
+    path = os.path.join(directory, f"part-{part}.parquet")
+    # Dot-prefixed files are ignored by dataset readers until renamed into place
+    tmp_path = os.path.join(directory, f".part-{part}.parquet.tmp")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def _to_datetime(value):
+    return get_datetime(value) if value and not isinstance(value, datetime) else value
+
+
+def _require():
+    if not is_available():
+        frappe.throw(_("pyarrow is not installed; install whatsapp_saas[analytics] to use analytics exports"))
@@ -0,0 +1,119 @@
+"""
+WhatsApp SaaS Concurrency Limits
+Caps concurrent Baileys calls per customer so one tenant cannot tie up every
+worker. Slots are leases in a Redis sorted set (member -> expiry), shared by all
+workers and nodes; a crashed worker's slot simply expires.
+"""
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+KEY = "whatsapp_saas:inflight:{0}"
+# Seconds a request waits for a free slot before failing with 429
+DEFAULT_WAIT = 2.0
+# Added to the route timeout so a lease outlives the call it guards
+LEASE_MARGIN = 5
+
+# Expired leases are dropped before counting; Redis TIME keeps all nodes on one clock
+_ACQUIRE = """
+redis.replicate_commands()
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(last[2]) - now) + 1)
+return 1
+"""
+
+_COUNT = """
+local t = redis.call('TIME')
+return redis.call('ZCOUNT', KEYS[1], tonumber(t[1]) + tonumber(t[2]) / 1000000, '+inf')
+"""
+
+_scripts = {}
+
+
+def get_limit(plan):
+    """Concurrent request cap for `plan`; 0 means unlimited"""
+    return cint(frappe.get_cached_value("WhatsApp Plan", plan, "max_concurrent_requests"))
+
+
+@contextmanager
+def slot(customer, plan, lease=60):
+    """Hold one of `customer`'s concurrent request slots for the duration of the block"""
+    limit = get_limit(plan) if customer else 0
+    if not limit:
+        yield
+        return
+
+    name = KEY.format(customer)
+    deadline = time.monotonic() + flt(frappe.conf.get("whatsapp_concurrency_wait") or DEFAULT_WAIT)
+    delay = 0.05
+
+    while not (token := try_acquire(name, limit, lease + LEASE_MARGIN)):
+        if time.monotonic() + delay > deadline:
+            frappe.throw(
+                _("Too many concurrent requests ({0} allowed), retry shortly").format(limit),
+                frappe.TooManyRequestsError,
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+    try:
+        yield
+    finally:
+        release(name, token)
+
+
+@contextmanager
+def slots(customer, plan, count, lease=60):
+    """
+    Hold up to `count` of `customer`'s slots for a fan-out: waits for the first
+    like `slot`, takes the rest only if they are free. Yields how many are held.
+    """
+    limit = get_limit(plan) if customer else 0
+    if not limit:
+        yield count
+        return
+
+    name = KEY.format(customer)
+    with slot(customer, plan, lease):
+        tokens = []
+        try:
+            while len(tokens) < count - 1 and (token := try_acquire(name, limit, lease + LEASE_MARGIN)):
+                tokens.append(token)
+            yield len(tokens) + 1
+        finally:
+            for token in tokens:
+                release(name, token)
+
+
+def try_acquire(name, limit, lease):
+    """Take one of `limit` leases on `name` for `lease` seconds; the token to release it with, or None"""
+    token = frappe.generate_hash(length=16)
+    if _script("acquire", _ACQUIRE)(keys=[frappe.cache.make_key(name)], args=[limit, token, lease]):
+        return token
+    return None
+
+
+def release(name, token):
+    frappe.cache.zrem(frappe.cache.make_key(name), token)
+
+
+def in_flight(customer):
+    """Number of slots `customer` currently holds"""
+    key = frappe.cache.make_key(KEY.format(customer))
+    return cint(_script("count", _COUNT)(keys=[key]))
+
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache.register_script(source)
+    return _scripts[name]
@@ -0,0 +1,192 @@
+"""
+WhatsApp SaaS Fair Dispatcher
+Tenant-aware front for this app's background jobs. Jobs wait in per-customer
+Redis lists and are released into RQ by deficit round robin, weighted by the
+customer's WhatsApp Plan, with a bounded number in flight per queue. A large
+tenant's backlog therefore stays in its own list instead of in front of
+everyone else's jobs on the shared RQ queue.
+"""
+import json
+import time
+
+import frappe
+from frappe.utils import cint
+
+QUEUE_KEY = "whatsapp_saas:fair:{0}:queue:{1}"
+ACTIVE_KEY = "whatsapp_saas:fair:{0}:active"
+INFLIGHT_KEY = "whatsapp_saas:fair:{0}:inflight"
+STATE_KEY = "whatsapp_saas:fair:{0}:state"
+PUMP_REQUESTED_KEY = "whatsapp_saas:fair:{0}:pump_requested"
+LOCK_KEY = "whatsapp_saas:fair:{0}:lock"
+DEDUPE_KEY = "whatsapp_saas:fair:dedupe:{0}"
+
+# Jobs of this app running or waiting in RQ at once, per queue
+DEFAULT_IN_FLIGHT = {"short": 8, "default": 8, "long": 4}
+# Extra time on top of the job timeout before a lost job's slot is reclaimed
+LEASE_MARGIN = 60
+
+# Pop the next job, or retire the customer from the active set in the same step,
+# so a job pushed concurrently is never left behind in an inactive list
+_POP = """
+local job = redis.call('LPOP', KEYS[1])
+if not job then
+    redis.call('SREM', KEYS[2], ARGV[1])
+end
+return job
+"""
+
+_pop_script = None
+
+
+def submit(customer, method, queue="default", timeout=300, dedupe_key=None, after_commit=False, **kwargs):
+    """
+    Queue `method(**kwargs)` for `customer`, to run as the session user. A
+    `dedupe_key` that is already waiting makes this a no-op. With
+    `after_commit`, nothing is queued unless the current transaction commits.
+    """
+    if after_commit:
+        frappe.db.after_commit.add(
+            lambda: submit(customer, method, queue, timeout, dedupe_key, after_commit=False, **kwargs)
+        )
+        return
+
+    if dedupe_key and not frappe.cache.set(
+        frappe.cache.make_key(DEDUPE_KEY.format(dedupe_key)), 1, nx=True, ex=timeout + LEASE_MARGIN
+    ):
+        return
+
+    customer = customer or "_"
+    spec = {
+        "id": frappe.generate_hash(length=16),
+        "method": method,
+        "user": frappe.session.user,
+        "timeout": timeout,
+        "dedupe_key": dedupe_key,
+        "kwargs": kwargs,
+    }
+    frappe.cache.rpush(QUEUE_KEY.format(queue, customer), json.dumps(spec, default=str))
+    frappe.cache.sadd(ACTIVE_KEY.format(queue), customer)
+    pump(queue)
+
+
+def pump(queue):
+    """Release waiting jobs into RQ while the queue has free in-flight slots"""
+    requested_key = frappe.cache.make_key(PUMP_REQUESTED_KEY.format(queue))
+    frappe.cache.set(requested_key, 1, ex=60)
+
+    lock = frappe.cache.lock(frappe.cache.make_key(LOCK_KEY.format(queue)), timeout=30)
+    if not lock.acquire(blocking=False):
+        # The holder sees the request flag and makes another pass
+        return
+
+    try:
+        while frappe.cache.delete(requested_key):
+            _dispatch_round(queue)
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            # Expired while dispatching; the next pump takes over
+            pass
+
+
+def pump_all():
+    """Scheduler: restart dispatching in case a pump was missed or a job died"""
+    for queue in DEFAULT_IN_FLIGHT:
+        if frappe.cache.smembers(ACTIVE_KEY.format(queue)):
+            pump(queue)
+
+
+def execute(queue_name, customer, spec):
+    """RQ entry point: run one dispatched job, then free its slot and refill"""
+    if spec.get("dedupe_key"):
+        # A new submit may queue the work again from here on
+        frappe.cache.delete(frappe.cache.make_key(DEDUPE_KEY.format(spec["dedupe_key"])))
+    # RQ runs this as whoever pumped, which may be another tenant or the scheduler
+    user = frappe.session.user
+    try:
+        frappe.set_user(spec.get("user") or "Administrator")
+        frappe.get_attr(spec["method"])(**spec["kwargs"])
+    finally:
+        frappe.set_user(user)
+        frappe.cache.zrem(frappe.cache.make_key(INFLIGHT_KEY.format(queue_name)), spec["id"])
+        pump(queue_name)
+
+
+def get_weight(customer):
+    plan = frappe.get_cached_value("WhatsApp Customer", customer, "current_plan") if customer != "_" else None
+    weight = cint(frappe.get_cached_value("WhatsApp Plan", plan, "job_weight")) if plan else 0
+    return max(weight, 1)
+
+
+def stats(queue):
+    """Waiting jobs per customer and jobs in flight, for monitoring"""
+    inflight_key = frappe.cache.make_key(INFLIGHT_KEY.format(queue))
+    return {
+        "in_flight": frappe.cache.zcount(inflight_key, time.time(), "+inf"),
+        "waiting": {
+            frappe.safe_decode(customer): frappe.cache.llen(QUEUE_KEY.format(queue, frappe.safe_decode(customer)))
+            for customer in frappe.cache.smembers(ACTIVE_KEY.format(queue))
+        },
+    }
+
+
+def _dispatch_round(queue):
+    inflight_key = frappe.cache.make_key(INFLIGHT_KEY.format(queue))
+    now = time.time()
+    # Slots of jobs that died without reaching `execute`'s finally expire here
+    frappe.cache.zremrangebyscore(inflight_key, "-inf", now)
+    limits = frappe.conf.get("whatsapp_dispatch_in_flight") or {}
+    limit = cint(limits.get(queue)) or DEFAULT_IN_FLIGHT.get(queue, 8)
+    free = limit - frappe.cache.zcard(inflight_key)
+
+    customers = sorted(frappe.safe_decode(c) for c in frappe.cache.smembers(ACTIVE_KEY.format(queue)))
+    if free <= 0 or not customers:
+        return
+
+    state = frappe.cache.get_value(STATE_KEY.format(queue)) or {"cursor": None, "deficit": {}}
+    deficit = {c: state["deficit"].get(c, 0) for c in customers}
+
+    # Resume the rotation after the customer served last
+    start = next((i + 1 for i, c in enumerate(customers) if c == state["cursor"]), 0)
+    rotation = customers[start:] + customers[:start]
+
+    while free > 0 and rotation:
+        for customer in list(rotation):
+            deficit[customer] += get_weight(customer)
+            while deficit[customer] >= 1 and free > 0:
+                raw = _pop(queue, customer)
+                if raw is None:
+                    # Idle customers do not bank credit (standard DRR)
+                    deficit.pop(customer, None)
+                    rotation.remove(customer)
+                    break
+                _release(queue, customer, json.loads(raw), inflight_key)
+                deficit[customer] -= 1
+                free -= 1
+            state["cursor"] = customer
+            if free <= 0:
+                break
+
+    state["deficit"] = deficit
+    frappe.cache.set_value(STATE_KEY.format(queue), state)
+
+
+def _pop(queue, customer):
+    global _pop_script
+    if _pop_script is None:
+        _pop_script = frappe.cache.register_script(_POP)
+    keys = [frappe.cache.make_key(QUEUE_KEY.format(queue, customer)), frappe.cache.make_key(ACTIVE_KEY.format(queue))]
+    return _pop_script(keys=keys, args=[customer])
+
+
+def _release(queue, customer, spec, inflight_key):
+    frappe.cache.zadd(inflight_key, {spec["id"]: time.time() + spec["timeout"] + LEASE_MARGIN})
+    frappe.enqueue(
+        "whatsapp_saas.api.dispatcher.execute",
+        queue=queue,
+        timeout=spec["timeout"],
+        queue_name=queue,
+        customer=customer,
+        spec=spec,
+    )
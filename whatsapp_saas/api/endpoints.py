@@ -1,112 +1,82 @@
 """
 WhatsApp SaaS API Endpoints
-Individual whitelisted methods for all WhatsApp Baileys endpoints
+Whitelisted methods for all WhatsApp Baileys endpoints. Plain proxy routes are
+generated from `routes.ROUTES`; routes with custom handling are defined below.
 """
 import frappe
-import requests
 import json
 from frappe import _
+from whatsapp_saas.api import (
+    baileys, concurrency, eventlog, exports, gateway, imaging, instance_state, media, messages, receipts, replica, routes,
+    scheduled, singleflight, usage, webhooks,
+)
 
-def _proxy_request(endpoint, method="POST", require_instance=True, **kwargs):
-    """Internal helper to proxy requests to Baileys service with auth & limits"""
+def _proxy_request(route, **kwargs):
+    """Internal helper to proxy a declared route to Baileys with auth & limits"""
     try:
         user = frappe.session.user
         if user == 'Guest':
             frappe.throw(_("Authentication required"), frappe.PermissionError)
         
-        # Verify customer exists
-        # customer_name = frappe.db.get_value("WhatsApp Customer", {"user": user}, "name")
-        
-        
-        # Get instance_id from kwargs or form
-        instance_id = kwargs.get('instance_id') or frappe.form_dict.get('instance_id')
-            
-        # Some endpoints don't require instance_id (like instance_list, instance_create)
-        if require_instance:
-            if not instance_id:
-                frappe.throw(_("instance_id is required"))
-            
-            # customer_name = frappe.db.get_value("WhatsApp Instance", {"instance_id": instance_id}, "whatsapp_customer")
-            # if not customer_name:
-            #     frappe.throw(_("No WhatsApp Customer linked to this user"))
-
-            # Verify instance ownership
-            instance = frappe.get_doc("WhatsApp Instance", {"instance_id": instance_id, "owner": user})
-            if not instance:
-                frappe.throw(_("Unauthorized access to instance"))
-            
-            subscription = frappe.get_doc("WhatsApp Subscription", instance.subscription)
-            if subscription.status != 'Active':
-                frappe.throw(_("Subscription not active"))
-            
-            # Check rate limits
-            plan = frappe.get_doc("WhatsApp Plan", subscription.plan)
-            from frappe.utils import get_first_day, get_last_day, today
-            current_usage = frappe.db.count("WhatsApp Message Log", {
-                "subscription": subscription.name,
-                "creation": ["between", [get_first_day(today()), get_last_day(today())]]
-            })
-            
-            if current_usage >= plan.max_messages_per_month:
-                frappe.throw(_("Monthly message limit reached"))
-        
-        # Forward to Baileys
-        url = f"http://whatsapp-baileys:3000/api/{endpoint}"
-        
-        # Prepare request data
-        data = {k: v for k, v in kwargs.items() if k != 'instance_id'}
+        data = dict(kwargs)
         data.update(frappe.form_dict)
         data.pop('cmd', None)
-        data.pop('instance_id', None)
-        
-        files = None
-        if frappe.request.files:
-            files = {k: (v.filename, v.stream, v.content_type) for k, v in frappe.request.files.items()}
-        
-        # Store request data for logging
-        request_data = json.dumps(data) if not files else str(data)
-        
-        response = requests.request(
-            method=method,
-            url=url,
-            json=data if not files else None,
-            data=data if files else None,
-            files=files,
-            timeout=60
-        )
-        
-        # Parse response
-        response_data = None
-        try:
-            response_data = response.json()
-        except:
-            response_data = response.content.decode('utf-8') if response.content else ""
-        
-        # Log the request with both request and response
-        if method in ['POST', 'PUT', 'DELETE'] and require_instance:
-            msg_id = "LOG-" + frappe.generate_hash(length=10)
-            if isinstance(response_data, dict):
-                msg_id = response_data.get('key', {}).get('id') or response_data.get('id') or msg_id
-            
-            frappe.get_doc({
-                "doctype": "WhatsApp Message Log",
-                "instance": instance.name,
-                "message_id": msg_id,
-                "timestamp": frappe.utils.now(),
-                "status": "Sent" if response.ok else "Failed",
-                "direction": "Outbound",
-                "whatsapp_customer": customer_name,
-                "subscription": subscription.name,
-                "request_data": request_data,
-                "response_data": json.dumps(response_data) if isinstance(response_data, dict) else str(response_data)
-            }).insert(ignore_permissions=True)
-        
-        return response_data
         
+        # Some endpoints don't require instance_id (like instance_list, health)
+        instance = None
+        if route.require_instance:
+            if not data.get('instance_id'):
+                frappe.throw(_("instance_id is required"))
+            instance = gateway.authorize(data['instance_id'])
+
+        # Sends with `send_at` are stored and go out through the same path when due
+        send_at = spread = None
+        if route.quota and instance:
+            send_at, spread = data.pop('send_at', None), data.pop('spread', None)
+        if send_at:
+            if gateway.request_files():
+                frappe.throw(_("Upload the file with media_upload and pass media_handle to schedule media"))
+            return {"success": True, "data": scheduled.schedule(route, instance, data, send_at, spread)}
+
+        return gateway.call_route(route, instance, data, files=gateway.request_files())
+
+    except frappe.TooManyRequestsError:
+        # Keep the 429 so clients know to retry
+        raise
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "WhatsApp API Error")
+        eventlog.report_error("WhatsApp API Error", route=route.handler)
         frappe.throw(str(e))
 
+def _route_endpoint(route):
+    def endpoint(**kwargs):
+        return _proxy_request(route, **kwargs)
+    
+    endpoint.__name__ = endpoint.__qualname__ = route.handler
+    endpoint.__doc__ = f"{route.method} /api/{route.path}"
+    return frappe.whitelist(allow_guest=False)(endpoint)
+
+# One whitelisted function per declared route, e.g. `send_text`, `list_groups`
+for _route in routes.ROUTES.values():
+    globals()[_route.handler] = _route_endpoint(_route)
+
+def _get_instance_name(instance_id):
+    """Resolve an instance owned by the session user, for routes served locally"""
+    user = frappe.session.user
+    if user == 'Guest':
+        frappe.throw(_("Authentication required"), frappe.PermissionError)
+    if not instance_id:
+        frappe.throw(_("instance_id is required"))
+    
+    filters = {"instance_id": instance_id, "owner": user}
+    with replica.read_only() as on_replica:
+        instance = frappe.db.get_value("WhatsApp Instance", filters, "name")
+    if not instance and on_replica:
+        # Created moments ago and not replicated yet
+        instance = frappe.db.get_value("WhatsApp Instance", filters, "name")
+    if not instance:
+        frappe.throw(_("Unauthorized access to instance"), frappe.PermissionError)
+    return instance
+
 # Instance Management
 @frappe.whitelist(allow_guest=False)
 def instance_create(**kwargs):
@@ -145,12 +115,11 @@ def instance_create(**kwargs):
         
         subscription = frappe.db.get_value("WhatsApp Subscription", {"plan": plan.name, "customer": customer_name}, "name")
         # Create instance via Baileys
-        url = "http://whatsapp-baileys:3000/api/instance/create"
         data = {k: v for k, v in kwargs.items()}
         data.update(frappe.form_dict)
         data.pop('cmd', None)
         
-        response = requests.post(url, json=data, timeout=60)
+        response = baileys.request("POST", "instance/create", json=data, timeout=60)
         response_data = response.json()
         
         # Create instance record in Frappe
@@ -168,447 +137,447 @@ def instance_create(**kwargs):
         
     except Exception as e:
         frappe.db.rollback(save_point="instance_create")
-        frappe.log_error(frappe.get_traceback(), "Instance Create Error")
+        eventlog.report_error("Instance Create Error")
         frappe.throw(str(e))
 
-@frappe.whitelist(allow_guest=False)
-def instance_list(**kwargs):
-    """List all instances - doesn't require instance_id"""
-    return _proxy_request("instance/list", "GET", require_instance=False, **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def instance_get(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}", "GET", **kwargs)
-
-# @frappe.whitelist(allow_guest=False)
-# def instance_qr(**kwargs):
-#     instance_id = kwargs.get('instance_id')
-#     return _proxy_request(f"instance/{instance_id}/qr", "GET", **kwargs)
-
 @frappe.whitelist(allow_guest=False)
 def instance_qr(**kwargs):
+    """Latest QR from the webhook cache; Baileys is asked only when none is cached"""
+    instance_id = kwargs.get('instance_id')
+    _get_instance_name(instance_id)
     try:
+        cached = instance_state.get_qr(instance_id)
+        if cached:
+            return cached
         
-        instance_id = kwargs.get('instance_id')
-        url = f"http://whatsapp-baileys:3000/api/instance/{instance_id}/qr"
         data = {
             "instance_id": instance_id
         }
-        response = requests.get(url, json=data, timeout=60)
-
-        response_data = response.json()
+        # Frontends polling the same QR share one Baileys call
+        response_data = singleflight.run(
+            f"instance_qr:{instance_id}",
+            lambda: baileys.request("GET", f"instance/{instance_id}/qr", json=data, timeout=60).json(),
+            timeout=60,
+        )
+        qr = response_data.get('data', {}).get('qr') if response_data.get('success') else None
+        if qr:
+            instance = frappe.get_doc("WhatsApp Instance", {"instance_id": instance_id})
+            return instance_state.update_qr(instance, qr)
         return response_data
 
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "Instance QR Error")
+        eventlog.report_error("Instance QR Error", instance_id=instance_id)
         return {
             "status": "error",
             "message": "An error occurred while retrieving QR code."
         }
-    # return _proxy_request(f"instance/{instance_id}/qr", "GET", **kwargs)
-
-
-
-# @frappe.whitelist(allow_guest=False)
-# def instance_status(**kwargs):
-#     instance_id = kwargs.get('instance_id')
-#     response = _proxy_request(f"instance/{instance_id}/status", "GET", **kwargs)
-#     # Update instance status in Frappe
-#     try:
-#         instance = frappe.get_doc("WhatsApp Instance", {"instance_id": instance_id})
-#         if response.get('success'):
-#             data = response.get('data', {})
-#             status = data.get('status', instance.status)
-#             if status == "connected":
-#                 instance.status = "Connected"
-#                 instance.phone_number = data.get('phoneNumber', instance.phone_number)
-#                 instance.qr_available = False
-
-#             elif status == "connecting":
-#                 instance.status = "Connecting"
-#             elif status == "disconnected" or status == "qr":
-#                 instance.status = "Disconnected"
-#                 instance.qr_available = True
-#                 instance.phone_number = None
-#             else:
-#                 instance.status = status
-                
-#             instance.save(ignore_permissions=True)
-#             frappe.db.commit()
-#             return response
-#     except Exception as e:
-#         frappe.log_error(frappe.get_traceback(), "Instance Status Update Error")
-
-#     return {
-#         "error": "Failed to check instance status"
-#     }
 
 @frappe.whitelist(allow_guest=False)
 def instance_status(**kwargs):
+    """Status from the webhook cache; on a miss Baileys is asked and the doc saved only if it changed"""
     instance_id = kwargs.get('instance_id')
-    # response = _proxy_request(f"instance/{instance_id}/status", "GET", **kwargs)
-    # Update instance status in Frappe
-    url = f"http://whatsapp-baileys:3000/api/instance/{instance_id}/status"
+    _get_instance_name(instance_id)
+    cached = instance_state.get_status(instance_id)
+    if cached:
+        return cached
+    
     data = {
         "instance_id": instance_id
     }
-    response = requests.get(url, json=data, timeout=60)
+    response = baileys.request("GET", f"instance/{instance_id}/status", json=data, timeout=60)
     response = response.json()
     try:
         instance = frappe.get_doc("WhatsApp Instance", {"instance_id": instance_id})
         if response.get('success'):
             data = response.get('data', {})
-            status = data.get('status', instance.status)
-            if status == "connected":
-                instance.status = "Connected"
-                instance.phone_number = data.get('phoneNumber', instance.phone_number)
-                instance.qr_available = False
-
-            elif status == "connecting":
-                instance.status = "Connecting"
-            elif status == "disconnected" or status == "qr":
-                instance.status = "Disconnected"
-                instance.qr_available = True
-                instance.phone_number = None
-            else:
-                instance.status = status
-                
-            instance.save(ignore_permissions=True)
-            frappe.db.commit()
+            instance_state.update_status(instance, data.get('status'), data.get('phoneNumber'))
             return response
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "Instance Status Update Error")
+        eventlog.report_error("Instance Status Update Error", instance_id=instance_id)
 
     return {
         "error": "Failed to check instance status"
     }
 
 @frappe.whitelist(allow_guest=False)
-def instance_delete(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}", "DELETE", **kwargs)
-
-# @frappe.whitelist(allow_guest=False)
-# def instance_logout(**kwargs):
-#     instance_id = kwargs.get('instance_id')
-#     return _proxy_request(f"instance/{instance_id}/logout", "POST", **kwargs)
+def instance_status_bulk(**kwargs):
+    """
+    Status of many instances in one call: `instance_ids` as a list, or omitted for all of yours
+    (the first 200; `truncated` says whether there are more).
+    Cached statuses are returned as is; `refresh=1` asks Baileys for every instance.
+    """
+    user = frappe.session.user
+    if user == 'Guest':
+        frappe.throw(_("Authentication required"), frappe.PermissionError)
+    
+    instance_ids = kwargs.get('instance_ids') or []
+    if isinstance(instance_ids, str):
+        instance_ids = json.loads(instance_ids) if instance_ids.startswith('[') else instance_ids.split(',')
+    instance_ids = [i.strip() for i in instance_ids if i and i.strip()]
+    if len(instance_ids) > 200:
+        frappe.throw(_("At most 200 instance_ids per call"))
+    
+    filters = {"owner": user}
+    if instance_ids:
+        filters["instance_id"] = ["in", instance_ids]
+    def get_instances():
+        # One extra row tells a caller asking for all instances that the list was cut
+        return frappe.get_all(
+            "WhatsApp Instance",
+            filters=filters,
+            fields=["name", "instance_id", "owner", "status", "phone_number", "whatsapp_customer", "subscription"],
+            order_by="creation asc",
+            limit=201,
+        )
+    
+    with replica.read_only() as on_replica:
+        instances = get_instances()
+    if on_replica and instance_ids and len(instances) < len(set(instance_ids)):
+        # Some may not be replicated yet
+        instances = get_instances()
+    truncated = len(instances) > 200
+    instances = instances[:200]
+    
+    results = instance_state.get_statuses_bulk(
+        [row for row in instances if row.instance_id], refresh=frappe.utils.cint(kwargs.get('refresh'))
+    )
+    for instance_id in instance_ids:
+        results.setdefault(instance_id, {"success": False, "error": "Unauthorized access to instance"})
+    response = {"success": True, "data": results}
+    if not instance_ids:
+        response["truncated"] = truncated
+    return response
 
 @frappe.whitelist(allow_guest=False)
 def instance_logout(**kwargs):
     try:
         instance_id = kwargs.get('instance_id')
-        url = f"http://whatsapp-baileys:3000/api/instance/{instance_id}/logout"
         data = {
             "instance_id": instance_id
         }
-        response = requests.post(url, json=data, timeout=60)
+        response = baileys.request("POST", f"instance/{instance_id}/logout", json=data, timeout=60)
         response_data = response.json()
         return response_data
     except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "Instance Logout Error")
+        eventlog.report_error("Instance Logout Error", instance_id=kwargs.get('instance_id'))
         frappe.throw(str(e))
 
-# Core Messaging
-@frappe.whitelist(allow_guest=False)
-def send_text(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/text", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_media(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/media", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_location(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/location", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_reaction(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/reaction", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def delete_message(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/message", "DELETE", **kwargs)
-
-# Enhanced Messaging
-@frappe.whitelist(allow_guest=False)
-def send_reply(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/reply", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_mention(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/mention", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def forward_message(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/message/forward", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def edit_message(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/message/edit", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def pin_message(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/message/pin", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def unpin_message(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/message/unpin", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_viewonce(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/viewonce", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_poll(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/poll", "POST", **kwargs)
-
-# Media Operations
-@frappe.whitelist(allow_guest=False)
-def download_media(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    message_id = kwargs.get('message_id')
-    return _proxy_request(f"instance/{instance_id}/media/{message_id}/download", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
+# Usage
+@frappe.whitelist(allow_guest=False)
+def concurrency_usage(**kwargs):
+    """Concurrent Baileys requests in flight for the session user's customer, and the plan caps"""
+    customer = media.customer_for_user()
+    with replica.read_only():
+        plans = frappe.get_all(
+            "WhatsApp Subscription",
+            filters={"customer": customer, "status": "Active"},
+            pluck="plan",
+            distinct=True,
+        )
+    return {"success": True, "data": {
+        "in_flight": concurrency.in_flight(customer),
+        "limits": {plan: concurrency.get_limit(plan) for plan in plans},
+    }}
+
+@frappe.whitelist(allow_guest=False)
+def usage_analytics(**kwargs):
+    """
+    Sent, failed and inbound counts per instance in Hour, Day or Month buckets.
+    Covers all of the customer's instances unless `instance_id` is given, and
+    only counts made under `subscription` if it is given;
+    System Managers may pass `customer`.
+    """
+    is_admin = "System Manager" in frappe.get_roles()
+    subscription = kwargs.get('subscription')
+    subscription_customer = frappe.db.get_value("WhatsApp Subscription", subscription, "customer") if subscription else None
+    if subscription and not subscription_customer:
+        frappe.throw(_("Subscription {0} not found").format(subscription), frappe.DoesNotExistError)
+    if subscription and not is_admin and subscription_customer != media.customer_for_user():
+        frappe.throw(_("Unauthorized access to subscription"), frappe.PermissionError)
+
+    if kwargs.get('instance_id'):
+        instances = [_get_instance_name(kwargs['instance_id'])]
+    else:
+        customer = (kwargs.get('customer') or subscription_customer) if is_admin else None
+        customer = customer or media.customer_for_user()
+        with replica.read_only():
+            instances = frappe.get_all("WhatsApp Instance", filters={"whatsapp_customer": customer}, pluck="name")
+    return {"success": True, "data": usage.get_series(
+        instances,
+        granularity=(kwargs.get('granularity') or "Day").title(),
+        from_date=kwargs.get('from_date'),
+        to_date=kwargs.get('to_date'),
+        subscription=subscription,
+    )}
+
+@frappe.whitelist(allow_guest=False)
+def recent_payloads(**kwargs):
+    """Latest raw payloads kept for debugging, e.g. kind=webhook (System Manager only)"""
+    frappe.only_for("System Manager")
+    return {"success": True, "data": eventlog.recent_payloads(kwargs.get('kind') or "webhook", kwargs.get('limit'))}
+
+@frappe.whitelist(allow_guest=False)
+def baileys_metrics(**kwargs):
+    """Adaptive concurrency limits and shed counts per Baileys node; format=prometheus for text exposition"""
+    frappe.only_for("System Manager")
+    metrics = baileys.get_metrics()
+    if kwargs.get('format') != "prometheus":
+        return {"success": True, "data": metrics}
+    
+    from werkzeug.wrappers import Response
+    lines = []
+    for name, kind, help_text in (
+        ("limit", "gauge", "Adaptive in-flight limit"),
+        ("in_flight", "gauge", "Requests currently in flight"),
+        ("latency_ms", "gauge", "Latency of the last sampled request"),
+        ("admitted", "counter", "Requests admitted"),
+    ):
+        lines += [f"# HELP whatsapp_baileys_{name} {help_text}", f"# TYPE whatsapp_baileys_{name} {kind}"]
+        lines += [f'whatsapp_baileys_{name}{{node="{node}"}} {values[name]}' for node, values in metrics.items()]
+    lines += [
+        "# HELP whatsapp_baileys_baseline_ms Latency baseline the limit adapts against, per route class",
+        "# TYPE whatsapp_baileys_baseline_ms gauge",
+    ]
+    for node, values in metrics.items():
+        lines += [
+            f'whatsapp_baileys_baseline_ms{{node="{node}",route="{route}"}} {baseline}'
+            for route, baseline in values["baseline_ms"].items()
+        ]
+    lines += ["# HELP whatsapp_baileys_shed Requests shed by priority", "# TYPE whatsapp_baileys_shed counter"]
+    for node, values in metrics.items():
+        lines += [
+            f'whatsapp_baileys_shed{{node="{node}",priority="{priority}"}} {count}'
+            for priority, count in values["shed"].items()
+        ]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@frappe.whitelist(allow_guest=False)
+def replica_status(**kwargs):
+    """Whether reads are served from the replica, and its last measured lag (System Manager only)"""
+    frappe.only_for("System Manager")
+    return {"success": True, "data": {"enabled": replica.is_enabled(), **replica.get_health()}}
+
+# Webhooks
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def webhook_subscribe(**kwargs):
+    """Register a URL to receive events; `events` is a list (empty for all), `instance_id` optional"""
+    customer = media.customer_for_user()
+    events = kwargs.get('events') or []
+    if isinstance(events, str):
+        events = json.loads(events) if events.startswith('[') else events.split(',')
+    
+    instance = _get_instance_name(kwargs['instance_id']) if kwargs.get('instance_id') else None
+    doc = frappe.get_doc({
+        "doctype": webhooks.DOCTYPE,
+        "whatsapp_customer": customer,
+        "instance": instance,
+        "url": kwargs.get('url'),
+        "events": "\n".join(e.strip() for e in events if e.strip()),
+        "secret": kwargs.get('secret'),
+    }).insert(ignore_permissions=True)
+    return {"success": True, "data": {
+        "webhook_id": doc.name,
+        "secret": doc.get_password("secret"),
+    }}
+
+@frappe.whitelist(allow_guest=False)
+def webhook_list(**kwargs):
+    customer = media.customer_for_user()
+    with replica.read_only():
+        return {"success": True, "data": frappe.get_all(
+            webhooks.DOCTYPE,
+            filters={"whatsapp_customer": customer},
+            fields=["name as webhook_id", "url", "instance", "events", "enabled"],
+        )}
+
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def webhook_unsubscribe(**kwargs):
+    name = _get_customer_doc(webhooks.DOCTYPE, kwargs.get('webhook_id'))
+    frappe.delete_doc(webhooks.DOCTYPE, name, ignore_permissions=True)
+    return {"success": True}
+
+@frappe.whitelist(allow_guest=False)
+def webhook_dead_letters(**kwargs):
+    customer = media.customer_for_user()
+    with replica.read_only():
+        return {"success": True, "data": frappe.get_all(
+            webhooks.DEAD_LETTER_DOCTYPE,
+            filters={"whatsapp_customer": customer, "status": "Failed"},
+            fields=["name", "webhook", "attempts", "event_count", "last_error", "creation"],
+            order_by="creation desc",
+            limit=100,
+        )}
+
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def webhook_requeue(**kwargs):
+    """Retry a dead-lettered delivery"""
+    webhooks.requeue(_get_customer_doc(webhooks.DEAD_LETTER_DOCTYPE, kwargs.get('name')))
+    return {"success": True}
+
+def _get_customer_doc(doctype, name):
+    """Name of a `doctype` record that belongs to the session user's customer"""
+    customer = media.customer_for_user()
+    if not name or not frappe.db.exists(doctype, {"name": name, "whatsapp_customer": customer}):
+        frappe.throw(_("{0} not found").format(_(doctype)), frappe.DoesNotExistError)
+    return name
+
+# Media Store
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def media_upload(**kwargs):
+    """Store an uploaded file once and return a `media_handle` for send_media, send_sticker and status_send"""
+    customer = media.customer_for_user()
+    if not frappe.request.files:
+        frappe.throw(_("file is required"))
+    
+    file_storage = next(iter(frappe.request.files.values()))
+    stored, existed = media.store_upload(customer, file_storage)
+    return {"success": True, "data": {**media.as_response(stored), "deduplicated": existed}}
+
+# Media Processing (local process pool, not Baileys)
+@frappe.whitelist(allow_guest=False, methods=['POST'])
 def generate_thumbnail(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/media/thumbnail", "POST", **kwargs)
+    """Thumbnail an uploaded image or `media_handle`; width, height, quality, format"""
+    return _process_single_image("thumbnail", kwargs)
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=['POST'])
 def optimize_image(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/media/optimize", "POST", **kwargs)
-
-# Chat Management
-@frappe.whitelist(allow_guest=False)
-def archive_chat(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/archive", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def mute_chat(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/mute", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def mark_read(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/read", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def pin_chat(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/pin", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def delete_chat(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat", "DELETE", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def star_message(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/star", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def set_disappearing(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/disappearing", "POST", **kwargs)
-
+    """Downscale and recompress an uploaded image or `media_handle`; max_width, max_height, quality, format"""
+    return _process_single_image("optimize", kwargs)
+
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def process_media_batch(**kwargs):
+    """
+    Process many images in one call. `items` is a list of
+    {"media_handle", "operation", ...params}; uploaded files use the top-level `operation`.
+    """
+    customer = media.customer_for_user()
+    results = imaging.process(customer, _image_items(customer, kwargs))
+    return {"success": True, "data": {"results": results}}
+
+def _process_single_image(operation, kwargs):
+    customer = media.customer_for_user()
+    items = _image_items(customer, kwargs, operation)
+    if len(items) != 1:
+        frappe.throw(_("Send a single image, or use media_batch for several"))
+    return imaging.process(customer, [(items[0][0], operation, items[0][2])])[0]
+
+def _image_items(customer, kwargs, default_operation=None):
+    specs = kwargs.get('items') or []
+    if isinstance(specs, str):
+        specs = json.loads(specs)
+    if not specs and kwargs.get('media_handle'):
+        specs = [kwargs]
+    
+    items = []
+    for spec in specs:
+        source = media.get_media(customer, spec.get('media_handle'))
+        if not source:
+            frappe.throw(_("Unknown media_handle {0}").format(spec.get('media_handle')))
+        items.append((source, spec.get('operation') or default_operation, spec))
+    
+    for _key, file_storage in (frappe.request.files.items(multi=True) if frappe.request.files else []):
+        source, _existed = media.store_upload(customer, file_storage)
+        items.append((source, kwargs.get('operation') or default_operation, kwargs))
+    
+    if not items:
+        frappe.throw(_("file or media_handle is required"))
+    return items
+
+# Scheduled Messages
+@frappe.whitelist(allow_guest=False)
+def scheduled_list(**kwargs):
+    """
+    Scheduled sends of the customer, soonest first; filter with `instance_id` and `status`
+    (by default every message that has not finished: Scheduled, Queued or Sending)
+    """
+    status = kwargs.get('status') or ["in", ["Scheduled", "Queued", "Sending"]]
+    filters = {"whatsapp_customer": media.customer_for_user(), "status": status}
+    if kwargs.get('instance_id'):
+        filters["instance"] = _get_instance_name(kwargs['instance_id'])
+    with replica.read_only():
+        return {"success": True, "data": frappe.get_all(
+            scheduled.DOCTYPE,
+            filters=filters,
+            fields=["name as scheduled_id", "instance", "route", "status", "send_at", "dispatch_at", "message_id", "error"],
+            order_by="dispatch_at asc",
+            limit=min(frappe.utils.cint(kwargs.get('limit')) or 100, 500),
+        )}
+
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def scheduled_cancel(**kwargs):
+    name = _get_customer_doc(scheduled.DOCTYPE, kwargs.get('scheduled_id'))
+    return {"success": True, "data": scheduled.cancel(name)}
+
+@frappe.whitelist(allow_guest=False, methods=['POST'])
+def scheduled_reschedule(**kwargs):
+    """New `send_at` (and optionally `spread`) for a message that has not gone out yet"""
+    name = _get_customer_doc(scheduled.DOCTYPE, kwargs.get('scheduled_id'))
+    if not kwargs.get('send_at'):
+        frappe.throw(_("send_at is required"))
+    return {"success": True, "data": scheduled.reschedule(name, kwargs['send_at'], kwargs.get('spread'))}
+
+# Delivery Status
+@frappe.whitelist(allow_guest=False)
+def message_status(**kwargs):
+    """Delivery status (Sent, Delivered, Read, Failed) for up to 1000 `message_ids` at once"""
+    instance = _get_instance_name(kwargs.get('instance_id'))
+    message_ids = kwargs.get('message_ids') or []
+    if isinstance(message_ids, str):
+        message_ids = json.loads(message_ids) if message_ids.startswith('[') else message_ids.split(',')
+    message_ids = [m.strip() for m in message_ids if m and m.strip()]
+    if not message_ids:
+        frappe.throw(_("message_ids is required"))
+    if len(message_ids) > 1000:
+        frappe.throw(_("At most 1000 message_ids per call"))
+    return {"success": True, "data": receipts.get_statuses(instance, message_ids)}
+
+# Chat History & Search
 @frappe.whitelist(allow_guest=False)
 def chat_history(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/chat/history", "GET", **kwargs)
-
-# Presence & Status
-@frappe.whitelist(allow_guest=False)
-def update_presence(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/presence/update", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def set_typing(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/presence/typing", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def set_online(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/presence/online", "POST", **kwargs)
-
-# Profile Management
-@frappe.whitelist(allow_guest=False)
-def update_name(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/profile/name", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def update_status(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/profile/status", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def update_picture(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/profile/picture", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def get_picture(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/profile/picture", "GET", **kwargs)
-
-# Privacy Settings
-@frappe.whitelist(allow_guest=False)
-def block_user(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/privacy/block", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def unblock_user(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/privacy/unblock", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def get_blocklist(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/privacy/blocklist", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def update_privacy(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/privacy/settings", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def get_privacy(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/privacy/settings", "GET", **kwargs)
-
-# Broadcast & Stories
-@frappe.whitelist(allow_guest=False)
-def send_broadcast(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/broadcast/send", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_status(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/status/send", "POST", **kwargs)
-
-# Group Management
-@frappe.whitelist(allow_guest=False)
-def create_group(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/group/create", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def list_groups(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/groups", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def get_group(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    group_jid = kwargs.get('group_jid')
-    return _proxy_request(f"instance/{instance_id}/group/{group_jid}", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def update_group_subject(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    group_jid = kwargs.get('group_jid')
-    return _proxy_request(f"instance/{instance_id}/group/{group_jid}/subject", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def update_group_description(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    group_jid = kwargs.get('group_jid')
-    return _proxy_request(f"instance/{instance_id}/group/{group_jid}/description", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def group_participants(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    group_jid = kwargs.get('group_jid')
-    return _proxy_request(f"instance/{instance_id}/group/{group_jid}/participants", "PUT", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def leave_group(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    group_jid = kwargs.get('group_jid')
-    return _proxy_request(f"instance/{instance_id}/group/{group_jid}/leave", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def get_invite_code(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    group_jid = kwargs.get('group_jid')
-    return _proxy_request(f"instance/{instance_id}/group/{group_jid}/invite", "GET", **kwargs)
-
-# Utilities
-@frappe.whitelist(allow_guest=False)
-def check_number(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/utils/check-number", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def validate_jid(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/utils/validate-jid", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def format_number(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/utils/format-number", "GET", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def device_info(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/utils/device-info", "GET", **kwargs)
-
-# Advanced Features
-@frappe.whitelist(allow_guest=False)
-def send_link_preview(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/advanced/link-preview", "POST", **kwargs)
-
-@frappe.whitelist(allow_guest=False)
-def send_sticker(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/advanced/sticker", "POST", **kwargs)
+    """Served from the local message store, paginated with `cursor`"""
+    instance = _get_instance_name(kwargs.get('instance_id'))
+    jid = kwargs.get('jid') or kwargs.get('chat_jid')
+    if not jid:
+        frappe.throw(_("jid is required"))
+    return messages.get_page(instance, jid, cursor=kwargs.get('cursor'), limit=kwargs.get('limit'))
 
 @frappe.whitelist(allow_guest=False)
 def search_messages(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/advanced/search", "GET", **kwargs)
+    """Full-text search over the local message store, paginated with `cursor`"""
+    instance = _get_instance_name(kwargs.get('instance_id'))
+    return messages.search(
+        instance,
+        kwargs.get('query') or kwargs.get('q'),
+        chat_jid=kwargs.get('jid') or kwargs.get('chat_jid'),
+        cursor=kwargs.get('cursor'),
+        limit=kwargs.get('limit'),
+    )
 
 @frappe.whitelist(allow_guest=False)
 def export_chat(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/advanced/export", "POST", **kwargs)
+    """Queue a background export; poll export_status for progress and the download link"""
+    instance = _get_instance_name(kwargs.get('instance_id'))
+    export = exports.start_export(
+        instance,
+        kwargs.get('jid') or kwargs.get('chat_jid'),
+        kwargs.get('format') or "NDJSON",
+    )
+    return {"success": True, "data": {"export_id": export.name, "status": export.status}}
 
-# Health & Monitoring
 @frappe.whitelist(allow_guest=False)
-def health_check(**kwargs):
-    return _proxy_request("health", "GET", require_instance=False, **kwargs)
+def export_status(**kwargs):
+    export_id = kwargs.get('export_id')
+    if not export_id:
+        frappe.throw(_("export_id is required"))
+    return {"success": True, "data": exports.get_status(export_id)}
 
 @frappe.whitelist(allow_guest=False)
 def get_messages(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/messages", "GET", **kwargs)
-
-# Template & Buttons
-@frappe.whitelist(allow_guest=False)
-def send_template_buttons(**kwargs):
-    instance_id = kwargs.get('instance_id')
-    return _proxy_request(f"instance/{instance_id}/send/template-buttons", "POST", **kwargs)
+    """Served from the local message store, paginated with `cursor`"""
+    instance = _get_instance_name(kwargs.get('instance_id'))
+    return messages.get_page(
+        instance,
+        kwargs.get('jid') or kwargs.get('chat_jid'),
+        cursor=kwargs.get('cursor'),
+        limit=kwargs.get('limit'),
+    )
@@ -0,0 +1,116 @@
+"""
+WhatsApp SaaS Event Log
+Structured, sampled events go to the app's rotating log file instead of Error
+Log. Errors are reported to Error Log at most once per signature per window,
+with a count of what was suppressed in between. Recent raw payloads are kept
+in a bounded Redis list for debugging.
+"""
+import hashlib
+import json
+import random
+import sys
+import traceback
+
+import frappe
+from frappe.utils import add_days, cint, flt, now
+
+# Fraction of events written to the log file; unlisted events are always written
+DEFAULT_SAMPLE_RATES = {
+    "webhook.received": 0.01,
+}
+# Identical errors reach Error Log at most once per window
+ERROR_WINDOW = 300
+RING_SIZE = 200
+RING_KEY = "whatsapp_saas:recent:{0}"
+ERROR_KEY = "whatsapp_saas:error:{0}"
+SUPPRESSED_KEY = "whatsapp_saas:error_suppressed:{0}"
+
+# Error Log titles this app used to write on every request
+SPAM_TITLES = ("WhatsApp Webhook Received", "WhatsApp Proxy Error", "WhatsApp API Error")
+PURGE_BATCH = 5000
+PURGE_MAX_BATCHES = 200
+# Kept for errors that may still be under investigation
+ERROR_RETENTION_DAYS = 7
+
+
+def event(name, **fields):
+    """Write a structured event line, subject to the event's sample rate"""
+    rates = {**DEFAULT_SAMPLE_RATES, **(frappe.conf.get("whatsapp_log_sample_rates") or {})}
+    rate = flt(rates.get(name, 1))
+    if rate < 1 and random.random() >= rate:
+        return
+    _get_logger().info(json.dumps({"event": name, "ts": now(), "sample_rate": rate, **fields}, default=str))
+
+
+def record_payload(kind, payload):
+    """Keep `payload` in a ring buffer of the latest RING_SIZE payloads of this kind"""
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8", "replace")
+    elif not isinstance(payload, str):
+        payload = json.dumps(payload, default=str)
+
+    key = frappe.cache.make_key(RING_KEY.format(kind))
+    pipe = frappe.cache.pipeline()
+    pipe.lpush(key, json.dumps({"ts": now(), "payload": payload}))
+    pipe.ltrim(key, 0, RING_SIZE - 1)
+    pipe.execute()
+
+
+def recent_payloads(kind, limit=50):
+    key = frappe.cache.make_key(RING_KEY.format(kind))
+    pipe = frappe.cache.pipeline()
+    pipe.lrange(key, 0, min(cint(limit) or 50, RING_SIZE) - 1)
+    return [json.loads(item) for item in pipe.execute()[0]]
+
+
+def report_error(title, **context):
+    """
+    Report the exception being handled. Only the first occurrence of a signature
+    in each window reaches Error Log; the rest are counted and logged as events.
+    """
+    exc_type, exc, tb = sys.exc_info()
+    signature = _signature(title, exc_type, tb)
+    event("error", title=title, signature=signature, error=str(exc), **context)
+
+    window_key = frappe.cache.make_key(ERROR_KEY.format(signature))
+    suppressed_key = frappe.cache.make_key(SUPPRESSED_KEY.format(signature))
+    if not frappe.cache.set(window_key, 1, ex=ERROR_WINDOW, nx=True):
+        frappe.cache.incr(suppressed_key)
+        return
+
+    suppressed = cint(frappe.cache.getset(suppressed_key, 0))
+    message = frappe.get_traceback()
+    if context:
+        message += "\n\nContext: " + json.dumps(context, default=str, indent=1)
+    if suppressed:
+        message += f"\n\n{suppressed} identical errors were suppressed since the last report"
+    frappe.log_error(title=title, message=f"[{signature}]\n{message}")
+
+
+def purge_error_log_spam():
+    """Daily: delete the per-request Error Log rows this app used to write, in batches"""
+    filters = [
+        {"method": "WhatsApp Webhook Received"},
+        {"method": ["in", SPAM_TITLES[1:]], "creation": ["<", add_days(now(), -ERROR_RETENTION_DAYS)]},
+    ]
+    for condition in filters:
+        for _i in range(PURGE_MAX_BATCHES):
+            names = frappe.get_all("Error Log", filters=condition, pluck="name", limit=PURGE_BATCH)
+            if not names:
+                break
+            frappe.db.delete("Error Log", {"name": ["in", names]})
+            # Short transactions keep the purge from locking Error Log for long
+            frappe.db.commit()
+
+
+def _signature(title, exc_type, tb):
+    # Where it was raised, not the message, so varying ids and values collapse together
+    frames = traceback.extract_tb(tb)[-3:] if tb else []
+    location = [f"{frame.filename}:{frame.name}:{frame.lineno}" for frame in frames]
+    raw = json.dumps([title, exc_type.__name__ if exc_type else None, location])
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def _get_logger():
+    # frappe.logger keeps one logger per site
+    return frappe.logger("whatsapp_saas", allow_site=True, file_count=10)
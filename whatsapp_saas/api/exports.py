@@ -0,0 +1,114 @@
+"""
+WhatsApp SaaS Chat Exports
+Background jobs that stream a chat out of the message store into a
+gzip-compressed NDJSON or CSV file
+"""
+import csv
+import gzip
+import json
+import os
+
+import frappe
+from frappe import _
+from whatsapp_saas.api import dispatcher, eventlog, messages
+
+DOCTYPE = "WhatsApp Chat Export"
+FORMATS = {"NDJSON": "ndjson", "CSV": "csv"}
+BATCH_SIZE = 1000
+
+
+def start_export(instance, chat_jid=None, export_format="NDJSON"):
+    """Create an export record and queue the job that fills it"""
+    export_format = (export_format or "NDJSON").upper()
+    if export_format not in FORMATS:
+        frappe.throw(_("format must be one of {0}").format(", ".join(FORMATS)))
+
+    export = frappe.get_doc({
+        "doctype": DOCTYPE,
+        "instance": instance,
+        "chat_jid": chat_jid,
+        "export_format": export_format,
+        "status": "Queued",
+    }).insert(ignore_permissions=True)
+
+    dispatcher.submit(
+        frappe.db.get_value("WhatsApp Instance", instance, "whatsapp_customer"),
+        "whatsapp_saas.api.exports.run_export",
+        queue="long",
+        timeout=3600,
+        after_commit=True,
+        export=export.name,
+    )
+    return export
+
+
+def get_status(export_name):
+    """Progress and download link of an export owned by the session user"""
+    export = frappe.db.get_value(
+        DOCTYPE,
+        {"name": export_name, "owner": frappe.session.user},
+        ["name", "status", "progress", "exported_messages", "total_messages", "file_url", "error"],
+        as_dict=True,
+    )
+    if not export:
+        frappe.throw(_("Export not found"), frappe.DoesNotExistError)
+    return export
+
+
+def run_export(export):
+    """Stream messages page by page into a compressed file, reporting progress as it goes"""
+    doc = frappe.get_doc(DOCTYPE, export)
+    extension = FORMATS[doc.export_format]
+    file_name = f"whatsapp-export-{doc.name}.{extension}.gz"
+    path = frappe.get_site_path("private", "files", file_name)
+
+    try:
+        total = messages.count_messages(doc.instance, doc.chat_jid)
+        _update(doc, status="Running", total_messages=total, progress=0)
+
+        exported = 0
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as out:
+            writer = None
+            if extension == "csv":
+                writer = csv.DictWriter(out, fieldnames=messages.FIELDS, extrasaction="ignore")
+                writer.writeheader()
+
+            for batch in messages.iter_messages(doc.instance, doc.chat_jid, BATCH_SIZE):
+                if writer:
+                    writer.writerows(batch)
+                else:
+                    out.writelines(
+                        json.dumps({f: row[f] for f in messages.FIELDS}, default=str) + "\n" for row in batch
+                    )
+                exported += len(batch)
+                _update(
+                    doc,
+                    exported_messages=exported,
+                    progress=min(99, exported * 100 / total) if total else 99,
+                )
+
+        file_doc = frappe.get_doc({
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": f"/private/files/{file_name}",
+            "is_private": 1,
+            "attached_to_doctype": DOCTYPE,
+            "attached_to_name": doc.name,
+        }).insert(ignore_permissions=True)
+        _update(doc, status="Completed", progress=100, file_url=file_doc.file_url)
+
+    except Exception as e:
+        frappe.db.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        eventlog.report_error("WhatsApp Chat Export Error", export=doc.name)
+        _update(doc, status="Failed", error=str(e))
+
+
+def _update(doc, **values):
+    doc.db_set(values, update_modified=False, commit=True)
+    frappe.publish_realtime(
+        "whatsapp_export_progress",
+        {"export_id": doc.name, **{k: doc.get(k) for k in ("status", "progress", "exported_messages", "total_messages", "file_url")}},
+        user=doc.owner,
+    )
@@ -0,0 +1,202 @@
+"""
+WhatsApp SaaS Gateway
+Authorization, quota, caching and logging around a single Baileys call,
+shared by the route endpoints and `api.proxy`
+"""
+import hashlib
+import json
+
+import frappe
+import requests
+from frappe import _
+from frappe.utils import get_first_day, get_last_day, today
+from whatsapp_saas.api import baileys, concurrency, media, messages, replica, routes, singleflight, subscriptions
+
+
+def authorize(instance_id):
+    """Instance row (with its active plan) for an instance the session user may use"""
+    user = frappe.session.user
+    with replica.read_only() as on_replica:
+        instance = _owned_instance(instance_id, user)
+    if not instance and on_replica:
+        # The replica may not have an instance or customer created moments ago
+        instance = _owned_instance(instance_id, user)
+    if not instance:
+        frappe.throw(_("Unauthorized access to instance"), frappe.PermissionError)
+
+    instance.plan = subscriptions.get_active_plan(instance.subscription)
+    if not instance.plan:
+        frappe.throw(_("Subscription not active"))
+
+    instance.instance_id = instance_id
+    return instance
+
+
+def check_quota(instance):
+    max_messages = frappe.get_cached_value("WhatsApp Plan", instance.plan, "max_messages_per_month")
+    # A replica within the allowed lag undercounts by a few seconds of sends at most
+    with replica.read_only():
+        current_usage = frappe.db.count("WhatsApp Message Log", {
+            "subscription": instance.subscription,
+            "billable": 1,
+            "creation": ["between", [get_first_day(today()), get_last_day(today())]]
+        })
+    if current_usage >= max_messages:
+        frappe.throw(_("Monthly message limit reached"))
+
+
+def request_files():
+    if not frappe.request or not frappe.request.files:
+        return None
+    return {k: (v.filename, v.stream, v.content_type) for k, v in frappe.request.files.items()}
+
+
+def call_route(route, instance, data, files=None):
+    """
+    Fill `route`'s path from `data` and forward it. A `media_handle` from the
+    media store is streamed in place of an upload.
+    """
+    path, missing = routes.build_path(route, data)
+    if missing:
+        frappe.throw(_("{0} is required").format(", ".join(missing)))
+    data.pop('instance_id', None)
+
+    # Media uploaded earlier is streamed from the local store instead of the client
+    media_handle = data.pop('media_handle', None) if route.media else None
+    if media_handle:
+        file_field = data.pop('media_field', None) or "file"
+        customer = media.customer_for_user()
+        with media.open_multipart(customer, media_handle, data, file_field) as body:
+            return forward(route, path, instance, data, body=body)
+
+    return forward(route, path, instance, data, files=files)
+
+
+def forward(route, path, instance=None, data=None, files=None, query=False, body=None):
+    """
+    Send one request to Baileys under `route`'s policy and return the parsed response.
+    `query` sends GET payloads as query parameters instead of a JSON body.
+    `body` is a prebuilt (stream, content_type) request body; `data` is then only logged.
+    """
+    data = data or {}
+    if instance and route.quota:
+        check_quota(instance)
+
+    cache_key = None
+    if (route.cache_ttl or route.coalesce) and route.method == "GET" and not files:
+        cache_key = _cache_key(instance, path, data)
+        cached = frappe.cache.get_value(cache_key) if route.cache_ttl else None
+        if cached is not None:
+            return cached
+
+    if body:
+        request_kwargs = {"data": body[0], "headers": {"Content-Type": body[1]}}
+    elif files:
+        request_kwargs = {"data": data, "files": files}
+    elif query and route.method == "GET":
+        request_kwargs = {"params": data}
+    else:
+        request_kwargs = {"json": data}
+
+    def call():
+        try:
+            # Per-customer cap so one tenant cannot hold every worker waiting on Baileys
+            with concurrency.slot(instance and instance.whatsapp_customer, instance and instance.plan, route.timeout):
+                response = baileys.request(
+                    route.method,
+                    path,
+                    timeout=route.timeout,
+                    priority=route.priority,
+                    # Uploads and downloads are slow by size, not by load
+                    sample_latency=not (files or body or route.media) and route.timeout <= 30,
+                    route_class=route.handler,
+                    **request_kwargs,
+                )
+        except baileys.Overloaded as e:
+            frappe.throw(str(e), frappe.TooManyRequestsError)
+        except requests.RequestException as e:
+            frappe.throw(_("Connection to WhatsApp Service failed: {0}").format(str(e)))
+        return response.ok, baileys.parse_response(response)
+
+    if route.coalesce and cache_key:
+        # Keyed like the cache, so a write to the instance starts a fresh flight
+        ok, response_data = singleflight.run(cache_key, call, timeout=route.timeout)
+    else:
+        ok, response_data = call()
+
+    if ok:
+        if cache_key and route.cache_ttl:
+            frappe.cache.set_value(cache_key, response_data, expires_in_sec=route.cache_ttl)
+        elif instance and route.method != "GET":
+            _invalidate_cache(instance)
+
+    if not instance:
+        return response_data
+
+    msg_id = message_id(response_data)
+
+    # Keep a local copy of sent messages for history and search. Sends without a real
+    # id are left to the fromMe upsert, which carries it; the log's LOG- id is never stored.
+    send_type = path.rsplit("/send/", 1)[-1] if "/send/" in path else None
+    if ok and send_type and send_type != "reaction" and msg_id and isinstance(data, dict):
+        messages.store_outbound(instance.name, data, msg_id, send_type)
+
+    if route.log:
+        frappe.get_doc({
+            "doctype": "WhatsApp Message Log",
+            "instance": instance.name,
+            "message_id": msg_id or "LOG-" + frappe.generate_hash(length=10),
+            "timestamp": frappe.utils.now(),
+            "status": "Sent" if ok else "Failed",
+            "direction": "Outbound",
+            "whatsapp_customer": instance.whatsapp_customer,
+            "subscription": instance.subscription,
+            "billable": int(route.quota),
+            # Undeclared proxy calls are recorded by their Baileys path
+            "endpoint": route.handler if route.path else path.split("/", 2)[-1],
+            "request_data": json.dumps(data, default=str) if not files else str(data),
+            "response_data": json.dumps(response_data) if isinstance(response_data, dict) else str(response_data)
+        }).insert(ignore_permissions=True)
+
+    return response_data
+
+
+def _owned_instance(instance_id, user):
+    instance = frappe.db.get_value(
+        "WhatsApp Instance",
+        {"instance_id": instance_id},
+        ["name", "owner", "whatsapp_customer", "subscription"],
+        as_dict=True,
+    )
+    if not instance:
+        return None
+
+    if instance.owner != user:
+        customer = frappe.db.get_value("WhatsApp Customer", {"user": user}, "name")
+        if not customer or instance.whatsapp_customer != customer:
+            return None
+    return instance
+
+
+def message_id(response_data):
+    """WhatsApp message id in a Baileys send response, if any"""
+    if not isinstance(response_data, dict):
+        return None
+    key = response_data.get('key')
+    return (isinstance(key, dict) and key.get('id')) or response_data.get('id') or response_data.get('messageId')
+
+
+def _cache_key(instance, path, data):
+    scope = instance.name if instance else "global"
+    version = frappe.cache.get(_version_key(scope))
+    digest = hashlib.sha1(json.dumps([path, data], sort_keys=True, default=str).encode()).hexdigest()
+    return f"whatsapp_saas:route_cache:{scope}:{int(version or 0)}:{digest}"
+
+
+def _invalidate_cache(instance):
+    # Successful writes bump the instance's cache version so cached reads miss
+    frappe.cache.incr(_version_key(instance.name))
+
+
+def _version_key(scope):
+    return frappe.cache.make_key(f"whatsapp_saas:route_cache_version:{scope}")
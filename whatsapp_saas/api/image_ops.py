@@ -0,0 +1,93 @@
+"""
+WhatsApp SaaS Image Operations
+Pure Pillow transforms run inside the media process pool. Kept free of frappe
+imports so pool workers start quickly and hold no site state.
+"""
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+THUMBNAIL_DEFAULTS = {"width": 320, "height": 320, "quality": 70, "format": "jpeg"}
+OPTIMIZE_DEFAULTS = {"max_width": 1600, "max_height": 1600, "quality": 80, "format": None}
+
+
+def normalize_params(operation, params):
+    """Fill defaults and coerce types so equal requests produce equal cache keys"""
+    defaults = THUMBNAIL_DEFAULTS if operation == "thumbnail" else OPTIMIZE_DEFAULTS
+    normalized = {}
+    for key, default in defaults.items():
+        value = params.get(key)
+        if value in (None, ""):
+            value = default
+        if key == "format":
+            value = str(value).lower() if value else None
+            if value and value not in FORMATS:
+                raise ValueError(f"Unsupported format {value}")
+        else:
+            value = max(1, int(value))
+        normalized[key] = value
+    normalized["quality"] = min(normalized["quality"], 95)
+    return normalized
+
+
+def render(src_path, out_dir, operation, params):
+    """
+    Apply `operation` ("thumbnail" or "optimize") to the image at `src_path` and
+    write the result into `out_dir` under its SHA-256. Returns the output's metadata.
+    """
+    with Image.open(src_path) as source:
+        image = ImageOps.exif_transpose(source)
+        if operation == "thumbnail":
+            image.thumbnail((params["width"], params["height"]))
+        elif operation == "optimize":
+            if image.width > params["max_width"] or image.height > params["max_height"]:
+                image.thumbnail((params["max_width"], params["max_height"]))
+        else:
+            raise ValueError(f"Unknown operation {operation}")
+
+        pil_format, content_type = _output_format(image, source.format, params.get("format"))
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        save_kwargs = {"optimize": True}
+        if pil_format in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = params["quality"]
+        buffer = BytesIO()
+        image.save(buffer, pil_format, **save_kwargs)
+        width, height = image.size
+
+    data = buffer.getvalue()
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = os.path.join(out_dir, content_hash)
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=".render-")
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+
+    return {
+        "content_hash": content_hash,
+        "size": len(data),
+        "width": width,
+        "height": height,
+        "content_type": content_type,
+    }
+
+
+def _output_format(image, source_format, requested):
+    if requested:
+        return FORMATS[requested]
+    if source_format and source_format.lower() in FORMATS:
+        return FORMATS[source_format.lower()]
+    has_alpha = image.mode in ("RGBA", "LA", "P")
+    return FORMATS["png"] if has_alpha else FORMATS["jpeg"]
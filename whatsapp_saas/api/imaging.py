@@ -0,0 +1,176 @@
+"""
+WhatsApp SaaS Media Processing
+Thumbnails and image optimization run locally in a process pool instead of on
+the Baileys event loop, bounded site-wide by render leases in Redis; the
+calling request waits for its batch. Results are cached by input hash and
+transform parameters and registered in the media store, so the output can be
+sent by handle like any other upload.
+"""
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+from whatsapp_saas.api import concurrency, image_ops, media
+
+OPERATIONS = ("thumbnail", "optimize")
+MAX_BATCH = 50
+TASK_TIMEOUT = 60
+# Total time a request waits for its whole batch
+BATCH_TIMEOUT = 90
+# Renders running at once across every web worker and node
+DEFAULT_RENDER_LIMIT = 4
+RENDER_SLOTS_KEY = "whatsapp_saas:media_render_slots"
+SLOT_POLL = 0.1
+RESULT_CACHE_TTL = 7 * 24 * 3600
+# Thumbnails up to this size are also returned inline as base64
+INLINE_LIMIT = 256 * 1024
+
+_executor = None
+
+
+def process(customer, items):
+    """
+    Run a batch of (media row, operation, params) items through the pool.
+    Returns one result dict per item, in order; failures do not affect other items.
+    The request waits for the batch, up to BATCH_TIMEOUT in total.
+    """
+    if len(items) > MAX_BATCH:
+        frappe.throw(_("At most {0} images per batch").format(MAX_BATCH))
+
+    out_dir = frappe.get_site_path(*media.MEDIA_DIR)
+    results = [None] * len(items)
+    queue = []
+
+    for i, (source, operation, params) in enumerate(items):
+        try:
+            if operation not in OPERATIONS:
+                raise ValueError(f"Unknown operation {operation}")
+            params = image_ops.normalize_params(operation, params or {})
+        except (TypeError, ValueError) as e:
+            results[i] = {"error": str(e)}
+            continue
+
+        key = _cache_key(source.content_hash, operation, params)
+        cached = frappe.cache.get_value(key)
+        if cached and os.path.exists(os.path.join(out_dir, cached["content_hash"])):
+            results[i] = cached
+            continue
+        queue.append((i, key, frappe.get_site_path(source.file_path), operation, params))
+
+    _render(queue, out_dir, results)
+    return [_response(customer, items[i], result) for i, result in enumerate(results)]
+
+
+def _render(queue, out_dir, results):
+    # Every render holds a site-wide lease, so all web workers together run at
+    # most `whatsapp_media_render_limit` renders however many pools they own
+    limit = cint(frappe.conf.get("whatsapp_media_render_limit")) or DEFAULT_RENDER_LIMIT
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    running = {}
+
+    try:
+        while queue or running:
+            while queue and len(running) < _pool_size():
+                token = concurrency.try_acquire(RENDER_SLOTS_KEY, limit, TASK_TIMEOUT)
+                if not token:
+                    break
+                i, key, path, operation, params = queue.pop(0)
+                try:
+                    future = _get_executor().submit(image_ops.render, path, out_dir, operation, params)
+                except BrokenProcessPool:
+                    _reset_executor()
+                    concurrency.release(RENDER_SLOTS_KEY, token)
+                    results[i] = {"error": "Media worker crashed"}
+                    continue
+                running[future] = (i, key, token)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not running:
+                # Every render slot is busy elsewhere; wait for one to free up
+                time.sleep(min(SLOT_POLL, remaining))
+                continue
+
+            done, _not_done = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, key, token = running.pop(future)
+                concurrency.release(RENDER_SLOTS_KEY, token)
+                results[i] = _result(future, key)
+    finally:
+        for future, (i, _key, token) in running.items():
+            # A render that already started keeps its lease until it expires
+            if future.cancel():
+                concurrency.release(RENDER_SLOTS_KEY, token)
+            results[i] = {"error": "Timed out"}
+        for i, *_rest in queue:
+            results[i] = {"error": "Media processing is busy, retry shortly"}
+
+
+def _result(future, key):
+    try:
+        rendered = future.result()
+    except BrokenProcessPool:
+        _reset_executor()
+        return {"error": "Media worker crashed"}
+    except Exception as e:
+        return {"error": str(e) or type(e).__name__}
+
+    frappe.cache.set_value(key, rendered, expires_in_sec=RESULT_CACHE_TTL)
+    return rendered
+
+
+def _response(customer, item, result):
+    if "error" in result:
+        return {"success": False, "error": result["error"]}
+
+    source, operation, _params = item
+    stored, _existed = media.register(
+        customer,
+        result["content_hash"],
+        os.path.join(*media.MEDIA_DIR, result["content_hash"]),
+        result["size"],
+        f"{operation}-{source.file_name}",
+        result["content_type"],
+    )
+    data = {**media.as_response(stored), "width": result["width"], "height": result["height"]}
+    if operation == "thumbnail" and result["size"] <= INLINE_LIMIT:
+        with open(frappe.get_site_path(stored.file_path), "rb") as f:
+            data["base64"] = base64.b64encode(f.read()).decode()
+    return {"success": True, "data": data}
+
+
+def _cache_key(content_hash, operation, params):
+    digest = hashlib.sha256(
+        json.dumps([content_hash, operation, params], sort_keys=True).encode()
+    ).hexdigest()
+    return f"whatsapp_saas:media_render:{digest}"
+
+
+def _pool_size():
+    return cint(frappe.conf.get("whatsapp_media_workers")) or min(4, os.cpu_count() or 1)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: pool workers must not inherit the web worker's sockets and DB connections
+        _executor = ProcessPoolExecutor(
+            max_workers=_pool_size(), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def _reset_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
@@ -0,0 +1,174 @@
+"""
+WhatsApp SaaS Instance State
+Latest connection status and QR code per instance, kept in Redis from the
+Baileys webhook and pushed to the owner over realtime, so pairing screens do
+not have to poll Baileys
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+import requests
+from whatsapp_saas.api import baileys, concurrency, subscriptions
+
+STATUS_KEY = "whatsapp_saas:instance_status:{0}"
+QR_KEY = "whatsapp_saas:instance_qr:{0}"
+# Webhooks keep the status fresh; the TTL only bounds drift if one is missed
+STATUS_TTL = 300
+# WhatsApp rotates pairing QR codes roughly every 20 seconds
+QR_TTL = 20
+
+# Bounded fan-out for instance_status_bulk cache misses
+BULK_WORKERS = 8
+BULK_TIMEOUT = 10
+
+STATUS_MAP = {
+    "connected": "Connected",
+    "connecting": "Connecting",
+    "disconnected": "Disconnected",
+    "logged_out": "Disconnected",
+    "qr": "Disconnected",
+}
+
+
+def get_status(instance_id):
+    return frappe.cache.get_value(STATUS_KEY.format(instance_id))
+
+
+def get_qr(instance_id):
+    return frappe.cache.get_value(QR_KEY.format(instance_id))
+
+
+def update_status(instance, status, phone_number=None):
+    """
+    Record a Baileys status for `instance` (a WhatsApp Instance doc): cache it,
+    and save the doc and push it to the owner only if the mapped status changed.
+    Returns the cached Baileys-style response.
+    """
+    response = _cache_status(instance.instance_id, status, phone_number)
+    mapped, phone_number = _resolve(instance, status, phone_number)
+
+    if mapped != instance.status or phone_number != instance.phone_number:
+        instance.status = mapped
+        instance.phone_number = phone_number
+        instance.save(ignore_permissions=True)
+        frappe.db.commit()
+        _publish_status(instance, mapped, phone_number)
+
+    if status == "connected":
+        frappe.cache.delete_value(QR_KEY.format(instance.instance_id))
+    return response
+
+
+def update_qr(instance, qr):
+    """Cache a new pairing QR and push it to the owner"""
+    response = {"success": True, "data": {"qr": qr}}
+    frappe.cache.set_value(QR_KEY.format(instance.instance_id), response, expires_in_sec=QR_TTL)
+    frappe.publish_realtime(
+        "whatsapp_instance_qr",
+        {"instance_id": instance.instance_id, "qr": qr},
+        user=instance.owner,
+    )
+    return response
+
+
+def get_statuses_bulk(instances, refresh=False):
+    """
+    instance_id -> Baileys-style status response for many instances at once.
+    `instances` are rows of one customer with name, instance_id, owner, status,
+    phone_number, whatsapp_customer and subscription. Cache misses are fetched
+    concurrently, under the customer's concurrency slots and the Baileys
+    adaptive limit like any other call; only changed rows are written back, in
+    one transaction.
+    """
+    results = {}
+    misses = []
+    for row in instances:
+        cached = None if refresh else get_status(row.instance_id)
+        if cached:
+            results[row.instance_id] = cached
+        else:
+            misses.append(row)
+    if not misses:
+        return results
+
+    owner = misses[0]
+    plan = subscriptions.get_active_plan(owner.subscription) if owner.subscription else None
+    # The fan-out is only as wide as the slots the customer has free
+    with concurrency.slots(owner.whatsapp_customer, plan, min(BULK_WORKERS, len(misses)), BULK_TIMEOUT) as width:
+        with ThreadPoolExecutor(max_workers=width) as pool:
+            # Each task runs in a copy of this context, so it sees the site's frappe.local
+            futures = [
+                pool.submit(contextvars.copy_context().run, _fetch_status, row.instance_id) for row in misses
+            ]
+            fetched = [future.result() for future in futures]
+
+    changed = []
+    for row, response in zip(misses, fetched, strict=True):
+        if not response.get("success"):
+            results[row.instance_id] = response
+            continue
+        data = response.get("data") or {}
+        results[row.instance_id] = _cache_status(row.instance_id, data.get("status"), data.get("phoneNumber"))
+        mapped, phone_number = _resolve(row, data.get("status"), data.get("phoneNumber"))
+        if mapped != row.status or phone_number != row.phone_number:
+            changed.append((row, mapped, phone_number))
+
+    if changed:
+        for row, mapped, phone_number in changed:
+            frappe.db.set_value("WhatsApp Instance", row.name, {"status": mapped, "phone_number": phone_number})
+        # Keep the customer's instance table in step, as WhatsApp Instance.on_update does
+        for mapped in {mapped for _row, mapped, _phone in changed}:
+            names = tuple(row.name for row, status, _phone in changed if status == mapped)
+            frappe.db.sql(
+                "update `tabWhatsApp Instance Summary` set status = %s where instance in %s",
+                (mapped, names),
+            )
+        frappe.db.commit()
+        for row, mapped, phone_number in changed:
+            _publish_status(row, mapped, phone_number)
+
+    return results
+
+
+def _fetch_status(instance_id):
+    try:
+        response = baileys.request(
+            "GET",
+            f"instance/{instance_id}/status",
+            timeout=BULK_TIMEOUT,
+            priority=baileys.PRIORITY_LOW,
+            route_class="instance_status",
+        )
+        return response.json()
+    except baileys.Overloaded as e:
+        return {"success": False, "error": str(e)}
+    except (requests.RequestException, ValueError) as e:
+        return {"success": False, "error": str(e) or type(e).__name__}
+
+
+def _cache_status(instance_id, status, phone_number):
+    response = {"success": True, "data": {"status": status, "phoneNumber": phone_number}}
+    frappe.cache.set_value(STATUS_KEY.format(instance_id), response, expires_in_sec=STATUS_TTL)
+    return response
+
+
+def _resolve(instance, status, phone_number):
+    """Stored (status, phone_number) for a Baileys status"""
+    # Statuses we do not model leave the stored one alone
+    mapped = STATUS_MAP.get(status, instance.status)
+    if status == "connected":
+        phone_number = phone_number or instance.phone_number
+    elif mapped == "Disconnected":
+        phone_number = None
+    else:
+        phone_number = instance.phone_number
+    return mapped, phone_number
+
+
+def _publish_status(instance, status, phone_number):
+    frappe.publish_realtime(
+        "whatsapp_instance_status",
+        {"instance_id": instance.instance_id, "status": status, "phone_number": phone_number},
+        user=instance.owner,
+    )
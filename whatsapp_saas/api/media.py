@@ -0,0 +1,191 @@
+"""
+WhatsApp SaaS Media Store
+Content-addressed uploads: a file is uploaded once, stored under its SHA-256
+and referenced by handle in later send calls. Stored files are streamed to
+Baileys from a read-only memory map instead of being re-uploaded by clients.
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+import frappe
+from frappe import _
+
+DOCTYPE = "WhatsApp Media"
+MEDIA_DIR = ("private", "files", "whatsapp_media")
+CHUNK_SIZE = 1024 * 1024
+
+
+def customer_for_user(user=None):
+    customer = frappe.db.get_value("WhatsApp Customer", {"user": user or frappe.session.user}, "name")
+    if not customer:
+        frappe.throw(_("No WhatsApp Customer linked to this user"), frappe.PermissionError)
+    return customer
+
+
+def store_upload(customer, file_storage):
+    """Stream an uploaded file to disk while hashing it; returns (media row, already_stored)"""
+    directory = frappe.get_site_path(*MEDIA_DIR)
+    os.makedirs(directory, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := file_storage.stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        if not size:
+            frappe.throw(_("Uploaded file is empty"))
+
+        content_hash = digest.hexdigest()
+        path = os.path.join(directory, content_hash)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return register(
+        customer,
+        content_hash,
+        os.path.join(*MEDIA_DIR, content_hash),
+        size,
+        file_storage.filename,
+        file_storage.content_type,
+    )
+
+
+def register(customer, content_hash, file_path, file_size, file_name=None, content_type=None):
+    """Media row for content already on disk; returns (media row, already_registered)"""
+    existing = get_media(customer, content_hash)
+    if existing:
+        return existing, True
+
+    frappe.get_doc({
+        "doctype": DOCTYPE,
+        "whatsapp_customer": customer,
+        "content_hash": content_hash,
+        "file_name": file_name or content_hash,
+        "content_type": content_type or "application/octet-stream",
+        "file_size": file_size,
+        "file_path": file_path,
+    }).insert(ignore_permissions=True)
+    return get_media(customer, content_hash), False
+
+
+def get_media(customer, content_hash):
+    return frappe.db.get_value(
+        DOCTYPE,
+        {"whatsapp_customer": customer, "content_hash": content_hash},
+        ["content_hash", "file_name", "content_type", "file_size", "file_path"],
+        as_dict=True,
+    )
+
+
+def as_response(media):
+    return {
+        "media_handle": media.content_hash,
+        "file_name": media.file_name,
+        "content_type": media.content_type,
+        "size": media.file_size,
+    }
+
+
+@contextmanager
+def open_multipart(customer, handle, fields, file_field="file"):
+    """
+    Multipart body for `fields` plus the stored file behind `handle`, as
+    (body, content_type). Valid only inside the `with` block.
+    """
+    media = get_media(customer, handle)
+    if not media:
+        frappe.throw(_("Unknown media_handle"), frappe.DoesNotExistError)
+
+    with open(frappe.get_site_path(media.file_path), "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    body = _MultipartBody(fields, file_field, media, mapped)
+    try:
+        yield body, body.content_type
+    finally:
+        body.close()
+        try:
+            mapped.close()
+        except BufferError:
+            # A slice handed to the socket layer is still alive; unmapped once it is collected
+            pass
+
+
+class _MultipartBody:
+    """
+    File-like multipart/form-data body. The file part is served as slices of the
+    memory map, so the HTTP client writes straight from the page cache without
+    copying the whole file into a Python bytes object first.
+    """
+
+    def __init__(self, fields, file_field, media, mapped):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        head = []
+        for key, value in fields.items():
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            head.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(key)}"\r\n\r\n{value}\r\n'
+            )
+        content_type = _quote(media.content_type or "application/octet-stream")
+        head.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(file_field)}"; '
+            f'filename="{_quote(media.file_name)}"\r\nContent-Type: {content_type}\r\n\r\n'
+        )
+
+        self._parts = [
+            memoryview("".join(head).encode()),
+            memoryview(mapped),
+            memoryview(f"\r\n--{boundary}--\r\n".encode()),
+        ]
+        self._length = sum(len(part) for part in self._parts)
+        self._part = 0
+        self._offset = 0
+
+    def close(self):
+        for part in self._parts:
+            try:
+                part.release()
+            except BufferError:
+                pass
+        self._parts = []
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        while self._part < len(self._parts):
+            part = self._parts[self._part]
+            if self._offset < len(part):
+                end = len(part) if size is None or size < 0 else self._offset + size
+                chunk = part[self._offset : end]
+                self._offset += len(chunk)
+                return chunk
+            self._part += 1
+            self._offset = 0
+        return b""
+
+
+def _quote(value):
+    # Client-supplied names go inside quoted header parameters; escaped as browsers do
+    # (WHATWG multipart/form-data) so they cannot end the quote or start a new header
+    return str(value).replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
@@ -0,0 +1,277 @@
+"""
+WhatsApp SaaS Message Store
+Local, indexed copy of inbound and outbound messages so history, listing and
+search do not depend on the Baileys in-memory store
+"""
+import base64
+import hashlib
+import json
+import re
+from datetime import datetime
+
+import frappe
+from frappe import _
+from frappe.utils import convert_utc_to_system_timezone, get_datetime
+from whatsapp_saas.api import replica
+from whatsapp_saas.api.usage import record_usage
+
+DOCTYPE = "WhatsApp Message"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+FIELDS = ["instance", "chat_jid", "message_id", "timestamp", "direction", "sender", "message_type", "body"]
+
+# Keys Baileys puts next to the actual content inside `message`
+_CONTENT_META_KEYS = {"messageContextInfo", "senderKeyDistributionMessage"}
+
+
+def store_messages(instance, payload):
+    """Persist a Baileys `messages.upsert` payload (a single message or {"messages": [...]})"""
+    if isinstance(payload, dict) and "messages" in payload:
+        messages = payload.get("messages") or []
+    elif isinstance(payload, list):
+        messages = payload
+    else:
+        messages = [payload]
+
+    rows = [row for row in (_row_from_baileys(instance, m) for m in messages if isinstance(m, dict)) if row]
+    inserted = _insert(rows)
+    record_usage(instance, "inbound", sum(1 for row in inserted if row["direction"] == "Inbound"))
+
+
+def store_outbound(instance, request_data, message_id, message_type="text"):
+    """Persist a message sent through the proxy, built from the request payload"""
+    chat_jid = _to_jid(
+        request_data.get("jid") or request_data.get("to") or request_data.get("number") or request_data.get("chatId")
+    )
+    # Only real WhatsApp ids: a placeholder would be duplicated by the fromMe upsert carrying the real one
+    if not chat_jid or not message_id or message_id.startswith("LOG-"):
+        return
+
+    body = request_data.get("text") or request_data.get("message") or request_data.get("caption")
+    _insert([{
+        "instance": instance,
+        "chat_jid": chat_jid,
+        "message_id": message_id,
+        "timestamp": frappe.utils.now_datetime(),
+        "direction": "Outbound",
+        "sender": None,
+        "message_type": message_type,
+        "body": body if isinstance(body, str) else None,
+    }])
+
+
+def get_page(instance, chat_jid=None, cursor=None, limit=None):
+    """Newest-first page of messages for an instance, optionally limited to one chat"""
+    conditions = ["instance = %(instance)s"]
+    values = {"instance": instance}
+    if chat_jid:
+        conditions.append("chat_jid = %(chat_jid)s")
+        values["chat_jid"] = _to_jid(chat_jid)
+
+    return _page(conditions, values, cursor, limit)
+
+
+def search(instance, query, chat_jid=None, cursor=None, limit=None):
+    """Full-text search over message bodies, newest first"""
+    terms = re.findall(r"\w+", query or "")
+    if not terms:
+        frappe.throw(_("query is required"))
+
+    conditions = ["instance = %(instance)s"]
+    values = {"instance": instance}
+    if chat_jid:
+        conditions.append("chat_jid = %(chat_jid)s")
+        values["chat_jid"] = _to_jid(chat_jid)
+
+    if frappe.db.db_type == "mariadb":
+        conditions.append("match(body) against (%(query)s in boolean mode)")
+        values["query"] = " ".join(f"+{term}*" for term in terms)
+    else:
+        for i, term in enumerate(terms):
+            conditions.append(f"body like %(term_{i})s")
+            values[f"term_{i}"] = f"%{term}%"
+
+    return _page(conditions, values, cursor, limit)
+
+
+def iter_messages(instance, chat_jid=None, batch_size=1000):
+    """Yield batches of messages oldest first, walking the (instance, chat, timestamp) index"""
+    values = {"instance": instance}
+    base_conditions = ["instance = %(instance)s"]
+    if chat_jid:
+        base_conditions.append("chat_jid = %(chat_jid)s")
+        values["chat_jid"] = _to_jid(chat_jid)
+
+    last = None
+    while True:
+        conditions = list(base_conditions)
+        if last:
+            values["after_ts"], values["after_name"] = last.timestamp, last.name
+            conditions.append(
+                "(timestamp > %(after_ts)s or (timestamp = %(after_ts)s and name > %(after_name)s))"
+            )
+
+        with replica.read_only():
+            rows = frappe.db.sql(
+                f"""
+                select name, {", ".join(FIELDS)}
+                from `tab{DOCTYPE}`
+                where {" and ".join(conditions)}
+                order by timestamp asc, name asc
+                limit {int(batch_size)}
+                """,
+                values,
+                as_dict=True,
+            )
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def count_messages(instance, chat_jid=None):
+    filters = {"instance": instance}
+    if chat_jid:
+        filters["chat_jid"] = _to_jid(chat_jid)
+    with replica.read_only():
+        return frappe.db.count(DOCTYPE, filters)
+
+
+def _page(conditions, values, cursor, limit):
+    limit = _page_size(limit)
+    if cursor:
+        values["cursor_ts"], values["cursor_name"] = _decode_cursor(cursor)
+        conditions.append(
+            "(timestamp < %(cursor_ts)s or (timestamp = %(cursor_ts)s and name < %(cursor_name)s))"
+        )
+
+    with replica.read_only():
+        rows = frappe.db.sql(
+            f"""
+            select name, {", ".join(FIELDS)}
+            from `tab{DOCTYPE}`
+            where {" and ".join(conditions)}
+            order by timestamp desc, name desc
+            limit {limit + 1}
+            """,
+            values,
+            as_dict=True,
+        )
+
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {
+        "success": True,
+        "data": {"messages": rows[:limit], "next_cursor": next_cursor},
+    }
+
+
+def _insert(rows):
+    """Insert the rows not stored yet; returns those rows"""
+    named = {_message_name(row["instance"], row["message_id"]): row for row in rows}
+    if not named:
+        return []
+
+    # Names are derived from (instance, message_id) so redelivered webhooks are no-ops
+    existing = set(frappe.get_all(DOCTYPE, filters={"name": ["in", list(named)]}, pluck="name"))
+    new = {name: row for name, row in named.items() if name not in existing}
+    if not new:
+        return []
+
+    now = frappe.utils.now()
+    user = frappe.session.user
+    values = [(name, now, now, user, user, *(row[f] for f in FIELDS)) for name, row in new.items()]
+    # ignore_duplicates still covers a concurrent delivery of the same message
+    frappe.db.bulk_insert(
+        DOCTYPE,
+        fields=["name", "creation", "modified", "owner", "modified_by", *FIELDS],
+        values=values,
+        ignore_duplicates=True,
+    )
+    return list(new.values())
+
+
+def _row_from_baileys(instance, message):
+    key = message.get("key") or {}
+    message_id = key.get("id") or message.get("id")
+    chat_jid = key.get("remoteJid") or message.get("chatId") or message.get("from")
+    if not message_id or not chat_jid:
+        return None
+
+    from_me = key.get("fromMe", message.get("fromMe"))
+    message_type, body = _extract_content(message.get("message") or {})
+    if body is None:
+        body = message.get("body") or message.get("text")
+
+    return {
+        "instance": instance,
+        "chat_jid": chat_jid,
+        "message_id": message_id,
+        "timestamp": _parse_timestamp(message.get("messageTimestamp") or message.get("timestamp")),
+        "direction": "Outbound" if from_me else "Inbound",
+        "sender": key.get("participant") or (None if from_me else chat_jid),
+        "message_type": message_type or message.get("type"),
+        "body": body,
+    }
+
+
+def _extract_content(content):
+    for type_key, value in content.items():
+        if type_key in _CONTENT_META_KEYS:
+            continue
+        if type_key == "conversation":
+            return "text", value
+        message_type = type_key[: -len("Message")] if type_key.endswith("Message") else type_key
+        if message_type == "extendedText":
+            message_type = "text"
+        if isinstance(value, dict):
+            return message_type, value.get("text") or value.get("caption") or value.get("fileName")
+        return message_type, None
+    return None, None
+
+
+def _parse_timestamp(value):
+    # Baileys sends unix seconds, sometimes serialised as a protobuf Long {"low": .., "high": ..}
+    if isinstance(value, dict):
+        value = value.get("low")
+    try:
+        utc = datetime.utcfromtimestamp(int(value))
+    except (TypeError, ValueError):
+        return frappe.utils.now_datetime()
+    return convert_utc_to_system_timezone(utc).replace(tzinfo=None)
+
+
+def _to_jid(value):
+    if not value:
+        return None
+    value = str(value)
+    if "@" in value:
+        return value
+    digits = re.sub(r"\D", "", value)
+    return f"{digits}@s.whatsapp.net" if digits else None
+
+
+def _message_name(instance, message_id):
+    return hashlib.sha1(f"{instance}:{message_id}".encode()).hexdigest()[:20]
+
+
+def _page_size(limit):
+    try:
+        limit = int(limit or DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _encode_cursor(row):
+    raw = json.dumps([str(row.timestamp), row.name])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        timestamp, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return get_datetime(timestamp), name
+    except Exception:
+        frappe.throw(_("Invalid cursor"))
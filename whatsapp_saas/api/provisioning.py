@@ -0,0 +1,230 @@
+"""
+WhatsApp SaaS Bulk Provisioning
+Creates Users, API keys, WhatsApp Customers and WhatsApp Subscriptions for
+many tenants at once with batched inserts, one transaction per chunk
+"""
+import json
+
+import frappe
+from frappe import _
+from frappe.query_builder import Table
+from frappe.utils import add_months, now, today, validate_email_address
+from frappe.utils.password import encrypt, passlibctx
+from whatsapp_saas.api import eventlog
+from whatsapp_saas.api.subscriptions import cache_subscription
+
+JOB_DOCTYPE = "WhatsApp Provisioning Job"
+CHUNK_SIZE = 500
+SYNC_LIMIT = 200
+DEFAULT_PLAN = "Free Plan"
+ROLE_PROFILE = "Customer"
+MODULE_PROFILE = "WhatsApp"
+
+REQUIRED_FIELDS = ["customer_name", "email", "phone"]
+
+
+def provision(tenants, on_chunk=None):
+    """
+    Provision a list of tenant dicts (customer_name, email, phone, optional password and plan).
+
+    Returns (results, errors): one entry per created tenant and one per rejected row,
+    both carrying the row's index in `tenants`.
+    """
+    context = _load_context()
+    results, errors = [], []
+    # User names are lowercased emails, and the primary key compares case-insensitively
+    tenants = [_normalize(tenant) for tenant in tenants]
+
+    for start in range(0, len(tenants), CHUNK_SIZE):
+        chunk = list(enumerate(tenants[start : start + CHUNK_SIZE], start))
+        valid, rejected = _validate(chunk, context)
+        errors.extend(rejected)
+
+        if valid:
+            try:
+                created = _insert_chunk(valid, context)
+                frappe.db.commit()
+                results.extend(created)
+                for row in created:
+                    cache_subscription(row["subscription"], row["plan"], True)
+            except Exception as e:
+                frappe.db.rollback()
+                errors.extend(_row_error(i, tenant, str(e)) for i, tenant in valid)
+
+        if on_chunk:
+            on_chunk(results, errors)
+
+    return results, errors
+
+
+def start_job(tenants):
+    job = frappe.get_doc({
+        "doctype": JOB_DOCTYPE,
+        "status": "Queued",
+        "total_rows": len(tenants),
+    }).insert(ignore_permissions=True)
+
+    frappe.enqueue(
+        "whatsapp_saas.api.provisioning.run_job",
+        queue="long",
+        timeout=3600,
+        enqueue_after_commit=True,
+        job=job.name,
+        tenants=tenants,
+    )
+    return job
+
+
+def run_job(job, tenants):
+    doc = frappe.get_doc(JOB_DOCTYPE, job)
+    doc.db_set("status", "Running", commit=True)
+
+    def report(results, errors):
+        doc.db_set({
+            "succeeded": len(results),
+            "failed": len(errors),
+            "results": json.dumps(results),
+            "errors": json.dumps(errors),
+        }, commit=True)
+
+    try:
+        provision(tenants, on_chunk=report)
+        doc.db_set("status", "Completed", commit=True)
+    except Exception:
+        frappe.db.rollback()
+        eventlog.report_error("WhatsApp Provisioning Error", provisioning_job=job)
+        doc.db_set("status", "Failed", commit=True)
+
+
+def _load_context():
+    """Everything that is the same for every row, fetched once per batch"""
+    roles = frappe.get_all("Has Role", filters={"parenttype": "Role Profile", "parent": ROLE_PROFILE}, pluck="role")
+    desk_roles = frappe.get_all("Role", filters={"name": ["in", roles or [""]], "desk_access": 1}, pluck="name")
+    blocked_modules = frappe.get_all(
+        "Block Module", filters={"parenttype": "Module Profile", "parent": MODULE_PROFILE}, pluck="module"
+    )
+    return frappe._dict(
+        roles=roles,
+        user_type="System User" if desk_roles else "Website User",
+        blocked_modules=blocked_modules,
+        plans=set(frappe.get_all("WhatsApp Plan", pluck="name")),
+        owner=frappe.session.user,
+    )
+
+
+def _validate(chunk, context):
+    emails = [t.get("email") for _i, t in chunk if isinstance(t, dict) and t.get("email")]
+    names = [t.get("customer_name") for _i, t in chunk if isinstance(t, dict) and t.get("customer_name")]
+    existing_emails = set(frappe.get_all("User", filters={"name": ["in", emails or [""]]}, pluck="name"))
+    existing_names = set(
+        frappe.get_all("WhatsApp Customer", filters={"customer_name": ["in", names or [""]]}, pluck="customer_name")
+    )
+
+    valid, rejected = [], []
+    for i, tenant in chunk:
+        if not isinstance(tenant, dict):
+            rejected.append(_row_error(i, {}, _("Row must be an object")))
+            continue
+
+        missing = [f for f in REQUIRED_FIELDS if not tenant.get(f)]
+        plan = tenant.get("plan") or DEFAULT_PLAN
+        if missing:
+            error = _("Missing required field: {0}").format(", ".join(missing))
+        elif not validate_email_address(tenant["email"]):
+            error = _("Invalid email address")
+        elif tenant["email"] in existing_emails:
+            error = _("User already exists")
+        elif tenant["customer_name"] in existing_names:
+            error = _("Customer name already exists")
+        elif plan not in context.plans:
+            error = _("Unknown plan {0}").format(plan)
+        else:
+            error = None
+
+        if error:
+            rejected.append(_row_error(i, tenant, error))
+            continue
+
+        # Later duplicates inside the same batch are rejected like existing ones
+        existing_emails.add(tenant["email"])
+        existing_names.add(tenant["customer_name"])
+        valid.append((i, tenant))
+
+    return valid, rejected
+
+
+def _insert_chunk(rows, context):
+    timestamp = now()
+    owner = context.owner
+    start_date = today()
+    end_date = add_months(start_date, 1)
+    std = (timestamp, timestamp, owner, owner)
+    std_fields = ["creation", "modified", "owner", "modified_by"]
+
+    users, roles, blocks, auth, customers, subscriptions, created = [], [], [], [], [], [], []
+    for i, tenant in rows:
+        email = tenant["email"]
+        plan = tenant.get("plan") or DEFAULT_PLAN
+        api_key = frappe.generate_hash(length=15)
+        api_secret = frappe.generate_hash(length=32)
+        subscription = frappe.generate_hash(length=10)
+
+        users.append((
+            email, *std, email, tenant["customer_name"], tenant["customer_name"], 1,
+            context.user_type, ROLE_PROFILE, MODULE_PROFILE, api_key,
+        ))
+        roles.extend(
+            (frappe.generate_hash(length=10), *std, email, "User", "roles", idx, role)
+            for idx, role in enumerate(context.roles, 1)
+        )
+        blocks.extend(
+            (frappe.generate_hash(length=10), *std, email, "User", "block_modules", idx, module)
+            for idx, module in enumerate(context.blocked_modules, 1)
+        )
+        auth.append(("User", email, "api_secret", encrypt(api_secret), 1))
+        if tenant.get("password"):
+            auth.append(("User", email, "password", passlibctx.hash(tenant["password"]), 0))
+
+        customers.append((
+            email, *std, tenant["customer_name"], email, email, tenant["phone"],
+            f"{api_key}:{api_secret}", plan,
+        ))
+        subscriptions.append((subscription, *std, email, plan, start_date, end_date, "Active"))
+        created.append({"row": i, "email": email, "customer": email, "subscription": subscription, "plan": plan})
+
+    frappe.db.bulk_insert(
+        "User",
+        ["name", *std_fields, "email", "first_name", "full_name", "enabled",
+         "user_type", "role_profile_name", "module_profile", "api_key"],
+        users,
+    )
+    child_fields = ["name", *std_fields, "parent", "parenttype", "parentfield", "idx"]
+    if roles:
+        frappe.db.bulk_insert("Has Role", [*child_fields, "role"], roles)
+    if blocks:
+        frappe.db.bulk_insert("Block Module", [*child_fields, "module"], blocks)
+
+    Auth = Table("__Auth")
+    frappe.qb.into(Auth).columns("doctype", "name", "fieldname", "password", "encrypted").insert(*auth).run()
+
+    frappe.db.bulk_insert(
+        "WhatsApp Customer",
+        ["name", *std_fields, "customer_name", "user", "email", "phone", "token", "current_plan"],
+        customers,
+    )
+    frappe.db.bulk_insert(
+        "WhatsApp Subscription",
+        ["name", *std_fields, "customer", "plan", "start_date", "end_date", "status"],
+        subscriptions,
+    )
+    return created
+
+
+def _normalize(tenant):
+    if isinstance(tenant, dict) and isinstance(tenant.get("email"), str):
+        return {**tenant, "email": tenant["email"].strip().lower()}
+    return tenant
+
+
+def _row_error(i, tenant, error):
+    return {"row": i, "email": tenant.get("email"), "error": error}
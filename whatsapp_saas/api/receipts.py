@@ -0,0 +1,214 @@
+"""
+WhatsApp SaaS Delivery Receipts
+Delivery and read receipts from the webhook are coalesced in Redis (highest
+status per message wins) and written to WhatsApp Message Log in bulk, so a
+receipt storm after a broadcast becomes a few set-based UPDATEs
+"""
+import frappe
+from frappe.utils import now
+from redis.exceptions import ResponseError
+
+LOG_DOCTYPE = "WhatsApp Message Log"
+PENDING_KEY = "whatsapp_saas:receipts"
+PROCESSING_KEY = "whatsapp_saas:receipts:processing"
+# field -> flushes a receipt has waited for its Message Log row
+ATTEMPTS_KEY = "whatsapp_saas:receipts:attempts"
+LOCK_KEY = "whatsapp_saas:receipts_flush"
+LOCK_TIMEOUT = 300
+MAX_ATTEMPTS = 20
+ATTEMPTS_TTL = 24 * 3600
+
+# Statuses only ever move forward; "Failed" is never overwritten by a receipt
+RANKS = {"Sent": 1, "Delivered": 2, "Read": 3}
+STATUSES = {rank: status for status, rank in RANKS.items()}
+
+# Baileys WAMessageStatus: 2 SERVER_ACK, 3 DELIVERY_ACK, 4 READ, 5 PLAYED
+BAILEYS_STATUS = {
+    2: "Sent",
+    3: "Delivered",
+    4: "Read",
+    5: "Read",
+    "SERVER_ACK": "Sent",
+    "DELIVERY_ACK": "Delivered",
+    "READ": "Read",
+    "PLAYED": "Read",
+}
+
+CHUNK_SIZE = 500
+_SEPARATOR = "\x1f"
+
+# HSET only when the new rank is higher than the pending one
+_RECORD = """
+for i = 1, #ARGV, 2 do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0')
+    if tonumber(ARGV[i + 1]) > current then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+# Merge unmatched receipts back into the pending hash (ARGV: max attempts,
+# attempts TTL, then field/rank pairs); a receipt is dropped after max attempts
+_REQUEUE = """
+for i = 3, #ARGV, 2 do
+    if redis.call('HINCRBY', KEYS[2], ARGV[i], 1) > tonumber(ARGV[1]) then
+        redis.call('HDEL', KEYS[2], ARGV[i])
+    else
+        local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0')
+        if tonumber(ARGV[i + 1]) > current then
+            redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+        end
+    end
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+_scripts = {}
+
+
+def record_updates(instance, data):
+    """Queue receipts from a `messages.update` webhook payload; returns how many were recognised"""
+    updates = data
+    if isinstance(data, dict):
+        updates = data.get("updates") or data.get("messages") or [data]
+
+    args = []
+    for update in updates:
+        if not isinstance(update, dict):
+            continue
+        key = update.get("key") or {}
+        message_id = key.get("id") or update.get("id") or update.get("messageId")
+        raw = (update.get("update") or {}).get("status", update.get("status"))
+        status = BAILEYS_STATUS.get(raw) or BAILEYS_STATUS.get(str(raw).upper())
+        if message_id and status:
+            args += [f"{instance}{_SEPARATOR}{message_id}", RANKS[status]]
+
+    if args:
+        _get_script("record", _RECORD)(keys=[frappe.cache.make_key(PENDING_KEY)], args=args)
+        frappe.enqueue(
+            "whatsapp_saas.api.receipts.flush",
+            queue="short",
+            job_id="whatsapp_receipts_flush",
+            deduplicate=True,
+        )
+    return len(args) // 2
+
+
+def flush():
+    """Apply pending receipts as bulk, forward-only status updates"""
+    lock = frappe.cache.lock(frappe.cache.make_key(LOCK_KEY), timeout=LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        # Another flush is running; it leaves newer receipts to the next one
+        return
+
+    try:
+        _flush()
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def _flush():
+    key = frappe.cache.make_key(PENDING_KEY)
+    processing = frappe.cache.make_key(PROCESSING_KEY)
+
+    # Raw pipeline: the values are plain integers, not pickled cache values.
+    # A batch left behind by a flush that died is finished before a new one is taken.
+    pending = frappe.cache.pipeline().hgetall(processing).execute()[0]
+    if not pending:
+        try:
+            # Receipts arriving from now on collect in a fresh hash
+            frappe.cache.rename(key, processing)
+        except ResponseError:
+            # Nothing pending
+            return
+        pending = frappe.cache.pipeline().hgetall(processing).execute()[0]
+
+    grouped = {}
+    for field, rank in pending.items():
+        instance, message_id = frappe.safe_decode(field).split(_SEPARATOR, 1)
+        # Messages are logged as Sent, so a Sent receipt never moves anything
+        if int(rank) > RANKS["Sent"]:
+            grouped.setdefault((instance, int(rank)), []).append(message_id)
+
+    timestamp = now()
+    matched, unmatched = [], []
+    for (instance, rank), message_ids in grouped.items():
+        lower = tuple(status for status, r in RANKS.items() if r < rank)
+        for start in range(0, len(message_ids), CHUNK_SIZE):
+            chunk = tuple(message_ids[start : start + CHUNK_SIZE])
+            values = {
+                "status": STATUSES[rank],
+                "now": timestamp,
+                "instance": instance,
+                "message_ids": chunk,
+                "lower": lower,
+            }
+            frappe.db.sql(
+                """
+                update `tabWhatsApp Message Log`
+                set status = %(status)s, status_updated = %(now)s, modified = %(now)s
+                where instance = %(instance)s and message_id in %(message_ids)s and status in %(lower)s
+                """,
+                values,
+            )
+            logged = set(frappe.db.sql_list(
+                """
+                select message_id from `tabWhatsApp Message Log`
+                where instance = %(instance)s and message_id in %(message_ids)s
+                """,
+                values,
+            ))
+            for message_id in chunk:
+                field = f"{instance}{_SEPARATOR}{message_id}"
+                if message_id in logged:
+                    matched.append(field)
+                else:
+                    unmatched.append((field, rank))
+    frappe.db.commit()
+
+    # A receipt can beat its Message Log row (logged after the send commits);
+    # those go back for the next flush, a bounded number of times
+    attempts = frappe.cache.make_key(ATTEMPTS_KEY)
+    for start in range(0, len(unmatched), CHUNK_SIZE):
+        args = [value for pair in unmatched[start : start + CHUNK_SIZE] for value in pair]
+        _get_script("requeue", _REQUEUE)(keys=[key, attempts], args=[MAX_ATTEMPTS, ATTEMPTS_TTL, *args])
+    pipe = frappe.cache.pipeline()
+    for start in range(0, len(matched), CHUNK_SIZE):
+        pipe.hdel(attempts, *matched[start : start + CHUNK_SIZE])
+    # Dropped only once the updates are committed and the stragglers requeued
+    pipe.delete(processing)
+    pipe.execute()
+
+
+def get_statuses(instance, message_ids):
+    """message_id -> status for logged messages, including receipts not yet flushed"""
+    statuses = {}
+    for start in range(0, len(message_ids), CHUNK_SIZE):
+        for row in frappe.get_all(
+            LOG_DOCTYPE,
+            filters={"instance": instance, "message_id": ["in", message_ids[start : start + CHUNK_SIZE]]},
+            fields=["message_id", "status", "status_updated"],
+        ):
+            statuses[row.message_id] = {"status": row.status, "updated": row.status_updated}
+
+    if statuses:
+        fields = [f"{instance}{_SEPARATOR}{message_id}" for message_id in statuses]
+        pipe = frappe.cache.pipeline()
+        pipe.hmget(frappe.cache.make_key(PENDING_KEY), fields)
+        pending = pipe.execute()[0]
+        for message_id, rank in zip(list(statuses), pending, strict=True):
+            current = statuses[message_id]
+            if rank and current["status"] in RANKS and RANKS[current["status"]] < int(rank):
+                current.update(status=STATUSES[int(rank)], updated=None, pending=True)
+    return statuses
+
+
+def _get_script(name, source):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache.register_script(source)
+    return _scripts[name]
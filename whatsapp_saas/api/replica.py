@@ -0,0 +1,164 @@
+"""
+WhatsApp SaaS Read Replica
+Routes this app's read-only queries to the MariaDB replica configured for the
+site (`read_from_replica`, `replica_host` in site_config.json). A scheduled
+heartbeat measures replication lag; while the replica is lagging, unreachable
+or unmeasured, reads stay on the primary.
+"""
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import flt, now
+from whatsapp_saas.api import eventlog
+
+HEALTH_KEY = "whatsapp_saas:replica_health"
+HEARTBEAT_KEY = "whatsapp_saas_replica_heartbeat"
+# Reads go back to the primary once the replica is further behind than this
+DEFAULT_MAX_LAG = 5
+# A verdict outlives a few missed monitor runs, after which it counts as unknown
+HEALTH_TTL = 300
+# After a failed connect, the primary is used this long before trying again
+RETRY_AFTER = 60
+
+
+def is_enabled():
+    return bool(frappe.conf.get("read_from_replica") and frappe.conf.get("replica_host"))
+
+
+@contextmanager
+def read_only(consistent=False):
+    """
+    Run the block's queries on the replica; yields whether it did. Reads stay
+    on the primary when the block must be `consistent` with the latest writes,
+    when this transaction has uncommitted writes the replica cannot see, or
+    while the replica is unhealthy. Keep blocks to reads: nothing in them may write.
+    """
+    replica = _get_connection() if not consistent and _usable() else None
+    if replica is None or frappe.local.db is replica:
+        yield frappe.local.db is replica
+        return
+
+    primary = frappe.local.db
+    frappe.local.db = replica
+    try:
+        yield True
+    finally:
+        frappe.local.db = primary
+
+
+def close(*args, **kwargs):
+    """after_request / after_job: drop the replica connection opened for this request"""
+    db = getattr(frappe.local, "whatsapp_replica_db", None)
+    if db is not None:
+        frappe.local.whatsapp_replica_db = None
+        db.close()
+
+
+def check_lag():
+    """
+    Scheduler: write a heartbeat on the primary and time how long it takes to
+    appear on the replica, waiting at most the allowed lag.
+    """
+    if not is_enabled():
+        return
+
+    max_lag = flt(frappe.conf.get("whatsapp_replica_max_lag")) or DEFAULT_MAX_LAG
+    beat = frappe.generate_hash(length=12)
+    _write_heartbeat(beat)
+    frappe.db.commit()
+
+    replica = _get_connection()
+    if replica is None:
+        return
+
+    started = time.monotonic()
+    lag = None
+    try:
+        while True:
+            seen = replica.sql(
+                "select defvalue from `tabDefaultValue` where parent = '__global' and defkey = %s",
+                HEARTBEAT_KEY,
+            )
+            if seen and seen[0][0] == beat:
+                lag = time.monotonic() - started
+                break
+            if time.monotonic() - started >= max_lag:
+                break
+            time.sleep(0.2)
+    except Exception:
+        eventlog.report_error("WhatsApp Replica Unavailable")
+        _set_health("down", ttl=RETRY_AFTER)
+        close()
+        return
+
+    _set_health("ok" if lag is not None else "lagging", lag=lag)
+    eventlog.event("replica.lag", lag=lag, max_lag=max_lag)
+
+
+def get_health():
+    """Last verdict of the lag monitor, for dashboards"""
+    return frappe.cache.get_value(HEALTH_KEY) or {"status": "unknown"}
+
+
+def _usable():
+    if not is_enabled() or hasattr(frappe.local, "primary_db"):
+        # Not configured, or already inside frappe.read_only() which swapped connections itself
+        return False
+    if getattr(frappe.local.db, "transaction_writes", 0):
+        # Read-your-writes: the replica cannot see this transaction's changes
+        return False
+    return get_health().get("status") == "ok"
+
+
+def _get_connection():
+    db = getattr(frappe.local, "whatsapp_replica_db", None)
+    if db is not None:
+        return db
+
+    try:
+        db = _connect()
+        db.connect()
+        # Every read sees the latest replicated rows instead of the snapshot of the first one,
+        # and an accidental write fails here rather than diverging the replica
+        db.sql("set session autocommit = 1")
+        db.sql("set session transaction read only")
+    except Exception:
+        eventlog.report_error("WhatsApp Replica Unavailable")
+        _set_health("down", ttl=RETRY_AFTER)
+        return None
+
+    frappe.local.whatsapp_replica_db = db
+    return db
+
+
+def _connect():
+    # Same settings frappe.connect_replica() reads
+    from frappe.database import get_db
+
+    conf = frappe.conf
+    user, password = conf.db_name, conf.db_password
+    if conf.different_credentials_for_replica:
+        user, password = conf.replica_db_name, conf.replica_db_password
+    return get_db(host=conf.replica_host, user=user, password=password, port=conf.replica_db_port)
+
+
+def _write_heartbeat(beat):
+    # Raw update: set_global would clear the whole site cache on every beat
+    if frappe.db.sql(
+        "select name from `tabDefaultValue` where parent = '__global' and defkey = %s", HEARTBEAT_KEY
+    ):
+        frappe.db.sql(
+            "update `tabDefaultValue` set defvalue = %s where parent = '__global' and defkey = %s",
+            (beat, HEARTBEAT_KEY),
+        )
+    else:
+        frappe.db.set_global(HEARTBEAT_KEY, beat)
+
+
+def _set_health(status, lag=None, ttl=HEALTH_TTL):
+    frappe.cache.set_value(
+        HEALTH_KEY,
+        {"status": status, "lag": round(lag, 3) if lag is not None else None, "checked": now()},
+        expires_in_sec=ttl,
+    )
@@ -0,0 +1,179 @@
+"""
+WhatsApp SaaS Route Table
+Single declaration of every Baileys route proxied by this app and its policy.
+Whitelisted methods in `endpoints` and `override_whitelisted_methods` in
+hooks.py are generated from this table.
+"""
+import re
+from typing import NamedTuple
+from urllib.parse import quote
+
+
+class Route(NamedTuple):
+    handler: str  # function name in whatsapp_saas.api.endpoints
+    method: str
+    path: str  # relative to /api on Baileys, placeholders filled from request params
+    quota: bool = False  # checked against and counted towards the monthly message limit
+    log: bool = False  # written to WhatsApp Message Log
+    cache_ttl: int = 0  # seconds to cache successful responses (GET only)
+    timeout: int = 60
+    require_instance: bool = True
+    media: bool = False  # accepts `media_handle` from the media store in place of an upload
+    priority: int = 1  # baileys.PRIORITY_*: low (0) is shed first when Baileys is saturated
+    coalesce: bool = False  # identical concurrent requests share one Baileys call (GET only)
+
+
+def _send(handler, path, method="POST", media=False):
+    """Delivers a message: counted, logged"""
+    return Route(handler, method, path, quota=True, log=True, media=media, priority=2)
+
+
+def _write(handler, method, path, timeout=30):
+    """Changes state on WhatsApp: logged for audit, not counted"""
+    return Route(handler, method, path, log=True, timeout=timeout)
+
+
+def _read(handler, path, cache_ttl=0, timeout=15, priority=1, coalesce=True):
+    """Read-only: neither counted nor logged, identical concurrent reads coalesced"""
+    return Route(handler, "GET", path, cache_ttl=cache_ttl, timeout=timeout, priority=priority, coalesce=coalesce)
+
+
+def _signal(handler, path):
+    """Cheap fire-and-forget updates (presence, typing): neither counted nor logged, shed first"""
+    return Route(handler, "POST", path, timeout=10, priority=0)
+
+
+INSTANCE = "instance/{instance_id}"
+GROUP = INSTANCE + "/group/{group_jid}"
+
+# Public method name -> Route
+ROUTES = {
+    # Instance Management
+    "instance_list": Route("instance_list", "GET", "instance/list", timeout=15, require_instance=False),
+    "instance_get": _read("instance_get", INSTANCE, cache_ttl=5),
+    "instance_delete": _write("instance_delete", "DELETE", INSTANCE),
+
+    # Core Messaging
+    "send_text": _send("send_text", INSTANCE + "/send/text"),
+    "send_media": _send("send_media", INSTANCE + "/send/media", media=True),
+    "send_location": _send("send_location", INSTANCE + "/send/location"),
+    "send_reaction": _send("send_reaction", INSTANCE + "/send/reaction"),
+    "message_delete": _write("delete_message", "DELETE", INSTANCE + "/message"),
+
+    # Enhanced Messaging
+    "send_reply": _send("send_reply", INSTANCE + "/send/reply"),
+    "send_mention": _send("send_mention", INSTANCE + "/send/mention"),
+    "message_forward": _send("forward_message", INSTANCE + "/message/forward"),
+    "message_edit": _write("edit_message", "PUT", INSTANCE + "/message/edit"),
+    "message_pin": _write("pin_message", "POST", INSTANCE + "/message/pin"),
+    "message_unpin": _write("unpin_message", "POST", INSTANCE + "/message/unpin"),
+    "send_viewonce": _send("send_viewonce", INSTANCE + "/send/viewonce"),
+    "send_poll": _send("send_poll", INSTANCE + "/send/poll"),
+
+    # Media Operations
+    # Too large to hand around through Redis
+    "media_download": _read(
+        "download_media", INSTANCE + "/media/{message_id}/download", timeout=120, coalesce=False
+    ),
+
+    # Chat Management
+    "chat_archive": _write("archive_chat", "POST", INSTANCE + "/chat/archive"),
+    "chat_mute": _write("mute_chat", "POST", INSTANCE + "/chat/mute"),
+    "chat_read": _signal("mark_read", INSTANCE + "/chat/read"),
+    "chat_pin": _write("pin_chat", "POST", INSTANCE + "/chat/pin"),
+    "chat_delete": _write("delete_chat", "DELETE", INSTANCE + "/chat"),
+    "chat_star": _write("star_message", "POST", INSTANCE + "/chat/star"),
+    "chat_disappearing": _write("set_disappearing", "POST", INSTANCE + "/chat/disappearing"),
+
+    # Presence & Status
+    "presence_update": _signal("update_presence", INSTANCE + "/presence/update"),
+    "presence_typing": _signal("set_typing", INSTANCE + "/presence/typing"),
+    "presence_online": _signal("set_online", INSTANCE + "/presence/online"),
+
+    # Profile Management
+    "profile_name": _write("update_name", "PUT", INSTANCE + "/profile/name"),
+    "profile_status": _write("update_status", "PUT", INSTANCE + "/profile/status"),
+    "profile_picture_update": _write("update_picture", "PUT", INSTANCE + "/profile/picture", timeout=60),
+    "profile_picture_get": _read("get_picture", INSTANCE + "/profile/picture", cache_ttl=300, priority=0),
+
+    # Privacy Settings
+    "privacy_block": _write("block_user", "POST", INSTANCE + "/privacy/block"),
+    "privacy_unblock": _write("unblock_user", "POST", INSTANCE + "/privacy/unblock"),
+    "privacy_blocklist": _read("get_blocklist", INSTANCE + "/privacy/blocklist", cache_ttl=60),
+    "privacy_update": _write("update_privacy", "PUT", INSTANCE + "/privacy/settings"),
+    "privacy_get": _read("get_privacy", INSTANCE + "/privacy/settings", cache_ttl=60),
+
+    # Broadcast & Stories
+    "broadcast_send": _send("send_broadcast", INSTANCE + "/broadcast/send"),
+    "status_send": _send("send_status", INSTANCE + "/status/send", media=True),
+
+    # Group Management
+    "group_create": _write("create_group", "POST", INSTANCE + "/group/create"),
+    "group_list": _read("list_groups", INSTANCE + "/groups", cache_ttl=30),
+    "group_get": _read("get_group", GROUP, cache_ttl=30),
+    "group_subject": _write("update_group_subject", "PUT", GROUP + "/subject"),
+    "group_description": _write("update_group_description", "PUT", GROUP + "/description"),
+    "group_participants": _write("group_participants", "PUT", GROUP + "/participants"),
+    "group_leave": _write("leave_group", "POST", GROUP + "/leave"),
+    "group_invite": _read("get_invite_code", GROUP + "/invite", cache_ttl=60),
+
+    # Utilities
+    "utils_check": _read("check_number", INSTANCE + "/utils/check-number", cache_ttl=3600),
+    "utils_validate": _read("validate_jid", INSTANCE + "/utils/validate-jid", cache_ttl=86400),
+    "utils_format": _read("format_number", INSTANCE + "/utils/format-number", cache_ttl=86400),
+    "utils_device": _read("device_info", INSTANCE + "/utils/device-info", cache_ttl=60, priority=0),
+
+    # Advanced Features
+    "advanced_link": _send("send_link_preview", INSTANCE + "/advanced/link-preview"),
+    "advanced_sticker": _send("send_sticker", INSTANCE + "/advanced/sticker", media=True),
+
+    # Health & Monitoring
+    "health": Route("health_check", "GET", "health", timeout=5, require_instance=False, priority=2),
+
+    # Template & Buttons
+    "send_buttons": _send("send_template_buttons", INSTANCE + "/send/template-buttons"),
+}
+
+# Used by `api.proxy` for endpoints that are not declared above
+DEFAULT_ROUTE = Route("proxy", "POST", "", quota=True, log=True)
+
+_PLACEHOLDER = re.compile(r"{(\w+)}")
+
+
+def whitelisted_methods(module="whatsapp_saas.api.endpoints"):
+    """override_whitelisted_methods entries for every declared route"""
+    return {name: f"{module}.{route.handler}" for name, route in ROUTES.items()}
+
+
+def build_path(route, params):
+    """Fill the route's placeholders from request params; returns (path, missing placeholder names)"""
+    missing = [key for key in _PLACEHOLDER.findall(route.path) if not params.get(key)]
+    if missing:
+        return None, missing
+    return _PLACEHOLDER.sub(lambda m: quote(str(params[m.group(1)]), safe="@:"), route.path), []
+
+
+def by_handler(handler):
+    """Declared route served by the endpoint named `handler`, if any"""
+    return next((route for route in ROUTES.values() if route.handler == handler), None)
+
+
+def match(method, path):
+    """Route declared for a concrete method and path, if any"""
+    for route in ROUTES.values():
+        if route.method == method and _pattern(route.path).fullmatch(path):
+            return route
+    return None
+
+
+_patterns = {}
+
+
+def _pattern(template):
+    if template not in _patterns:
+        parts = _PLACEHOLDER.split(template)
+        # split() alternates literal text and placeholder names
+        _patterns[template] = re.compile(
+            "".join(re.escape(part) if i % 2 == 0 else "[^/]+" for i, part in enumerate(parts))
+        )
+    return _patterns[template]
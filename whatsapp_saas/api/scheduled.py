@@ -0,0 +1,256 @@
+"""
+WhatsApp SaaS Scheduled Messages
+Sends given a `send_at` are stored in WhatsApp Scheduled Message and released
+by a short drain pass on every minute's cron tick. Each message is placed at
+random within its `spread` window, so messages scheduled for the same minute
+boundary are spread over the following ticks, and each tick's release is paced
+by the fair dispatcher's in-flight bound. Released messages are sent through
+the normal outbound path, as the user who scheduled them.
+"""
+import json
+import random
+from datetime import datetime, timedelta
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, add_to_date, cint, convert_utc_to_system_timezone, get_datetime, now_datetime
+from whatsapp_saas.api import dispatcher, eventlog, gateway, routes
+
+DOCTYPE = "WhatsApp Scheduled Message"
+# Seconds after `send_at` over which a message's dispatch is spread by default
+DEFAULT_SPREAD = 30
+MAX_SPREAD = 3600
+MAX_HORIZON_DAYS = 90
+BATCH_SIZE = 500
+MAX_BATCHES_PER_RUN = 10
+# Queued messages whose job never ran are released again after this long
+QUEUED_TIMEOUT = 15 * 60
+SEND_TIMEOUT = 120
+# A message still Sending this long after it started belongs to a job that died
+SENDING_TIMEOUT = SEND_TIMEOUT + 5 * 60
+# Delay range before retrying a send rejected because Baileys or the customer was
+# saturated, and how many such retries a message gets
+RETRY_DELAY = (5, 30)
+MAX_RETRIES = 10
+LOCK_KEY = "whatsapp_saas:scheduled_drain"
+LOCK_TIMEOUT = 55
+
+
+def schedule(route, instance, data, send_at, spread=None):
+    """Store a send of `route` with `data` to go out at `send_at`"""
+    _path, missing = routes.build_path(route, data)
+    if missing:
+        frappe.throw(_("{0} is required").format(", ".join(missing)))
+
+    send_at, spread, dispatch_at = _plan(send_at, spread)
+    doc = frappe.get_doc({
+        "doctype": DOCTYPE,
+        "instance": instance.name,
+        "whatsapp_customer": instance.whatsapp_customer,
+        "route": route.handler,
+        "status": "Scheduled",
+        "send_at": send_at,
+        "spread": spread,
+        "dispatch_at": dispatch_at,
+        "payload": json.dumps(data, default=str),
+    }).insert(ignore_permissions=True)
+    return _summary(doc)
+
+
+def reschedule(name, send_at, spread=None):
+    """Move a message that has not been sent yet to a new time"""
+    doc = frappe.get_doc(DOCTYPE, name, for_update=True)
+    if doc.status not in ("Scheduled", "Queued"):
+        frappe.throw(_("Only scheduled messages can be rescheduled; this one is {0}").format(doc.status))
+
+    doc.send_at, doc.spread, doc.dispatch_at = _plan(send_at, doc.spread if spread in (None, "") else spread)
+    # A queued job finds the message no longer Queued and leaves it to the drain loop
+    doc.status = "Scheduled"
+    doc.save(ignore_permissions=True)
+    return _summary(doc)
+
+
+def cancel(name):
+    doc = frappe.get_doc(DOCTYPE, name, for_update=True)
+    if doc.status not in ("Scheduled", "Queued"):
+        frappe.throw(_("Only scheduled messages can be cancelled; this one is {0}").format(doc.status))
+    doc.db_set("status", "Cancelled")
+    return _summary(doc)
+
+
+def drain():
+    """Cron, every minute: release the messages that are due, in one short pass"""
+    lock = frappe.cache.lock(frappe.cache.make_key(LOCK_KEY), timeout=LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return
+
+    try:
+        _requeue_stale()
+        _fail_stuck_sends()
+        for _i in range(MAX_BATCHES_PER_RUN):
+            if _release_due() < BATCH_SIZE:
+                break
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            # Expired; the next run takes over
+            pass
+
+
+def send(name):
+    """Dispatcher job: send one released message through the normal outbound path"""
+    row = frappe.db.get_value(
+        DOCTYPE, name, ["name", "owner", "status", "route", "payload", "retries"], as_dict=True, for_update=True
+    )
+    if not row or row.status != "Queued":
+        # Cancelled or rescheduled after it was released
+        return
+    # `modified` marks when sending started, for _fail_stuck_sends
+    frappe.db.set_value(DOCTYPE, name, "status", "Sending")
+    frappe.db.commit()
+
+    user = frappe.session.user
+    try:
+        frappe.set_user(row.owner)
+        route = routes.by_handler(row.route)
+        data = json.loads(row.payload)
+        instance = gateway.authorize(data.get("instance_id"))
+        response_data = gateway.call_route(route, instance, data)
+        message_id = gateway.message_id(response_data)
+        values = {"status": "Sent", "message_id": message_id, "sent_at": now_datetime()} if message_id else {
+            "status": "Failed",
+            "error": json.dumps(response_data, default=str)[:1000],
+        }
+    except frappe.TooManyRequestsError:
+        frappe.db.rollback()
+        # Saturated right now; try again shortly instead of failing the message
+        values = {
+            "status": "Scheduled",
+            "dispatch_at": add_to_date(now_datetime(), seconds=random.randint(*RETRY_DELAY)),
+            "retries": cint(row.retries) + 1,
+        } if cint(row.retries) < MAX_RETRIES else {
+            "status": "Failed",
+            "error": f"WhatsApp service still busy after {MAX_RETRIES} retries",
+        }
+    except Exception as e:
+        frappe.db.rollback()
+        eventlog.report_error("WhatsApp Scheduled Send Error", scheduled_message=name)
+        values = {"status": "Failed", "error": str(e)[:1000]}
+    finally:
+        frappe.set_user(user)
+
+    frappe.db.set_value(DOCTYPE, name, values)
+    frappe.db.commit()
+
+
+def _release_due():
+    rows = frappe.db.sql(
+        """
+        select name, whatsapp_customer
+        from `tabWhatsApp Scheduled Message`
+        where status = 'Scheduled' and dispatch_at <= %s
+        order by dispatch_at
+        limit %s
+        """,
+        (now_datetime(), BATCH_SIZE),
+        as_dict=True,
+    )
+    if not rows:
+        # Ends the read snapshot so the next poll sees newly scheduled rows
+        frappe.db.commit()
+        return 0
+
+    frappe.db.sql(
+        """
+        update `tabWhatsApp Scheduled Message`
+        set status = 'Queued', modified = %s
+        where name in %s and status = 'Scheduled'
+        """,
+        (now_datetime(), tuple(row.name for row in rows)),
+    )
+    frappe.db.commit()
+
+    # Released fairly per customer, so one tenant's batch does not delay everyone else's
+    for row in rows:
+        dispatcher.submit(
+            row.whatsapp_customer,
+            "whatsapp_saas.api.scheduled.send",
+            queue="short",
+            timeout=SEND_TIMEOUT,
+            name=row.name,
+        )
+    return len(rows)
+
+
+def _requeue_stale():
+    frappe.db.sql(
+        """
+        update `tabWhatsApp Scheduled Message`
+        set status = 'Scheduled'
+        where status = 'Queued' and modified < %s
+        """,
+        add_to_date(now_datetime(), seconds=-QUEUED_TIMEOUT),
+    )
+    frappe.db.commit()
+
+
+def _fail_stuck_sends():
+    # The message may or may not have gone out, so it is not sent again
+    frappe.db.sql(
+        """
+        update `tabWhatsApp Scheduled Message`
+        set status = 'Failed', error = %s, modified = %s
+        where status = 'Sending' and modified < %s
+        """,
+        (
+            "Outcome unknown: the sending job stopped before recording a result",
+            now_datetime(),
+            add_to_date(now_datetime(), seconds=-SENDING_TIMEOUT),
+        ),
+    )
+    frappe.db.commit()
+
+
+def _plan(send_at, spread):
+    """(send_at, spread, dispatch_at) for a request, validated"""
+    send_at = _parse_time(send_at)
+    now = now_datetime()
+    if send_at > add_days(now, MAX_HORIZON_DAYS):
+        frappe.throw(_("send_at can be at most {0} days ahead").format(MAX_HORIZON_DAYS))
+
+    spread = DEFAULT_SPREAD if spread in (None, "") else cint(spread)
+    if not 0 <= spread <= MAX_SPREAD:
+        frappe.throw(_("spread must be between 0 and {0} seconds").format(MAX_SPREAD))
+
+    # Past times go out now, still spread so a late batch does not arrive at once
+    start = max(send_at, now)
+    return send_at, spread, start + timedelta(seconds=random.uniform(0, spread))
+
+
+def _parse_time(value):
+    # Unix seconds, or a datetime string in system time unless it carries an offset
+    try:
+        utc = datetime.utcfromtimestamp(float(value))
+        return convert_utc_to_system_timezone(utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        pass
+    try:
+        parsed = get_datetime(value)
+    except Exception:
+        parsed = None
+    if not parsed:
+        frappe.throw(_("send_at must be a datetime or unix timestamp"))
+    if parsed.tzinfo:
+        utc = datetime.utcfromtimestamp(parsed.timestamp())
+        return convert_utc_to_system_timezone(utc).replace(tzinfo=None)
+    return parsed
+
+
+def _summary(doc):
+    return {
+        "scheduled_id": doc.name,
+        "status": doc.status,
+        "send_at": doc.send_at,
+        "dispatch_at": doc.dispatch_at,
+    }
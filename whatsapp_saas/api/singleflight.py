@@ -0,0 +1,97 @@
+"""
+WhatsApp SaaS Single Flight
+Identical concurrent calls share one execution across all workers: the first
+caller for a key runs it, later callers wait for its result (or its error) in
+Redis instead of repeating the call. Nothing is kept once the flight lands, so
+this adds no staleness on top of the call itself.
+"""
+import time
+
+import frappe
+
+FLIGHT_KEY = "whatsapp_saas:flight:{0}"
+RESULT_KEY = "whatsapp_saas:flight_result:{0}:{1}"
+# Long enough for every waiting caller to pick the result up
+RESULT_TTL = 10
+LEASE_MARGIN = 5
+
+# Only the leader that still owns the flight may end it
+_LAND = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_land_script = None
+
+
+def run(key, fn, timeout=60):
+    """
+    Return `fn()`, sharing one execution among concurrent callers with the same
+    `key`. Waits at most `timeout` seconds for a flight in progress; a caller
+    whose leader vanished without a result runs `fn` itself.
+    """
+    flight_key = frappe.cache.make_key(FLIGHT_KEY.format(key))
+    for _attempt in range(2):
+        flight = frappe.generate_hash(length=12)
+        if frappe.cache.set(flight_key, flight, nx=True, ex=int(timeout) + LEASE_MARGIN):
+            return _lead(key, flight_key, flight, fn)
+
+        leader = frappe.cache.get(flight_key)
+        if leader is None:
+            # Landed between the two calls; try to lead the next one
+            continue
+        landed, result = _follow(key, flight_key, frappe.safe_decode(leader), timeout)
+        if landed:
+            if isinstance(result, _Raised):
+                raise result.error
+            return result
+        break
+    return fn()
+
+
+class _Raised:
+    def __init__(self, error):
+        self.error = error
+
+
+def _lead(key, flight_key, flight, fn):
+    try:
+        result = fn()
+    except Exception as e:
+        # Followers fail the same way instead of all retrying against a struggling upstream
+        _land(key, flight_key, flight, _Raised(e))
+        raise
+    _land(key, flight_key, flight, result)
+    return result
+
+
+def _land(key, flight_key, flight, result):
+    global _land_script
+    try:
+        frappe.cache.set_value(RESULT_KEY.format(key, flight), result, expires_in_sec=RESULT_TTL)
+    except Exception:
+        # Unpicklable result or error: followers find no result and run the call themselves
+        pass
+    if _land_script is None:
+        _land_script = frappe.cache.register_script(_LAND)
+    _land_script(keys=[flight_key], args=[flight])
+
+
+def _follow(key, flight_key, flight, timeout):
+    result_key = RESULT_KEY.format(key, flight)
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while time.monotonic() < deadline:
+        # expires=True skips the per-request local cache, which would pin the first miss
+        result = frappe.cache.get_value(result_key, expires=True)
+        if result is not None:
+            return True, result
+        if frappe.safe_decode(frappe.cache.get(flight_key) or b"") != flight:
+            # Landed or abandoned; a result written just before landing is still there
+            result = frappe.cache.get_value(result_key, expires=True)
+            return result is not None, result
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
+    return False, None
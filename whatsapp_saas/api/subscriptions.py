@@ -0,0 +1,94 @@
+"""
+WhatsApp SaaS Subscription Lifecycle
+Set-based expiry/renewal and the Redis hash of active subscriptions that the
+proxy path checks instead of loading WhatsApp Subscription documents
+"""
+import pickle
+
+import frappe
+from frappe.utils import getdate, now, today
+
+# subscription name -> plan name, for every subscription that may use the API.
+# A subscription without an end_date is open-ended: active until its status changes.
+ACTIVE_KEY = "whatsapp_saas:active_subscriptions"
+_BUILT_MARKER = "__built__"
+
+
+def get_active_plan(subscription):
+    """Plan of an active subscription, or None; a single HGET on the hot path"""
+    if not subscription:
+        return None
+
+    plan = frappe.cache.hget(ACTIVE_KEY, subscription)
+    if plan is None and not frappe.cache.hget(ACTIVE_KEY, _BUILT_MARKER):
+        # Redis was flushed or never populated
+        publish_active_subscriptions()
+        plan = frappe.cache.hget(ACTIVE_KEY, subscription)
+    return plan
+
+
+def is_active(status, end_date):
+    """Same rule as publish_active_subscriptions, for a single subscription"""
+    return status == "Active" and (not end_date or getdate(end_date) >= getdate(today()))
+
+
+def publish_active_subscriptions():
+    """Rebuild the active subscription hash and swap it in atomically"""
+    rows = frappe.get_all(
+        "WhatsApp Subscription",
+        filters={"status": "Active"},
+        or_filters=[["end_date", ">=", today()], ["end_date", "is", "not set"]],
+        fields=["name", "plan"],
+    )
+
+    key = frappe.cache.make_key(ACTIVE_KEY)
+    staging = f"{key}:staging"
+    pipe = frappe.cache.pipeline()
+    pipe.delete(staging)
+    for start in range(0, len(rows), 1000):
+        pipe.hset(staging, mapping={row.name: pickle.dumps(row.plan) for row in rows[start : start + 1000]})
+    pipe.hset(staging, _BUILT_MARKER, pickle.dumps(1))
+    pipe.rename(staging, key)
+    pipe.execute()
+
+    # hget keeps a request-local copy; drop it so this request sees the new hash
+    frappe.local.cache.pop(key, None)
+
+
+def cache_subscription(name, plan, active):
+    """Reflect a single subscription change in the active hash immediately"""
+    if active:
+        frappe.cache.hset(ACTIVE_KEY, name, plan)
+    else:
+        frappe.cache.hdel(ACTIVE_KEY, name)
+
+
+def process_subscription_lifecycle():
+    """Daily: renew lapsed auto-renew subscriptions, expire the rest, republish the cache"""
+    values = {"today": today(), "now": now()}
+
+    # Open-ended subscriptions (end_date null) match neither update and never lapse.
+    # Roll auto-renewing subscriptions forward by as many whole months as they lapsed.
+    # start_date is assigned first so both expressions see the old end_date.
+    frappe.db.sql(
+        """
+        update `tabWhatsApp Subscription`
+        set
+            start_date = date_add(end_date, interval timestampdiff(month, end_date, %(today)s) month),
+            end_date = date_add(end_date, interval timestampdiff(month, end_date, %(today)s) + 1 month),
+            modified = %(now)s
+        where status = 'Active' and auto_renew = 1 and end_date < %(today)s
+        """,
+        values,
+    )
+    frappe.db.sql(
+        """
+        update `tabWhatsApp Subscription`
+        set status = 'Expired', modified = %(now)s
+        where status = 'Active' and end_date < %(today)s
+        """,
+        values,
+    )
+    frappe.db.commit()
+
+    publish_active_subscriptions()
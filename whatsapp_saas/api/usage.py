@@ -0,0 +1,200 @@
+"""
+WhatsApp SaaS Usage Analytics
+Message counts per instance in hourly, daily and monthly buckets. Writes bump
+Redis counters; a scheduled flush folds them into WhatsApp Usage Bucket with
+upserts, so charts read a handful of pre-aggregated rows instead of scanning
+WhatsApp Message Log.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+import frappe
+from frappe import _
+from frappe.utils import get_datetime, now, now_datetime
+from redis.exceptions import ResponseError
+from whatsapp_saas.api import replica
+
+DOCTYPE = "WhatsApp Usage Bucket"
+PENDING_KEY = "whatsapp_saas:usage_pending"
+PROCESSING_KEY = "whatsapp_saas:usage_pending:processing"
+LOCK_KEY = "whatsapp_saas:usage_flush"
+LOCK_TIMEOUT = 300
+METRICS = ("sent", "failed", "inbound")
+GRANULARITIES = ("Hour", "Day", "Month")
+
+# A series never returns more buckets than this, whatever range is asked for
+MAX_BUCKETS = 1000
+CACHE_TTL = {"Hour": 60, "Day": 300, "Month": 900}
+CHUNK_SIZE = 500
+_SEPARATOR = "\x1f"
+
+
+def record_usage(instance, metric, count=1, at=None):
+    """Count `count` events of `metric` for `instance` in the current hour"""
+    if not instance or not count:
+        return
+    hour = bucket_start(at or now_datetime(), "Hour").strftime("%Y-%m-%d %H:%M:%S")
+    frappe.cache.hincrby(
+        frappe.cache.make_key(PENDING_KEY), _SEPARATOR.join((instance, hour, metric)), count
+    )
+
+
+def bucket_start(dt, granularity):
+    dt = get_datetime(dt).replace(minute=0, second=0, microsecond=0)
+    if granularity == "Day":
+        dt = dt.replace(hour=0)
+    elif granularity == "Month":
+        dt = dt.replace(day=1, hour=0)
+    return dt
+
+
+def flush():
+    """Scheduler: fold pending counters into hour, day and month buckets"""
+    lock = frappe.cache.lock(frappe.cache.make_key(LOCK_KEY), timeout=LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return
+
+    try:
+        _flush()
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def _flush():
+    key = frappe.cache.make_key(PENDING_KEY)
+    processing = frappe.cache.make_key(PROCESSING_KEY)
+
+    # Counters left by a flush that failed are folded in before new ones are taken
+    pending = frappe.cache.pipeline().hgetall(processing).execute()[0]
+    if not pending:
+        try:
+            frappe.cache.rename(key, processing)
+        except ResponseError:
+            # Nothing counted since the last flush
+            return
+        pending = frappe.cache.pipeline().hgetall(processing).execute()[0]
+
+    buckets = {}
+    for field, count in pending.items():
+        instance, hour, metric = frappe.safe_decode(field).split(_SEPARATOR)
+        for granularity in GRANULARITIES:
+            start = bucket_start(hour, granularity)
+            counts = buckets.setdefault((instance, granularity, start), dict.fromkeys(METRICS, 0))
+            counts[metric] += int(count)
+
+    owners = {
+        row.name: row
+        for row in frappe.get_all(
+            "WhatsApp Instance",
+            filters={"name": ["in", list({instance for instance, _g, _s in buckets})]},
+            fields=["name", "whatsapp_customer", "subscription"],
+        )
+    }
+
+    timestamp = now()
+    rows = []
+    for (instance, granularity, start), counts in buckets.items():
+        owner = owners.get(instance) or frappe._dict()
+        rows.append((
+            _bucket_name(instance, granularity, start), timestamp, timestamp, "Administrator", "Administrator",
+            instance, owner.whatsapp_customer, owner.subscription, granularity, start,
+            *(counts[metric] for metric in METRICS),
+        ))
+
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[start : start + CHUNK_SIZE]
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * len(chunk[0])) + ")"] * len(chunk))
+        frappe.db.sql(
+            f"""
+            insert into `tabWhatsApp Usage Bucket`
+                (name, creation, modified, owner, modified_by,
+                instance, whatsapp_customer, subscription, granularity, bucket_start,
+                sent, failed, inbound)
+            values {placeholders}
+            on duplicate key update
+                sent = sent + values(sent),
+                failed = failed + values(failed),
+                inbound = inbound + values(inbound),
+                modified = values(modified)
+            """,
+            [value for row in chunk for value in row],
+        )
+    frappe.db.commit()
+
+    # Dropped only once the counts are committed
+    frappe.cache.pipeline().delete(processing).execute()
+
+
+def get_series(instances, granularity="Day", from_date=None, to_date=None, subscription=None):
+    """
+    Bucketed counts for `instances` between two datetimes, cached briefly.
+    With `subscription`, only buckets recorded under that subscription; a
+    bucket keeps the subscription its instance had when the bucket was created.
+    """
+    if granularity not in GRANULARITIES:
+        frappe.throw(_("granularity must be one of {0}").format(", ".join(GRANULARITIES)))
+
+    end = bucket_start(to_date or now_datetime(), granularity)
+    start = bucket_start(from_date, granularity) if from_date else _buckets_before(end, granularity, 30)
+    if start > end:
+        frappe.throw(_("from_date must be before to_date"))
+    if _bucket_count(start, end, granularity) > MAX_BUCKETS:
+        frappe.throw(
+            _("Range spans more than {0} {1} buckets; use a coarser granularity").format(MAX_BUCKETS, granularity)
+        )
+
+    instances = sorted(instances)
+    cache_key = "whatsapp_saas:usage_series:" + hashlib.sha1(
+        json.dumps([instances, granularity, str(start), str(end), subscription]).encode()
+    ).hexdigest()
+    cached = frappe.cache.get_value(cache_key)
+    if cached is not None:
+        return cached
+
+    with replica.read_only():
+        series = frappe.get_all(
+            DOCTYPE,
+            filters={
+                "instance": ["in", instances],
+                "granularity": granularity,
+                "bucket_start": ["between", [start, end]],
+                **({"subscription": subscription} if subscription else {}),
+            },
+            fields=["instance", "subscription", "bucket_start", *METRICS],
+            order_by="bucket_start asc",
+            limit=MAX_BUCKETS * len(instances),
+        ) if instances else []
+
+    result = {
+        "granularity": granularity,
+        "from": start,
+        "to": end,
+        "totals": {metric: sum(row[metric] for row in series) for metric in METRICS},
+        "series": series,
+    }
+    frappe.cache.set_value(cache_key, result, expires_in_sec=CACHE_TTL[granularity])
+    return result
+
+
+def _bucket_name(instance, granularity, start):
+    # Deterministic so the upsert hits the same row from any worker
+    return hashlib.sha1(f"{instance}:{granularity}:{start}".encode()).hexdigest()[:20]
+
+
+def _bucket_count(start, end, granularity):
+    if granularity == "Month":
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    step = timedelta(hours=1) if granularity == "Hour" else timedelta(days=1)
+    return int((end - start) / step) + 1
+
+
+def _buckets_before(end, granularity, count):
+    if granularity == "Month":
+        month = end.year * 12 + end.month - 1 - (count - 1)
+        return end.replace(year=month // 12, month=month % 12 + 1)
+    step = timedelta(hours=1) if granularity == "Hour" else timedelta(days=1)
+    return end - step * (count - 1)
@@ -0,0 +1,274 @@
+"""
+WhatsApp SaaS Customer Webhooks
+Events received from Baileys are pushed to the customer's own endpoints so
+they do not have to poll. Events queue per webhook in a Redis outbox and are
+delivered in signed batches by a deduplicated background job; failed batches
+retry with exponential backoff and end up as dead letters.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import time
+from urllib.parse import urlsplit
+
+import frappe
+import requests
+from frappe import _
+from frappe.utils import cint
+from frappe.utils.password import get_decrypted_password
+from whatsapp_saas.api import dispatcher
+
+DOCTYPE = "WhatsApp Webhook"
+DEAD_LETTER_DOCTYPE = "WhatsApp Webhook Dead Letter"
+
+# customer -> enabled webhooks, built on demand from the database
+SUBSCRIPTIONS_KEY = "whatsapp_saas:webhook_subscriptions"
+OUTBOX_KEY = "whatsapp_saas:webhook_outbox:{0}"
+# webhooks whose outbox may hold events
+PENDING_KEY = "whatsapp_saas:webhook_pending"
+# batch id -> pending batch, and batch id scored by when it is due again
+BATCHES_KEY = "whatsapp_saas:webhook_batches"
+RETRY_KEY = "whatsapp_saas:webhook_retry"
+
+BATCH_SIZE = 100
+MAX_BATCHES_PER_RUN = 50
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 30
+BACKOFF_MAX = 6 * 3600
+TIMEOUT = 10
+
+_session = None
+
+
+def emit(instance, event, data):
+    """Queue `event` for every webhook of the instance's customer that subscribes to it"""
+    if not event or not instance.get("whatsapp_customer"):
+        return
+
+    envelope = json.dumps({
+        "event": event,
+        "instance_id": instance.instance_id,
+        "timestamp": int(time.time()),
+        "data": data,
+    }, default=str)
+
+    for webhook in get_subscriptions(instance.whatsapp_customer):
+        if webhook["instance"] and webhook["instance"] != instance.name:
+            continue
+        if webhook["events"] and event not in webhook["events"]:
+            continue
+        frappe.cache.rpush(OUTBOX_KEY.format(webhook["name"]), envelope)
+        frappe.cache.sadd(PENDING_KEY, webhook["name"])
+        _enqueue_delivery(webhook["name"], instance.whatsapp_customer)
+
+
+def get_subscriptions(customer):
+    def build():
+        rows = frappe.get_all(
+            DOCTYPE,
+            filters={"whatsapp_customer": customer, "enabled": 1},
+            fields=["name", "instance", "events"],
+        )
+        return [
+            {"name": row.name, "instance": row.instance, "events": (row.events or "").split()}
+            for row in rows
+        ]
+
+    return frappe.cache.hget(SUBSCRIPTIONS_KEY, customer, generator=build)
+
+
+def clear_subscriptions(customer):
+    frappe.cache.hdel(SUBSCRIPTIONS_KEY, customer)
+
+
+def check_url(url):
+    """
+    Raise ValueError unless `url` is http(s) and every address its host resolves
+    to is public, so webhooks cannot be pointed at internal services.
+    """
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("URL must start with http:// or https:// and name a host")
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        raise ValueError(f"Cannot resolve host {parts.hostname}") from None
+
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        ip = getattr(ip, "ipv4_mapped", None) or ip
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Host {parts.hostname} resolves to a non-public address")
+
+
+def deliver(webhook):
+    """Drain the outbox of `webhook` in batches; failed batches go to the retry set"""
+    key = frappe.cache.make_key(OUTBOX_KEY.format(webhook))
+    for _i in range(MAX_BATCHES_PER_RUN):
+        # Take a batch atomically so concurrent runs never send the same events
+        pipe = frappe.cache.pipeline()
+        pipe.lrange(key, 0, BATCH_SIZE - 1)
+        pipe.ltrim(key, BATCH_SIZE, -1)
+        events = pipe.execute()[0]
+        if not events:
+            return
+
+        batch = {
+            "id": frappe.generate_hash(length=20),
+            "webhook": webhook,
+            "events": [json.loads(event) for event in events],
+            "attempts": 0,
+        }
+        _attempt(batch)
+
+    # Still more queued than one run may send; continue in a fresh job
+    _enqueue_delivery(webhook)
+
+
+def process_retries():
+    """Scheduler: resend batches whose backoff has elapsed and pick up stranded outboxes"""
+    _sweep_outboxes()
+
+    retry_key = frappe.cache.make_key(RETRY_KEY)
+    batches_key = frappe.cache.make_key(BATCHES_KEY)
+
+    due = frappe.cache.zrangebyscore(retry_key, "-inf", time.time(), start=0, num=MAX_BATCHES_PER_RUN)
+    for batch_id in due:
+        # Whoever removes the entry owns the retry
+        if not frappe.cache.zrem(retry_key, batch_id):
+            continue
+        raw = frappe.cache.hget(batches_key, batch_id, shared=True)
+        frappe.cache.hdel(batches_key, batch_id, shared=True)
+        if raw:
+            _attempt(raw)
+
+
+def requeue(dead_letter):
+    """Send a dead-lettered batch again with a fresh attempt budget"""
+    doc = frappe.get_doc(DEAD_LETTER_DOCTYPE, dead_letter)
+    if doc.status != "Failed":
+        frappe.throw(_("Dead letter {0} was already requeued").format(doc.name))
+
+    _schedule({
+        "id": frappe.generate_hash(length=20),
+        "webhook": doc.webhook,
+        "events": json.loads(doc.payload),
+        "attempts": 0,
+    }, delay=0)
+    doc.db_set("status", "Requeued")
+
+
+def _attempt(batch):
+    webhook = frappe.db.get_value(
+        DOCTYPE, batch["webhook"], ["name", "url", "enabled", "whatsapp_customer"], as_dict=True
+    )
+    if not webhook or not webhook.enabled:
+        return
+
+    batch["attempts"] += 1
+    error = _post(webhook, batch)
+    if not error:
+        return
+
+    batch["error"] = error
+    if batch["attempts"] >= MAX_ATTEMPTS:
+        _dead_letter(webhook, batch)
+    else:
+        delay = min(BACKOFF_BASE * 2 ** (batch["attempts"] - 1), BACKOFF_MAX)
+        _schedule(batch, delay * random.uniform(0.8, 1.2))
+
+
+def _post(webhook, batch):
+    """POST one signed batch; returns an error string, or None once the receiver accepted it"""
+    body = json.dumps({"webhook": webhook.name, "delivery_id": batch["id"], "events": batch["events"]}, default=str)
+    timestamp = str(int(time.time()))
+    secret = get_decrypted_password(DOCTYPE, webhook.name, "secret", raise_exception=False) or ""
+    signature = hmac.new(secret.encode(), f"{timestamp}.{body}".encode(), hashlib.sha256).hexdigest()
+
+    try:
+        # Checked on every delivery too, in case DNS changed since the webhook was saved
+        check_url(webhook.url)
+    except ValueError as e:
+        return str(e)
+
+    try:
+        response = _get_session().post(
+            webhook.url,
+            data=body.encode(),
+            timeout=TIMEOUT,
+            # A redirect could lead to an address check_url would reject
+            allow_redirects=False,
+            headers={
+                "Content-Type": "application/json",
+                "X-WhatsApp-Delivery": batch["id"],
+                "X-WhatsApp-Timestamp": timestamp,
+                "X-WhatsApp-Signature": f"sha256={signature}",
+            },
+        )
+    except requests.RequestException as e:
+        # Only the exception type and status code are kept: last_error is shown to
+        # the customer, and the receiver's response is not ours to echo back
+        return type(e).__name__
+
+    if response.ok:
+        return None
+    return f"HTTP {response.status_code}"
+
+
+def _sweep_outboxes():
+    # An event pushed while a delivery job was finishing is not picked up by that job
+    for webhook in frappe.cache.smembers(PENDING_KEY):
+        webhook = frappe.safe_decode(webhook)
+        if frappe.cache.llen(OUTBOX_KEY.format(webhook)):
+            _enqueue_delivery(webhook)
+        else:
+            frappe.cache.srem(PENDING_KEY, webhook)
+
+
+def _schedule(batch, delay):
+    frappe.cache.hset(frappe.cache.make_key(BATCHES_KEY), batch["id"], batch, shared=True)
+    frappe.cache.zadd(frappe.cache.make_key(RETRY_KEY), {batch["id"]: time.time() + delay})
+
+
+def _dead_letter(webhook, batch):
+    frappe.get_doc({
+        "doctype": DEAD_LETTER_DOCTYPE,
+        "webhook": webhook.name,
+        "whatsapp_customer": webhook.whatsapp_customer,
+        "status": "Failed",
+        "attempts": batch["attempts"],
+        "event_count": len(batch["events"]),
+        "last_error": batch.get("error"),
+        "payload": json.dumps(batch["events"], default=str),
+    }).insert(ignore_permissions=True)
+    frappe.db.commit()
+
+
+def _enqueue_delivery(webhook, customer=None):
+    # One waiting delivery job per webhook, fair-queued by customer; events that
+    # arrive meanwhile ride along. The key is released when the job starts.
+    dispatcher.submit(
+        customer or frappe.db.get_value(DOCTYPE, webhook, "whatsapp_customer"),
+        "whatsapp_saas.api.webhooks.deliver",
+        queue="short",
+        timeout=300,
+        dedupe_key=f"webhook_delivery:{webhook}",
+        webhook=webhook,
+    )
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=50, pool_maxsize=cint(frappe.conf.get("whatsapp_webhook_pool_size")) or 10
+        )
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
@@ -5,103 +5,92 @@ app_description = "WhatsApp SaaS Management"
 app_email = "admin@example.com"
 app_license = "mit"
 
+from whatsapp_saas.api.routes import whitelisted_methods as _route_methods
+
+# Scheduled Tasks
+# ---------------
+scheduler_events = {
+	"cron": {
+		# Every minute. "all" would follow scheduler_interval (240s by default), too slow for
+		# retry timing, lost-job recovery and the replica health TTL.
+		"* * * * *": [
+			"whatsapp_saas.api.webhooks.process_retries",
+			"whatsapp_saas.api.receipts.flush",
+			"whatsapp_saas.api.usage.flush",
+			"whatsapp_saas.api.dispatcher.pump_all",
+			"whatsapp_saas.api.replica.check_lag",
+			# One short pass per tick; due messages go out within about a minute
+			"whatsapp_saas.api.scheduled.drain",
+		],
+	},
+	"hourly_long": [
+		"whatsapp_saas.api.columnar.export_message_logs",
+	],
+	"daily": [
+		"whatsapp_saas.api.subscriptions.process_subscription_lifecycle",
+		"whatsapp_saas.api.eventlog.purge_error_log_spam",
+	],
+}
+
+# Request and Job Events
+# ----------------------
+
+# Read-replica connections are opened per request or job on first use
+after_request = ["whatsapp_saas.api.replica.close"]
+after_job = ["whatsapp_saas.api.replica.close"]
+
 # Overriding Methods
 # ------------------------------
-# All WhatsApp API endpoints whitelisted with short names (using underscores)
+# All WhatsApp API endpoints whitelisted with short names (using underscores).
+# Plain proxy routes are generated from whatsapp_saas.api.routes.ROUTES.
 override_whitelisted_methods = {
 	# Onboarding & Account Management
 	"onboard": "whatsapp_saas.api.api.signup",
+	"onboard_bulk": "whatsapp_saas.api.api.bulk_signup",
+	"onboard_bulk_status": "whatsapp_saas.api.api.bulk_signup_status",
 	"whatsapp.webhook": "whatsapp_saas.api.api.webhook",
 	
 	# Instance Management
 	"instance_create": "whatsapp_saas.api.endpoints.instance_create",
-	"instance_list": "whatsapp_saas.api.endpoints.instance_list",
-	"instance_get": "whatsapp_saas.api.endpoints.instance_get",
 	"instance_qr": "whatsapp_saas.api.endpoints.instance_qr",
 	"instance_status": "whatsapp_saas.api.endpoints.instance_status",
-	"instance_delete": "whatsapp_saas.api.endpoints.instance_delete",
+	"instance_status_bulk": "whatsapp_saas.api.endpoints.instance_status_bulk",
 	"instance_logout": "whatsapp_saas.api.endpoints.instance_logout",
 	
-	# Core Messaging
-	"send_text": "whatsapp_saas.api.endpoints.send_text",
-	"send_media": "whatsapp_saas.api.endpoints.send_media",
-	"send_location": "whatsapp_saas.api.endpoints.send_location",
-	"send_reaction": "whatsapp_saas.api.endpoints.send_reaction",
-	"message_delete": "whatsapp_saas.api.endpoints.delete_message",
+	# Usage
+	"concurrency_usage": "whatsapp_saas.api.endpoints.concurrency_usage",
+	"usage_analytics": "whatsapp_saas.api.endpoints.usage_analytics",
+	"recent_payloads": "whatsapp_saas.api.endpoints.recent_payloads",
+	"baileys_metrics": "whatsapp_saas.api.endpoints.baileys_metrics",
+	"replica_status": "whatsapp_saas.api.endpoints.replica_status",
 	
-	# Enhanced Messaging
-	"send_reply": "whatsapp_saas.api.endpoints.send_reply",
-	"send_mention": "whatsapp_saas.api.endpoints.send_mention",
-	"message_forward": "whatsapp_saas.api.endpoints.forward_message",
-	"message_edit": "whatsapp_saas.api.endpoints.edit_message",
-	"message_pin": "whatsapp_saas.api.endpoints.pin_message",
-	"message_unpin": "whatsapp_saas.api.endpoints.unpin_message",
-	"send_viewonce": "whatsapp_saas.api.endpoints.send_viewonce",
-	"send_poll": "whatsapp_saas.api.endpoints.send_poll",
+	# Webhooks
+	"webhook_subscribe": "whatsapp_saas.api.endpoints.webhook_subscribe",
+	"webhook_list": "whatsapp_saas.api.endpoints.webhook_list",
+	"webhook_unsubscribe": "whatsapp_saas.api.endpoints.webhook_unsubscribe",
+	"webhook_dead_letters": "whatsapp_saas.api.endpoints.webhook_dead_letters",
+	"webhook_requeue": "whatsapp_saas.api.endpoints.webhook_requeue",
 	
-	# Media Operations
-	"media_download": "whatsapp_saas.api.endpoints.download_media",
+	# Media Store
+	"media_upload": "whatsapp_saas.api.endpoints.media_upload",
 	"media_thumbnail": "whatsapp_saas.api.endpoints.generate_thumbnail",
 	"media_optimize": "whatsapp_saas.api.endpoints.optimize_image",
+	"media_batch": "whatsapp_saas.api.endpoints.process_media_batch",
 	
-	# Chat Management
-	"chat_archive": "whatsapp_saas.api.endpoints.archive_chat",
-	"chat_mute": "whatsapp_saas.api.endpoints.mute_chat",
-	"chat_read": "whatsapp_saas.api.endpoints.mark_read",
-	"chat_pin": "whatsapp_saas.api.endpoints.pin_chat",
-	"chat_delete": "whatsapp_saas.api.endpoints.delete_chat",
-	"chat_star": "whatsapp_saas.api.endpoints.star_message",
-	"chat_disappearing": "whatsapp_saas.api.endpoints.set_disappearing",
-	"chat_history": "whatsapp_saas.api.endpoints.chat_history",
-	
-	# Presence & Status
-	"presence_update": "whatsapp_saas.api.endpoints.update_presence",
-	"presence_typing": "whatsapp_saas.api.endpoints.set_typing",
-	"presence_online": "whatsapp_saas.api.endpoints.set_online",
-	
-	# Profile Management
-	"profile_name": "whatsapp_saas.api.endpoints.update_name",
-	"profile_status": "whatsapp_saas.api.endpoints.update_status",
-	"profile_picture_update": "whatsapp_saas.api.endpoints.update_picture",
-	"profile_picture_get": "whatsapp_saas.api.endpoints.get_picture",
+	# Scheduled Messages
+	"scheduled_list": "whatsapp_saas.api.endpoints.scheduled_list",
+	"scheduled_cancel": "whatsapp_saas.api.endpoints.scheduled_cancel",
+	"scheduled_reschedule": "whatsapp_saas.api.endpoints.scheduled_reschedule",
 	
-	# Privacy Settings
-	"privacy_block": "whatsapp_saas.api.endpoints.block_user",
-	"privacy_unblock": "whatsapp_saas.api.endpoints.unblock_user",
-	"privacy_blocklist": "whatsapp_saas.api.endpoints.get_blocklist",
-	"privacy_update": "whatsapp_saas.api.endpoints.update_privacy",
-	"privacy_get": "whatsapp_saas.api.endpoints.get_privacy",
+	# Delivery Status
+	"message_status": "whatsapp_saas.api.endpoints.message_status",
 	
-	# Broadcast & Stories
-	"broadcast_send": "whatsapp_saas.api.endpoints.send_broadcast",
-	"status_send": "whatsapp_saas.api.endpoints.send_status",
-	
-	# Group Management
-	"group_create": "whatsapp_saas.api.endpoints.create_group",
-	"group_list": "whatsapp_saas.api.endpoints.list_groups",
-	"group_get": "whatsapp_saas.api.endpoints.get_group",
-	"group_subject": "whatsapp_saas.api.endpoints.update_group_subject",
-	"group_description": "whatsapp_saas.api.endpoints.update_group_description",
-	"group_participants": "whatsapp_saas.api.endpoints.group_participants",
-	"group_leave": "whatsapp_saas.api.endpoints.leave_group",
-	"group_invite": "whatsapp_saas.api.endpoints.get_invite_code",
-	
-	# Utilities
-	"utils_check": "whatsapp_saas.api.endpoints.check_number",
-	"utils_validate": "whatsapp_saas.api.endpoints.validate_jid",
-	"utils_format": "whatsapp_saas.api.endpoints.format_number",
-	"utils_device": "whatsapp_saas.api.endpoints.device_info",
-	
-	# Advanced Features
-	"advanced_link": "whatsapp_saas.api.endpoints.send_link_preview",
-	"advanced_sticker": "whatsapp_saas.api.endpoints.send_sticker",
+	# Message Store
+	"chat_history": "whatsapp_saas.api.endpoints.chat_history",
+	"messages_get": "whatsapp_saas.api.endpoints.get_messages",
 	"advanced_search": "whatsapp_saas.api.endpoints.search_messages",
 	"advanced_export": "whatsapp_saas.api.endpoints.export_chat",
+	"advanced_export_status": "whatsapp_saas.api.endpoints.export_status",
 	
-	# Health & Monitoring
-	"health": "whatsapp_saas.api.endpoints.health_check",
-	"messages_get": "whatsapp_saas.api.endpoints.get_messages",
-	
-	# Template & Buttons
-	"send_buttons": "whatsapp_saas.api.endpoints.send_template_buttons",
+	**_route_methods("whatsapp_saas.api.endpoints"),
 }
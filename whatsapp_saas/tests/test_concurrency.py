@@ -0,0 +1,64 @@
+# Copyright (c) 2026, Frappe Baileys and Contributors
+# See license.txt
+
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp_saas.api import concurrency
+
+
+class TestConcurrency(FrappeTestCase):
+	def setUp(self):
+		self.customer = f"_Test Customer {frappe.generate_hash(length=8)}"
+		self.wait = frappe.conf.get("whatsapp_concurrency_wait")
+		frappe.conf.whatsapp_concurrency_wait = 0.2
+
+	def tearDown(self):
+		frappe.conf.whatsapp_concurrency_wait = self.wait
+		frappe.cache.delete_value(concurrency.KEY.format(self.customer))
+
+	def test_slot_caps_concurrent_holders(self):
+		with patch.object(concurrency, "get_limit", return_value=2), ExitStack() as stack:
+			stack.enter_context(concurrency.slot(self.customer, "_Test Plan"))
+			stack.enter_context(concurrency.slot(self.customer, "_Test Plan"))
+			self.assertEqual(concurrency.in_flight(self.customer), 2)
+
+			with self.assertRaises(frappe.TooManyRequestsError):
+				with concurrency.slot(self.customer, "_Test Plan"):
+					pass
+
+		self.assertEqual(concurrency.in_flight(self.customer), 0)
+
+	def test_slot_is_released_when_the_block_raises(self):
+		with patch.object(concurrency, "get_limit", return_value=1):
+			with self.assertRaises(ValueError):
+				with concurrency.slot(self.customer, "_Test Plan"):
+					raise ValueError
+
+			with concurrency.slot(self.customer, "_Test Plan"):
+				self.assertEqual(concurrency.in_flight(self.customer), 1)
+
+	def test_unlimited_plan_takes_no_slot(self):
+		with patch.object(concurrency, "get_limit", return_value=0):
+			with concurrency.slot(self.customer, "_Test Plan"):
+				self.assertEqual(concurrency.in_flight(self.customer), 0)
+
+	def test_expired_lease_frees_its_slot(self):
+		name = concurrency.KEY.format(self.customer)
+		self.assertTrue(concurrency.try_acquire(name, 1, 0.5))
+		self.assertIsNone(concurrency.try_acquire(name, 1, 0.5))
+
+		time.sleep(0.6)
+		self.assertTrue(concurrency.try_acquire(name, 1, 0.5))
+
+	def test_slots_takes_only_free_slots(self):
+		with patch.object(concurrency, "get_limit", return_value=3):
+			with concurrency.slot(self.customer, "_Test Plan"):
+				with concurrency.slots(self.customer, "_Test Plan", 5) as width:
+					self.assertEqual(width, 2)
+					self.assertEqual(concurrency.in_flight(self.customer), 3)
+				self.assertEqual(concurrency.in_flight(self.customer), 1)
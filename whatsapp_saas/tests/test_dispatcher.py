@@ -0,0 +1,114 @@
+# Copyright (c) 2026, Frappe Baileys and Contributors
+# See license.txt
+
+from collections import Counter
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp_saas.api import dispatcher
+
+WEIGHTS = {"_Test Large": 2, "_Test Small": 1}
+ran_as = []
+
+
+def record_user(**kwargs):
+	ran_as.append(frappe.session.user)
+
+
+class TestDispatcher(FrappeTestCase):
+	def setUp(self):
+		self.queue = f"_test_{frappe.generate_hash(length=8)}"
+		self.limits = frappe.conf.get("whatsapp_dispatch_in_flight")
+		frappe.conf.whatsapp_dispatch_in_flight = {self.queue: 6}
+
+		for target, kwargs in (
+			("frappe.enqueue", {}),
+			("whatsapp_saas.api.dispatcher.get_weight", {"side_effect": WEIGHTS.get}),
+		):
+			patcher = patch(target, **kwargs)
+			setattr(self, target.rsplit(".", 1)[1], patcher.start())
+			self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		frappe.conf.whatsapp_dispatch_in_flight = self.limits
+		keys = [dispatcher.QUEUE_KEY.format(self.queue, customer) for customer in WEIGHTS]
+		keys += [
+			key.format(self.queue)
+			for key in (dispatcher.ACTIVE_KEY, dispatcher.INFLIGHT_KEY, dispatcher.STATE_KEY, dispatcher.PUMP_REQUESTED_KEY)
+		]
+		frappe.cache.delete_value(keys)
+
+	def _submit(self, customer, count):
+		# Queue everything before the first pump, as a backlog would be
+		with patch.object(dispatcher, "pump"):
+			for i in range(count):
+				dispatcher.submit(customer, "frappe._dict", queue=self.queue, timeout=60, n=i)
+
+	def _released(self):
+		return Counter(call.kwargs["customer"] for call in self.enqueue.call_args_list)
+
+	def test_release_is_weighted_by_plan(self):
+		self._submit("_Test Large", 10)
+		self._submit("_Test Small", 10)
+
+		dispatcher.pump(self.queue)
+
+		self.assertEqual(self._released(), {"_Test Large": 4, "_Test Small": 2})
+		self.assertEqual(
+			dispatcher.stats(self.queue), {"in_flight": 6, "waiting": {"_Test Large": 6, "_Test Small": 8}}
+		)
+
+	def test_jobs_of_one_customer_keep_their_order(self):
+		self._submit("_Test Small", 3)
+
+		dispatcher.pump(self.queue)
+
+		self.assertEqual([call.kwargs["spec"]["kwargs"]["n"] for call in self.enqueue.call_args_list], [0, 1, 2])
+
+	def test_finished_job_frees_its_slot(self):
+		frappe.conf.whatsapp_dispatch_in_flight = {self.queue: 1}
+		self._submit("_Test Small", 2)
+
+		dispatcher.pump(self.queue)
+		self.assertEqual(self.enqueue.call_count, 1)
+
+		first = self.enqueue.call_args.kwargs
+		dispatcher.execute(self.queue, first["customer"], first["spec"])
+
+		self.assertEqual(self.enqueue.call_count, 2)
+		self.assertEqual(self.enqueue.call_args.kwargs["spec"]["kwargs"]["n"], 1)
+
+	def test_job_runs_as_the_submitting_user(self):
+		ran_as.clear()
+		self.addCleanup(frappe.set_user, "Administrator")
+
+		frappe.set_user("test@example.com")
+		with patch.object(dispatcher, "pump"):
+			dispatcher.submit("_Test Small", "whatsapp_saas.tests.test_dispatcher.record_user", queue=self.queue)
+
+		frappe.set_user("test1@example.com")
+		dispatcher.pump(self.queue)
+		released = self.enqueue.call_args.kwargs
+
+		frappe.set_user("Administrator")
+		dispatcher.execute(self.queue, released["customer"], released["spec"])
+
+		self.assertEqual(ran_as, ["test@example.com"])
+		self.assertEqual(frappe.session.user, "Administrator")
+
+	def test_pop_retires_an_empty_customer(self):
+		self._submit("_Test Small", 1)
+
+		self.assertIsNotNone(dispatcher._pop(self.queue, "_Test Small"))
+		self.assertIsNone(dispatcher._pop(self.queue, "_Test Small"))
+		self.assertFalse(frappe.cache.smembers(dispatcher.ACTIVE_KEY.format(self.queue)))
+
+	def test_dedupe_key_queues_once(self):
+		with patch.object(dispatcher, "pump"):
+			for _i in range(3):
+				dispatcher.submit("_Test Small", "frappe._dict", queue=self.queue, dedupe_key=self.queue)
+		self.addCleanup(frappe.cache.delete, frappe.cache.make_key(dispatcher.DEDUPE_KEY.format(self.queue)))
+
+		self.assertEqual(dispatcher.stats(self.queue)["waiting"], {"_Test Small": 1})
@@ -0,0 +1,131 @@
+# Copyright (c) 2026, Frappe Baileys and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp_saas.api import receipts
+
+
+def _raw_hash(key):
+	return frappe.cache.pipeline().hgetall(frappe.cache.make_key(key)).execute()[0]
+
+
+def _receipt(message_id, status):
+	return {"key": {"id": message_id}, "update": {"status": status}}
+
+
+class TestReceipts(FrappeTestCase):
+	def setUp(self):
+		self.instance = f"_Test Instance {frappe.generate_hash(length=8)}"
+		self.logs = []
+		self._clear_keys()
+		enqueue = patch("frappe.enqueue")
+		enqueue.start()
+		self.addCleanup(enqueue.stop)
+
+	def tearDown(self):
+		self._clear_keys()
+		frappe.db.delete(receipts.LOG_DOCTYPE, {"name": ["in", self.logs or [""]]})
+		frappe.db.commit()
+
+	def _clear_keys(self):
+		pipe = frappe.cache.pipeline()
+		for key in (receipts.PENDING_KEY, receipts.PROCESSING_KEY, receipts.ATTEMPTS_KEY):
+			pipe.delete(frappe.cache.make_key(key))
+		pipe.execute()
+
+	def _log(self, message_id, status="Sent"):
+		doc = frappe.get_doc({
+			"doctype": receipts.LOG_DOCTYPE,
+			"name": frappe.generate_hash(length=10),
+			"instance": self.instance,
+			"direction": "Outbound",
+			"message_id": message_id,
+			"status": status,
+		})
+		doc.db_insert()
+		frappe.db.commit()
+		self.logs.append(doc.name)
+		return doc.name
+
+	def _status(self, name):
+		return frappe.db.get_value(receipts.LOG_DOCTYPE, name, "status")
+
+	def test_flush_only_moves_statuses_forward(self):
+		sent = self._log("m-sent")
+		read = self._log("m-read", "Read")
+		failed = self._log("m-failed", "Failed")
+
+		receipts.record_updates(self.instance, [
+			_receipt("m-sent", 3),
+			_receipt("m-sent", 4),
+			_receipt("m-read", "DELIVERY_ACK"),
+			_receipt("m-failed", 3),
+		])
+		receipts.flush()
+
+		self.assertEqual(self._status(sent), "Read")
+		self.assertEqual(self._status(read), "Read")
+		self.assertEqual(self._status(failed), "Failed")
+		self.assertFalse(_raw_hash(receipts.PROCESSING_KEY))
+		self.assertFalse(_raw_hash(receipts.PENDING_KEY))
+
+	def test_sent_receipts_alone_flush_cleanly(self):
+		sent = self._log("m-sent")
+
+		receipts.record_updates(self.instance, [_receipt("m-sent", 2), _receipt("m-unknown", "SERVER_ACK")])
+		receipts.flush()
+
+		self.assertEqual(self._status(sent), "Sent")
+		self.assertFalse(_raw_hash(receipts.PROCESSING_KEY))
+		self.assertFalse(_raw_hash(receipts.PENDING_KEY))
+
+	def test_receipt_waits_for_its_log_row(self):
+		receipts.record_updates(self.instance, [_receipt("m-late", 3)])
+		receipts.flush()
+		self.assertEqual(len(_raw_hash(receipts.PENDING_KEY)), 1)
+
+		late = self._log("m-late")
+		receipts.flush()
+
+		self.assertEqual(self._status(late), "Delivered")
+		self.assertFalse(_raw_hash(receipts.PENDING_KEY))
+		self.assertFalse(_raw_hash(receipts.ATTEMPTS_KEY))
+
+	def test_unmatched_receipt_is_dropped_after_max_attempts(self):
+		receipts.record_updates(self.instance, [_receipt("m-never", 3)])
+
+		with patch.object(receipts, "MAX_ATTEMPTS", 2):
+			receipts.flush()
+			receipts.flush()
+			self.assertEqual(len(_raw_hash(receipts.PENDING_KEY)), 1)
+			receipts.flush()
+
+		self.assertFalse(_raw_hash(receipts.PENDING_KEY))
+		self.assertFalse(_raw_hash(receipts.ATTEMPTS_KEY))
+
+	def test_leftover_processing_batch_is_applied_first(self):
+		stranded = self._log("m-stranded")
+		fresh = self._log("m-fresh")
+		field = f"{self.instance}{receipts._SEPARATOR}m-stranded"
+		frappe.cache.pipeline().hset(frappe.cache.make_key(receipts.PROCESSING_KEY), field, 2).execute()
+		receipts.record_updates(self.instance, [_receipt("m-fresh", 3)])
+
+		receipts.flush()
+		self.assertEqual(self._status(stranded), "Delivered")
+		self.assertEqual(self._status(fresh), "Sent")
+
+		receipts.flush()
+		self.assertEqual(self._status(fresh), "Delivered")
+
+	def test_get_statuses_includes_unflushed_receipts(self):
+		self._log("m-sent")
+		receipts.record_updates(self.instance, [_receipt("m-sent", 4)])
+
+		statuses = receipts.get_statuses(self.instance, ["m-sent"])
+
+		self.assertEqual(statuses["m-sent"]["status"], "Read")
+		self.assertTrue(statuses["m-sent"]["pending"])
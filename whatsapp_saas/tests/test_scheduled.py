@@ -0,0 +1,116 @@
+# Copyright (c) 2026, Frappe Baileys and Contributors
+# See license.txt
+
+import json
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, add_to_date, now_datetime
+
+from whatsapp_saas.api import scheduled
+
+
+class TestScheduled(FrappeTestCase):
+	def setUp(self):
+		self.names = []
+		submit = patch.object(scheduled.dispatcher, "submit")
+		self.submit = submit.start()
+		self.addCleanup(submit.stop)
+
+	def tearDown(self):
+		frappe.db.delete(scheduled.DOCTYPE, {"name": ["in", self.names or [""]]})
+		frappe.db.commit()
+
+	def _message(self, status, modified=None, **values):
+		doc = frappe.get_doc({
+			"doctype": scheduled.DOCTYPE,
+			"name": frappe.generate_hash(length=10),
+			"instance": "_Test Instance",
+			"whatsapp_customer": "_Test Customer",
+			"route": "send_text",
+			"status": status,
+			"send_at": now_datetime(),
+			"dispatch_at": add_to_date(now_datetime(), minutes=-1),
+			"payload": json.dumps({"instance_id": "_test", "jid": "15550001111", "text": "hi"}),
+			**values,
+		})
+		doc.db_insert()
+		if modified:
+			frappe.db.set_value(scheduled.DOCTYPE, doc.name, "modified", modified, update_modified=False)
+		frappe.db.commit()
+		self.names.append(doc.name)
+		return doc.name
+
+	def _get(self, name):
+		return frappe.db.get_value(scheduled.DOCTYPE, name, ["status", "error", "retries", "dispatch_at"], as_dict=True)
+
+	def test_plan_spreads_past_times_from_now(self):
+		now = now_datetime()
+		send_at, spread, dispatch_at = scheduled._plan(add_days(now, -1), 60)
+
+		self.assertEqual(spread, 60)
+		self.assertLess(send_at, now)
+		self.assertGreaterEqual(dispatch_at, now)
+		self.assertLessEqual(dispatch_at, add_to_date(now_datetime(), seconds=60))
+
+	def test_plan_rejects_bad_input(self):
+		for send_at, spread in (
+			(add_days(now_datetime(), scheduled.MAX_HORIZON_DAYS + 1), None),
+			(now_datetime(), scheduled.MAX_SPREAD + 1),
+			(now_datetime(), -1),
+			("not a time", None),
+		):
+			with self.assertRaises(frappe.ValidationError):
+				scheduled._plan(send_at, spread)
+
+	def test_drain_releases_due_messages_once(self):
+		due = self._message("Scheduled")
+		later = self._message("Scheduled", dispatch_at=add_to_date(now_datetime(), hours=1))
+
+		scheduled.drain()
+		scheduled.drain()
+
+		self.assertEqual(self._get(due).status, "Queued")
+		self.assertEqual(self._get(later).status, "Scheduled")
+		released = [call.kwargs["name"] for call in self.submit.call_args_list]
+		self.assertEqual(released.count(due), 1)
+		self.assertNotIn(later, released)
+
+	def test_drain_fails_stuck_sends_without_resending(self):
+		stuck = self._message("Sending", modified=add_to_date(now_datetime(), seconds=-scheduled.SENDING_TIMEOUT - 60))
+		sending = self._message("Sending", modified=now_datetime())
+
+		scheduled.drain()
+
+		stuck = self._get(stuck)
+		self.assertEqual(stuck.status, "Failed")
+		self.assertTrue(stuck.error.startswith("Outcome unknown"))
+		self.assertEqual(self._get(sending).status, "Sending")
+		self.assertFalse(self.submit.called)
+
+	def test_busy_send_is_retried_a_bounded_number_of_times(self):
+		busy = patch.object(scheduled.gateway, "authorize", side_effect=frappe.TooManyRequestsError)
+		busy.start()
+		self.addCleanup(busy.stop)
+
+		retried = self._message("Queued")
+		scheduled.send(retried)
+		row = self._get(retried)
+		self.assertEqual((row.status, row.retries), ("Scheduled", 1))
+		self.assertGreater(row.dispatch_at, now_datetime())
+
+		exhausted = self._message("Queued", retries=scheduled.MAX_RETRIES)
+		scheduled.send(exhausted)
+		row = self._get(exhausted)
+		self.assertEqual(row.status, "Failed")
+		self.assertIn("busy", row.error)
+
+	def test_send_skips_messages_no_longer_queued(self):
+		cancelled = self._message("Cancelled")
+
+		with patch.object(scheduled.gateway, "call_route") as call_route:
+			scheduled.send(cancelled)
+
+		call_route.assert_not_called()
+		self.assertEqual(self._get(cancelled).status, "Cancelled")
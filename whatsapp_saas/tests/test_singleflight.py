@@ -0,0 +1,65 @@
+# Copyright (c) 2026, Frappe Baileys and Contributors
+# See license.txt
+
+from unittest.mock import Mock
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp_saas.api import singleflight
+
+
+class TestSingleFlight(FrappeTestCase):
+	def setUp(self):
+		self.key = f"_test:{frappe.generate_hash(length=8)}"
+		self.flight_key = frappe.cache.make_key(singleflight.FLIGHT_KEY.format(self.key))
+
+	def tearDown(self):
+		frappe.cache.delete(self.flight_key)
+
+	def _in_flight(self, flight, result=None, ex=30):
+		# A leader on another worker that has not landed yet
+		frappe.cache.set(self.flight_key, flight, ex=ex)
+		if result is not None:
+			frappe.cache.set_value(singleflight.RESULT_KEY.format(self.key, flight), result, expires_in_sec=10)
+
+	def test_leader_runs_the_call_and_lands(self):
+		fn = Mock(return_value={"ok": True})
+
+		self.assertEqual(singleflight.run(self.key, fn), {"ok": True})
+		fn.assert_called_once()
+		self.assertIsNone(frappe.cache.get(self.flight_key))
+
+	def test_leader_lands_when_the_call_raises(self):
+		with self.assertRaises(ValueError):
+			singleflight.run(self.key, Mock(side_effect=ValueError("boom")))
+		self.assertIsNone(frappe.cache.get(self.flight_key))
+
+	def test_follower_shares_the_leaders_result(self):
+		self._in_flight("leader", {"ok": True})
+		fn = Mock()
+
+		self.assertEqual(singleflight.run(self.key, fn, timeout=2), {"ok": True})
+		fn.assert_not_called()
+
+	def test_follower_shares_the_leaders_error(self):
+		self._in_flight("leader", singleflight._Raised(ValueError("boom")))
+		fn = Mock()
+
+		with self.assertRaises(ValueError):
+			singleflight.run(self.key, fn, timeout=2)
+		fn.assert_not_called()
+
+	def test_follower_runs_the_call_when_the_leader_vanishes(self):
+		self._in_flight("leader", ex=1)
+		fn = Mock(return_value="own")
+
+		self.assertEqual(singleflight.run(self.key, fn, timeout=5), "own")
+		fn.assert_called_once()
+
+	def test_follower_gives_up_waiting_after_timeout(self):
+		self._in_flight("leader")
+		fn = Mock(return_value="own")
+
+		self.assertEqual(singleflight.run(self.key, fn, timeout=0.3), "own")
+		fn.assert_called_once()
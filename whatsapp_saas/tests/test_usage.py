@@ -0,0 +1,81 @@
+# Copyright (c) 2026, Frappe Baileys and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import get_datetime
+
+from whatsapp_saas.api import messages, usage
+
+
+class TestUsage(FrappeTestCase):
+	def setUp(self):
+		self.instance = f"_Test Instance {frappe.generate_hash(length=8)}"
+		self._clear_keys()
+
+	def tearDown(self):
+		self._clear_keys()
+		frappe.db.delete(usage.DOCTYPE, {"instance": self.instance})
+		frappe.db.delete(messages.DOCTYPE, {"instance": self.instance})
+		frappe.db.commit()
+
+	def _clear_keys(self):
+		pipe = frappe.cache.pipeline()
+		for key in (usage.PENDING_KEY, usage.PROCESSING_KEY):
+			pipe.delete(frappe.cache.make_key(key))
+		pipe.execute()
+
+	def _bucket(self, granularity):
+		return frappe.db.get_value(
+			usage.DOCTYPE,
+			{"instance": self.instance, "granularity": granularity},
+			["sent", "failed", "inbound"],
+			as_dict=True,
+		)
+
+	def test_flush_folds_counters_into_every_granularity(self):
+		at = get_datetime("2026-03-14 15:09:26")
+		usage.record_usage(self.instance, "sent", 3, at=at)
+		usage.record_usage(self.instance, "failed", at=at)
+		usage.flush()
+		usage.record_usage(self.instance, "sent", 2, at=at)
+		usage.flush()
+
+		for granularity in usage.GRANULARITIES:
+			self.assertEqual(self._bucket(granularity), {"sent": 5, "failed": 1, "inbound": 0})
+		self.assertEqual(
+			frappe.db.get_value(usage.DOCTYPE, {"instance": self.instance, "granularity": "Hour"}, "bucket_start"),
+			get_datetime("2026-03-14 15:00:00"),
+		)
+		self.assertFalse(frappe.cache.pipeline().exists(frappe.cache.make_key(usage.PROCESSING_KEY)).execute()[0])
+
+	def test_failed_flush_keeps_its_counters(self):
+		usage.record_usage(self.instance, "sent", 4)
+
+		with patch("frappe.db.sql", side_effect=RuntimeError("database unavailable")):
+			with self.assertRaises(RuntimeError):
+				usage.flush()
+		frappe.db.rollback()
+
+		usage.record_usage(self.instance, "sent", 1)
+		usage.flush()
+		self.assertEqual(self._bucket("Hour").sent, 4)
+
+		usage.flush()
+		self.assertEqual(self._bucket("Hour").sent, 5)
+
+	def test_redelivered_inbound_messages_are_counted_once(self):
+		payload = {"messages": [
+			{"key": {"id": f"in-{i}", "remoteJid": "15550001111@s.whatsapp.net", "fromMe": False}, "text": "hi"}
+			for i in range(3)
+		]}
+
+		with patch.object(messages, "record_usage") as record_usage:
+			messages.store_messages(self.instance, payload)
+			messages.store_messages(self.instance, payload)
+
+		self.assertEqual(record_usage.call_args_list[0].args, (self.instance, "inbound", 3))
+		self.assertEqual(record_usage.call_args_list[1].args, (self.instance, "inbound", 0))
+		self.assertEqual(frappe.db.count(messages.DOCTYPE, {"instance": self.instance}), 3)
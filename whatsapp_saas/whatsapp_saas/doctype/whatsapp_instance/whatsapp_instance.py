@@ -1,6 +1,6 @@
 import frappe
 from frappe.model.document import Document
-import requests
+from whatsapp_saas.api import baileys
 
 class WhatsAppInstance(Document):
     def before_insert(self):
@@ -35,12 +35,11 @@ class WhatsAppInstance(Document):
     def after_insert(self):
         try:
             user = frappe.session.user
-            url = "http://whatsapp-baileys:3000/api/instance/create"
             data = {
                 "name": self.instance_name
             }
 
-            response = requests.post(url, json=data, timeout=60)
+            response = baileys.request("POST", "instance/create", json=data, timeout=60)
             response_data = response.json()
             
             # Create instance record in Frappe
@@ -0,0 +1,10 @@
+import frappe
+from frappe.model.document import Document
+
+class WhatsAppMedia(Document):
+    pass
+
+
+def on_doctype_update():
+    # One handle per customer per content; the blob itself is shared on disk
+    frappe.db.add_unique("WhatsApp Media", ["whatsapp_customer", "content_hash"])
@@ -0,0 +1,16 @@
+import frappe
+from frappe.model.document import Document
+
+class WhatsAppMessage(Document):
+    pass
+
+
+def on_doctype_update():
+    # History pages walk (instance, chat, timestamp); get_messages walks (instance, timestamp)
+    frappe.db.add_index("WhatsApp Message", ["instance", "chat_jid", "timestamp"])
+    frappe.db.add_index("WhatsApp Message", ["instance", "timestamp"])
+
+    if frappe.db.db_type == "mariadb" and not frappe.db.sql(
+        "SHOW INDEX FROM `tabWhatsApp Message` WHERE Key_name = 'body_fulltext'"
+    ):
+        frappe.db.sql_ddl("ALTER TABLE `tabWhatsApp Message` ADD FULLTEXT INDEX body_fulltext (body)")
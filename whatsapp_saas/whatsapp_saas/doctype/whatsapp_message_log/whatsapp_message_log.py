@@ -1,5 +1,10 @@
 import frappe
 from frappe.model.document import Document
 
+from whatsapp_saas.api.usage import record_usage
+
 class WhatsAppMessageLog(Document):
-    pass
+    def after_insert(self):
+        # Feeds the usage buckets behind usage_analytics
+        if self.direction == "Outbound" and self.billable:
+            record_usage(self.instance, "failed" if self.status == "Failed" else "sent")
@@ -0,0 +1,10 @@
+import frappe
+from frappe.model.document import Document
+
+class WhatsAppScheduledMessage(Document):
+    pass
+
+
+def on_doctype_update():
+    # The drain loop reads due rows as (status = Scheduled, dispatch_at <= now)
+    frappe.db.add_index("WhatsApp Scheduled Message", ["status", "dispatch_at"])
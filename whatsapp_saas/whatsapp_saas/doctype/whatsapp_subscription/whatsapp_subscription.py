@@ -1,5 +1,13 @@
 import frappe
 from frappe.model.document import Document
 
+from whatsapp_saas.api.subscriptions import cache_subscription, is_active
+
 class WhatsAppSubscription(Document):
-    pass
+    def on_update(self):
+        # Status, plan and date changes reach the proxy path without waiting for the scheduler
+        active = is_active(self.status, self.end_date)
+        frappe.db.after_commit.add(lambda: cache_subscription(self.name, self.plan, active))
+
+    def on_trash(self):
+        frappe.db.after_commit.add(lambda: cache_subscription(self.name, self.plan, False))
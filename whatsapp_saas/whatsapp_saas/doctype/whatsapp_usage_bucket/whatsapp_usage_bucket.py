@@ -0,0 +1,10 @@
+import frappe
+from frappe.model.document import Document
+
+class WhatsAppUsageBucket(Document):
+    pass
+
+
+def on_doctype_update():
+    # Upserts key on (instance, granularity, bucket_start); series read ranges of it
+    frappe.db.add_unique("WhatsApp Usage Bucket", ["instance", "granularity", "bucket_start"])
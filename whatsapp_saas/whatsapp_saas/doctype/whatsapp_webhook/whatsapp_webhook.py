@@ -0,0 +1,23 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+from whatsapp_saas.api.webhooks import check_url, clear_subscriptions
+
+class WhatsAppWebhook(Document):
+    def validate(self):
+        if not self.url:
+            frappe.throw(_("URL is required"))
+        try:
+            check_url(self.url)
+        except ValueError as e:
+            frappe.throw(_("Invalid webhook URL: {0}").format(e))
+        if not self.secret:
+            self.secret = frappe.generate_hash(length=32)
+
+    def on_update(self):
+        # Event fan-out reads the per-customer list from Redis
+        frappe.db.after_commit.add(lambda: clear_subscriptions(self.whatsapp_customer))
+
+    def on_trash(self):
+        frappe.db.after_commit.add(lambda: clear_subscriptions(self.whatsapp_customer))